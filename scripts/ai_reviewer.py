@@ -1,18 +1,117 @@
 # scripts/ai_reviewer.py
+# Imports lourds (openai, pydantic, requests) différés : un run sans fichier à analyser n'utilise que git
+from __future__ import annotations
 import os
 import sys
 import subprocess
-import requests
-from openai import OpenAI # type: ignore
+import hashlib
+import re
+import time
+import random
+import threading
+import atexit
+import argparse
+import ipaddress
+from contextlib import contextmanager
+import ast
 import json
-from typing import List, Optional
-from pydantic import BaseModel, ValidationError, Field, field_validator
-from github import Github, GithubException
+from dataclasses import dataclass, field
+from functools import lru_cache
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, FIRST_COMPLETED, wait
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from ai_reviewer_models import ReviewReport
 
 # --- CONFIGURATION ---
 MODEL_NAME = "gpt-5.1-codex-mini"
-MAX_CONTENT_LENGTH = 80000  # Augmenté car les diffs sont plus compacts que le contenu complet
+MAX_PROMPT_TOKENS = int(os.environ.get("AI_REVIEW_MAX_PROMPT_TOKENS", "24000"))  # Prompt complet (système + consignes + diffs)
+OMITTED_SUMMARY_RESERVE_TOKENS = 1000  # Réservé au résumé des fichiers non inclus
 MAX_FILES_ANALYZED = 50
+PROMPT_VERSION = "3"  # À incrémenter à chaque modification du prompt (invalide le cache)
+
+# Cache des reviews (répertoire restaurable depuis le cache CI)
+REVIEW_CACHE_DIR = os.environ.get("AI_REVIEW_CACHE_DIR", ".ai-review-cache")
+REVIEW_CACHE_MAX_AGE_DAYS = 30
+REVIEW_CACHE_MAX_BYTES = 5 * 1024 * 1024
+
+# Review par morceaux des changements dépassant MAX_PROMPT_TOKENS
+CHUNKED_REVIEW = os.environ.get("AI_REVIEW_CHUNKED", "true").lower() == "true"
+MAX_PARALLEL_REVIEWS = int(os.environ.get("AI_REVIEW_MAX_PARALLEL", "4"))
+
+# Review incrémentale des PR : seuls les commits depuis la dernière review sont analysés
+INCREMENTAL_REVIEW = os.environ.get("AI_REVIEW_INCREMENTAL", "true").lower() == "true"
+REVIEW_STATE_MARKER = "ai-review:state"  # Commentaire HTML caché dans le commentaire de PR du bot
+REVIEW_BOT_LOGIN = os.environ.get("AI_REVIEW_BOT_LOGIN", "github-actions[bot]")  # Auteur des commentaires de review (GITHUB_TOKEN)
+
+# Lecture en flux des diffs : plafonds appliqués pendant la lecture de git, un fichier énorme n'est jamais chargé
+MAX_PATCH_BYTES_PER_FILE = int(os.environ.get("AI_REVIEW_MAX_FILE_BYTES", str(256 * 1024)))
+MAX_PATCH_BYTES_TOTAL = int(os.environ.get("AI_REVIEW_MAX_DIFF_BYTES", str(2 * 1024 * 1024)))
+DIFF_HEADER_PROBE_BYTES = 256  # Lecture minimale : assez pour reconnaître l'en-tête "diff --git" du fichier suivant
+# Au-delà de ce nombre de lignes modifiées (numstat), le fichier est décrit sans que son diff soit lu
+MAX_PATCH_LINES_PER_FILE = int(os.environ.get("AI_REVIEW_MAX_FILE_LINES", "3000"))
+
+# Push : plage before..after de l'événement, reviewée en un bloc (squash) ou commit par commit (per-commit)
+PUSH_REVIEW_MODE = os.environ.get("AI_REVIEW_PUSH_MODE", "squash").lower()
+MAX_PARALLEL_COMMITS = int(os.environ.get("AI_REVIEW_MAX_PARALLEL_COMMITS", "4"))
+MAX_COMMITS_REVIEWED = 20  # Commits les plus récents retenus en mode per-commit
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"  # Base du commit racine d'un dépôt
+
+# Compaction des diffs avant envoi (passes : whitespace, renames, literals, context)
+COMPACTION_PASSES = [p.strip() for p in os.environ.get("AI_REVIEW_COMPACTION", "whitespace,renames,literals,context").split(",") if p.strip()]
+COMPACTION_CONTEXT_LINES = int(os.environ.get("AI_REVIEW_CONTEXT_LINES", "1"))  # Contexte conservé autour des gros hunks
+COMPACTION_SMALL_HUNK_LINES = 3  # Hunks d'au plus 3 lignes modifiées : contexte git par défaut conservé
+COMPACTION_LITERAL_RUN = 20  # Lignes de données consécutives à partir desquelles elles sont résumées
+
+# Consommation en streaming de la Responses API (abandon anticipé des sorties hors schéma)
+STREAMING_REVIEW = os.environ.get("AI_REVIEW_STREAMING", "true").lower() == "true"
+
+# Sortie structurée (json_schema strict dérivé de ReviewReport), désactivée en cours de run si le modèle la refuse
+STRUCTURED_OUTPUT = os.environ.get("AI_REVIEW_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+# Ampleur du changement selon le nombre de lignes modifiées (None = sans plafond), annoncée au modèle
+CHANGE_MAGNITUDES = [
+    (10, "TRÈS PETIT (ajustement mineur)"),
+    (50, "PETIT (modification simple)"),
+    (200, "MOYEN (feature ou refactoring)"),
+    (None, "IMPORTANT (refactoring majeur ou nouvelle feature)"),
+]
+
+# Routage : type de fichiers puis niveau d'ampleur (index dans CHANGE_MAGNITUDES) → (modèle, effort de raisonnement)
+# "config" = uniquement styles et YAML ; les changements moyens et importants de code gardent le réglage complet
+MODEL_NAME_LIGHT = os.environ.get("AI_REVIEW_MODEL_LIGHT", MODEL_NAME)
+CONFIG_EXTENSIONS = ('.css', '.scss', '.yaml', '.yml')
+MODEL_ROUTES = {
+    "code": [(MODEL_NAME_LIGHT, "low"), (MODEL_NAME_LIGHT, "low"), (MODEL_NAME, "medium"), (MODEL_NAME, "medium")],
+    "config": [(MODEL_NAME_LIGHT, "low"), (MODEL_NAME_LIGHT, "low"), (MODEL_NAME_LIGHT, "low"), (MODEL_NAME, "medium")],
+}
+
+# Analyse locale préalable (ai_reviewer_analysis.py) : indices transmis au modèle sous forme de tableau
+PREPASS = os.environ.get("AI_REVIEW_PREPASS", "true").lower() == "true"
+PREPASS_EXTENSIONS = ('.py', '.ts', '.vue', '.js')
+PREPASS_WORKERS = int(os.environ.get("AI_REVIEW_PREPASS_WORKERS", str(min(os.cpu_count() or 1, 8))))
+PREPASS_POOL_MIN_LINES = 5000  # En dessous (ou sur un seul CPU), l'analyse reste dans le processus principal : démarrer le pool coûte ~0,2 s
+PREPASS_TIMEOUT = 5.0  # Au-delà, la review part sans indices
+PREPASS_MAX_FINDINGS = 25
+PREPASS_LOWERED_LEVELS = (2,)  # Ampleur MOYEN : effort medium → low quand les indices sont fournis
+
+# Contexte étendu : chaque hunk élargi à sa fonction (ou classe) englobante, dans la limite du budget de tokens restant
+FUNCTION_CONTEXT = os.environ.get("AI_REVIEW_FUNCTION_CONTEXT", "false").lower() == "true"
+FUNCTION_CONTEXT_EXTENSIONS = ('.py', '.ts', '.vue', '.js')
+FUNCTION_CONTEXT_MAX_LINES = int(os.environ.get("AI_REVIEW_FUNCTION_CONTEXT_LINES", "200"))  # Blocs plus longs : contexte git conservé
+MAX_BLOB_BYTES = 512 * 1024  # Fichiers plus gros ignorés par l'analyse locale et le contexte étendu
+
+# Diffs ne touchant que des espaces ou des commentaires : notés localement, sans appel à l'IA
+LOCAL_FAST_PATH = os.environ.get("AI_REVIEW_LOCAL_FAST_PATH", "true").lower() == "true"
+COMMENT_PREFIXES = {  # Commentaires de ligne
+    '.py': ('#',), '.yaml': ('#',), '.yml': ('#',),
+    '.php': ('//', '#'), '.ts': ('//',), '.js': ('//',), '.vue': ('//',), '.scss': ('//',),
+}
+BLOCK_COMMENTS = {  # Commentaires bloc (ouverture, fermeture) : une ligne "* ..." n'en est un qu'à l'intérieur
+    '.php': (('/*', '*/'),), '.ts': (('/*', '*/'),), '.js': (('/*', '*/'),),
+    '.vue': (('/*', '*/'), ('<!--', '-->')), '.css': (('/*', '*/'),), '.scss': (('/*', '*/'),),
+}
 
 # Patterns de fichiers à exclure de l'analyse
 EXCLUDED_PATTERNS = [
@@ -33,13 +132,33 @@ EXCLUDED_PATTERNS = [
     '*.generated.',
 ]
 
+# Extensions des fichiers analysés
+VALID_EXTENSIONS = ('.php', '.vue', '.ts', '.js', '.yaml', '.yml', '.css', '.scss', '.py')
+
 DISCORD_WEBHOOK = os.environ.get("DISCORD_WEBHOOK_URL")
 API_KEY = os.environ.get("OPENAI_API_KEY")
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 GITHUB_EVENT_NAME = os.environ.get("GITHUB_EVENT_NAME")
 GITHUB_BASE_REF = os.environ.get("GITHUB_BASE_REF")
 GITHUB_REPOSITORY = os.environ.get("GITHUB_REPOSITORY")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
 GITHUB_PR_NUMBER = os.environ.get("GITHUB_PR_NUMBER")
+GITHUB_HEAD_SHA = os.environ.get("GITHUB_HEAD_SHA")  # Tête de la PR (HEAD est le commit de merge)
+GITHUB_EVENT_BEFORE = os.environ.get("GITHUB_EVENT_BEFORE")  # Tête de la branche avant le push (zéros si nouvelle branche)
+GITHUB_SHA = os.environ.get("GITHUB_SHA")  # Tête de la branche après le push
+GITHUB_REF_NAME = os.environ.get("GITHUB_REF_NAME")  # Branche poussée
+
+# Mode service (`ai_reviewer.py serve`) : webhooks GitHub reçus en local, clients gardés chauds entre les reviews
+SERVICE_MAX_WORKERS = int(os.environ.get("AI_REVIEW_SERVICE_WORKERS", "2"))
+WEBHOOK_SECRET = os.environ.get("AI_REVIEW_WEBHOOK_SECRET")  # Secret du webhook GitHub (signature X-Hub-Signature-256)
+WEBHOOK_MAX_BODY_BYTES = 5 * 1024 * 1024
+PR_REVIEW_ACTIONS = ("opened", "synchronize", "reopened", "ready_for_review")
+
+# File d'envoi Discord : embeds regroupés par message, quota du webhook respecté, reliquat repris au run suivant
+DISCORD_MAX_EMBEDS_PER_MESSAGE = 10
+DISCORD_MAX_EMBED_CHARS_PER_MESSAGE = 6000  # Limite Discord sur le texte cumulé des embeds d'un message
+DISCORD_OUTBOX_FILE = "discord-outbox.jsonl"  # Dans REVIEW_CACHE_DIR (hors éviction du cache : pas en .json)
+DISCORD_OUTBOX_MAX_MESSAGES = 50
 
 # Mapping des auteurs Git vers les IDs Discord
 AUTHOR_DISCORD_MAP = {
@@ -48,204 +167,317 @@ AUTHOR_DISCORD_MAP = {
     "ethanolove": "556125496979619840"
 }
 
-# Initialisation du client OpenAI
-client = OpenAI(api_key=API_KEY)
-
-# --- VALIDATION SCHÉMA PYDANTIC ---
-class ReviewDetails(BaseModel):
-    SOLID: int = Field(ge=0, le=20)
-    Clarte: int = Field(ge=0, le=20)
-    Securite: int = Field(ge=0, le=20)
-    Performance: int = Field(ge=0, le=20)
-
-class ReviewReport(BaseModel):
-    score_global: int = Field(ge=0, le=20)
-    details: ReviewDetails
-    resume: str = Field(max_length=200)
-    points_forts: List[str] = Field(max_length=5)
-    points_faibles: List[str] = Field(max_length=5)
-    conseil_mentor: str = Field(max_length=300)
-    
-    @field_validator('points_forts', 'points_faibles')
-    @classmethod
-    def validate_list_items(cls, v):
-        if not v:
-            return ["Aucun point identifié"]
-        # Limite la longueur de chaque élément et sanitation
-        return [item[:150].strip() for item in v[:5]]
-    
-    @field_validator('resume', 'conseil_mentor')
-    @classmethod
-    def sanitize_text(cls, v):
-        # Supprime les caractères potentiellement problématiques
-        return v.replace('`', '').replace('*', '').strip()
-
-def should_analyze_file(filepath: str) -> bool:
-    """Vérifie si un fichier doit être analysé (filtre les fichiers exclus)"""
-    # Vérifie si le fichier existe
-    if not os.path.exists(filepath):
-        return False
-
-    # Vérifie les patterns d'exclusion
-    for pattern in EXCLUDED_PATTERNS:
-        # Pattern avec wildcard
-        if '*' in pattern:
-            extension = pattern.replace('*', '')
-            if filepath.endswith(extension):
-                return False
-        # Pattern de dossier
-        elif pattern.endswith('/'):
-            if pattern.rstrip('/') in filepath.split(os.sep):
-                return False
-        # Pattern exact
-        elif pattern in filepath:
-            return False
-
-    # Vérifie les extensions valides
-    valid_extensions = ('.php', '.vue', '.ts', '.js', '.yaml', '.yml', '.css', '.scss', '.py')
-    return filepath.endswith(valid_extensions)
-
-def get_changed_files():
-    """Récupère la liste des fichiers modifiés (contexte PR ou push)"""
-    try:
-        is_pr = GITHUB_EVENT_NAME == "pull_request"
-
-        if is_pr and GITHUB_BASE_REF:
-            # Pour une PR, comparer avec la branche de base
-            print(f"🔀 Contexte: Pull Request (base: {GITHUB_BASE_REF})")
-            base_branch = f"origin/{GITHUB_BASE_REF}"
-            result = subprocess.run(
-                ["git", "diff", "--name-only", base_branch, "HEAD"],
-                capture_output=True, text=True, check=True
-            )
-        else:
-            # Pour un push, comparer avec le commit précédent
-            print("📤 Contexte: Push direct")
-            result = subprocess.run(
-                ["git", "diff", "--name-only", "HEAD~1", "HEAD"],
-                capture_output=True, text=True, check=True
-            )
-
-        files = result.stdout.strip().split('\n')
-        files = [f for f in files if f]  # Supprime les lignes vides
-
-        # Applique les filtres intelligents
-        valid_files = [f for f in files if should_analyze_file(f)]
-
-        excluded_count = len(files) - len(valid_files)
-        if excluded_count > 0:
-            print(f"📋 {excluded_count} fichier(s) exclu(s) par les filtres")
-
-        if len(valid_files) > MAX_FILES_ANALYZED:
-            print(f"⚠️ Trop de fichiers modifiés ({len(valid_files)}). Limitation à {MAX_FILES_ANALYZED} fichiers.")
-            return valid_files[:MAX_FILES_ANALYZED]
-
-        return valid_files
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erreur lors de la récupération des fichiers: {e}")
-        return []
+# Politique de retry partagée (OpenAI, Discord, GitHub)
+RETRY_MAX_ATTEMPTS = int(os.environ.get("AI_REVIEW_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = 1.0  # Secondes, doublé à chaque essai
+RETRY_MAX_DELAY = 30.0
+RETRY_MAX_HEADER_DELAY = 120.0  # Plafond d'un délai imposé par Retry-After / X-RateLimit (sans échéance en backfill)
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+CIRCUIT_BREAKER_THRESHOLD = 5  # Échecs transitoires consécutifs (tous appels confondus) avant coupure du service
+CIRCUIT_BREAKER_COOLDOWN = 60.0
+BACKFILL_CIRCUIT_ATTEMPTS = 5  # Pauses du backfill sur circuit ouvert avant de compter le commit en échec
+HTTP_TIMEOUT = 10.0
+MODEL_TIMEOUT = 600.0  # Plafond d'un appel au modèle, même sans échéance globale (backfill)
+HTTP_POOL_SIZE = 16  # Connexions keep-alive conservées par hôte (notifications et reviews parallèles)
+RUN_TIME_BUDGET = float(os.environ.get("AI_REVIEW_TIME_BUDGET", "600"))  # Échéance globale du job CI
+RUN_DEADLINE = time.monotonic() + RUN_TIME_BUDGET
+
+# Mesures du run (durées, volumes, tokens, coût) écrites en JSON et dans le résumé du job CI
+METRICS_FILE = os.environ.get("AI_REVIEW_METRICS_FILE")
+GITHUB_STEP_SUMMARY = os.environ.get("GITHUB_STEP_SUMMARY")
+# Tarifs en USD par million de tokens : entrée, entrée en cache, sortie (raisonnement inclus)
+MODEL_PRICING = {
+    "gpt-5.1-codex-mini": (0.25, 0.025, 2.00),
+}
 
-def get_file_diff(filepath: str) -> str:
-    """Récupère le diff d'un fichier spécifique (contexte PR ou push)"""
-    try:
-        is_pr = GITHUB_EVENT_NAME == "pull_request"
-
-        if is_pr and GITHUB_BASE_REF:
-            base_branch = f"origin/{GITHUB_BASE_REF}"
-            result = subprocess.run(
-                ["git", "diff", base_branch, "HEAD", "--", filepath],
-                capture_output=True, text=True, check=True
-            )
-        else:
-            result = subprocess.run(
-                ["git", "diff", "HEAD~1", "HEAD", "--", filepath],
-                capture_output=True, text=True, check=True
-            )
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"⚠️ Erreur lors de la récupération du diff pour {filepath}: {e}")
-        return ""
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """Client OpenAI construit au premier appel (les retries sont gérés par call_with_retry)"""
+    from openai import OpenAI
+    return OpenAI(api_key=API_KEY, max_retries=0)
+
+# --- POLITIQUE DE RETRY ---
+class RetryableHTTPError(Exception):
+    """Réponse HTTP dont le code indique une erreur transitoire (429, 5xx...)"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code} sur {response.url}")
+        self.response = response
+        self.status_code = response.status_code
+
+class ModelOutputError(Exception):
+    """Sortie du modèle inexploitable (hors schéma, génération échouée) : un nouvel essai peut réussir"""
+
+class CircuitOpenError(Exception):
+    """Service coupé par le circuit breaker après trop d'échecs consécutifs"""
+
+# État du circuit breaker par service : [échecs consécutifs, instant d'ouverture]
+CIRCUIT_STATE: Dict[str, List[float]] = {}
+CIRCUIT_LOCK = threading.Lock()
+
+def remaining_time_budget() -> float:
+    """Secondes restantes avant l'échéance globale du run"""
+    return RUN_DEADLINE - time.monotonic()
+
+def get_error_status(error: Exception) -> Optional[int]:
+    """Code HTTP porté par une exception OpenAI ou requests"""
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def get_error_headers(error: Exception) -> Dict[str, str]:
+    """En-têtes HTTP de la réponse en erreur, clés en minuscules"""
+    headers = getattr(error, "headers", None)
+    if headers is None and getattr(error, "response", None) is not None:
+        headers = getattr(error.response, "headers", None)
+    return {str(k).lower(): str(v) for k, v in (headers or {}).items()}
+
+def is_retryable_error(error: Exception) -> bool:
+    """Distingue les erreurs transitoires (réseau, 429, 5xx, sortie invalide) des erreurs fatales"""
+    if isinstance(error, ModelOutputError):
+        return True
+    # Une exception de requests ou d'openai implique que le module est déjà chargé
+    requests_module = sys.modules.get("requests")
+    if requests_module and isinstance(error, (requests_module.exceptions.ConnectionError, requests_module.exceptions.Timeout)):
+        return True
+    openai_module = sys.modules.get("openai")
+    if openai_module and isinstance(error, openai_module.APIConnectionError):
+        return True
+    status = get_error_status(error)
+    return status in RETRYABLE_STATUS_CODES
 
-def get_file_stats(filepath: str) -> dict:
-    """Récupère les statistiques d'un fichier (lignes ajoutées/supprimées)"""
+def parse_duration(value: str) -> Optional[float]:
+    """Convertit une durée '12', '1.5', '20ms' ou '6m0s' en secondes"""
     try:
-        is_pr = GITHUB_EVENT_NAME == "pull_request"
-
-        if is_pr and GITHUB_BASE_REF:
-            base_branch = f"origin/{GITHUB_BASE_REF}"
-            result = subprocess.run(
-                ["git", "diff", "--numstat", base_branch, "HEAD", "--", filepath],
-                capture_output=True, text=True, check=True
-            )
-        else:
-            result = subprocess.run(
-                ["git", "diff", "--numstat", "HEAD~1", "HEAD", "--", filepath],
-                capture_output=True, text=True, check=True
-            )
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+def get_header_delay(headers: Dict[str, str], rate_limited: bool) -> Optional[float]:
+    """Délai annoncé par la réponse : Retry-After toujours, en-têtes de quota seulement sur un refus pour quota
+
+    OpenAI envoie x-ratelimit-reset-* sur toutes ses réponses : ailleurs qu'après un 429, ils ne disent rien de l'erreur."""
+    if "retry-after-ms" in headers:
+        delay = parse_duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    names = ("retry-after", "x-ratelimit-reset-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens") if rate_limited else ("retry-after",)
+    for name in names:
+        delay = parse_duration(headers.get(name, ""))
+        if delay is not None:
+            return delay
+    if "retry-after" in headers:
+        # Retry-After au format date HTTP
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    if rate_limited and headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+        # GitHub : timestamp epoch de réinitialisation du quota
+        try:
+            return max(float(headers["x-ratelimit-reset"]) - time.time(), 0)
+        except ValueError:
+            pass
+    return None
 
-        stats = result.stdout.strip().split('\t')
-        if len(stats) >= 2:
-            return {
-                "added": int(stats[0]) if stats[0] != '-' else 0,
-                "deleted": int(stats[1]) if stats[1] != '-' else 0
-            }
-    except (subprocess.CalledProcessError, ValueError) as e:
-        print(f"⚠️ Erreur stats pour {filepath}: {e}")
-    return {"added": 0, "deleted": 0}
+def get_retry_delay(error: Exception, attempt: int) -> float:
+    """Délai avant le prochain essai : en-têtes de rate limit si présents (plafonnés), sinon backoff exponentiel avec jitter"""
+    headers = get_error_headers(error)
+    status = get_error_status(error)
+    rate_limited = status == 429 or (status == 403 and headers.get("x-ratelimit-remaining") == "0")
+    delay = get_header_delay(headers, rate_limited)
+    if delay is not None:
+        return min(delay, RETRY_MAX_HEADER_DELAY)
+    return min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+
+def get_circuit_cooldown(service: str) -> float:
+    """Secondes avant que le circuit ouvert d'un service ne laisse repasser un appel (0 s'il est fermé)"""
+    with CIRCUIT_LOCK:
+        failures, opened_at = CIRCUIT_STATE.get(service, [0, 0.0])
+    if failures < CIRCUIT_BREAKER_THRESHOLD:
+        return 0.0
+    return max(CIRCUIT_BREAKER_COOLDOWN - (time.monotonic() - opened_at), 0.0)
+
+def call_with_retry(service: str, func, *args, **kwargs):
+    """Exécute un appel réseau avec retry, circuit breaker par service et échéance globale"""
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        with CIRCUIT_LOCK:
+            failures, opened_at = CIRCUIT_STATE.get(service, [0, 0.0])
+            if failures >= CIRCUIT_BREAKER_THRESHOLD and time.monotonic() - opened_at < CIRCUIT_BREAKER_COOLDOWN:
+                raise CircuitOpenError(f"{service} indisponible ({failures} échecs consécutifs)")
+
+        if remaining_time_budget() <= 0:
+            raise TimeoutError(f"Budget de temps du run épuisé ({RUN_TIME_BUDGET:.0f}s)")
 
-def get_commit_info():
-    """Récupère le message, le hash et l'auteur du dernier commit"""
+        try:
+            result = func(*args, **kwargs)
+            with CIRCUIT_LOCK:
+                CIRCUIT_STATE[service] = [0, 0.0]
+            return result
+        except Exception as e:
+            retryable = is_retryable_error(e)
+            if retryable:
+                with CIRCUIT_LOCK:
+                    failures = CIRCUIT_STATE.get(service, [0, 0.0])[0] + 1
+                    CIRCUIT_STATE[service] = [failures, time.monotonic()]
+
+            if not retryable or attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+
+            delay = get_retry_delay(e, attempt)
+            if delay >= remaining_time_budget():
+                print(f"⚠️ {service}: nouvel essai impossible dans le budget de temps restant")
+                raise
+            print(f"🔁 {service}: tentative {attempt + 1}/{RETRY_MAX_ATTEMPTS} échouée ({e}), nouvel essai dans {delay:.1f}s")
+            count_metric(f"retries_{service.lower()}")
+            time.sleep(delay)
+
+@lru_cache(maxsize=1)
+def get_http_session():
+    """Session HTTP partagée : connexions keep-alive réutilisées par Discord et GitHub"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    # Pas de retry au niveau du pool : géré par call_with_retry
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def http_request(method: str, url: str, **kwargs):
+    """Requête HTTP qui lève RetryableHTTPError sur les codes transitoires"""
+    kwargs.setdefault("timeout", min(HTTP_TIMEOUT, max(remaining_time_budget(), 1)))
+    response = get_http_session().request(method, url, **kwargs)
+    # GitHub signale un quota épuisé par un 403 : réessayé après la réinitialisation annoncée
+    rate_limited = response.status_code == 403 and response.headers.get("x-ratelimit-remaining") == "0"
+    if response.status_code in RETRYABLE_STATUS_CODES or rate_limited:
+        raise RetryableHTTPError(response)
+    return response
+
+# --- MESURES ---
+PHASE_TIMINGS: Dict[str, float] = {}
+RUN_METRICS: Dict[str, object] = {}  # Volumes et issue du run (fichiers, lignes, caractères, mode de review...)
+TOKEN_USAGE = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0}
+TOKEN_USAGE_BY_MODEL: Dict[str, Dict[str, int]] = {}  # Même décompte par modèle routé (tarifs différents)
+METRIC_COUNTERS: Dict[str, int] = {}  # Événements comptés (retries, rapports invalides, JSON extrait du texte...)
+METRICS_LOCK = threading.Lock()
+
+@contextmanager
+def timed_phase(name: str):
+    """Cumule la durée d'une phase du run (git, filtrage, prompt, modèle, parsing, notifications)"""
+    started = time.perf_counter()
     try:
-        # Récupère le hash court (7 caractères)
-        hash_result = subprocess.run(
-            ["git", "rev-parse", "--short=7", "HEAD"],
-            capture_output=True, text=True, check=True
-        )
-        commit_hash = hash_result.stdout.strip()
-
-        # Récupère le message du commit (première ligne uniquement)
-        message_result = subprocess.run(
-            ["git", "log", "-1", "--pretty=%s"],
-            capture_output=True, text=True, check=True
-        )
-        commit_message = message_result.stdout.strip()
-
-        # Récupère l'auteur du commit (nom d'utilisateur Git)
-        author_result = subprocess.run(
-            ["git", "log", "-1", "--pretty=%an"],
-            capture_output=True, text=True, check=True
-        )
-        commit_author = author_result.stdout.strip()
-
-        return commit_hash, commit_message, commit_author
-    except subprocess.CalledProcessError as e:
-        print(f"⚠️ Erreur lors de la récupération des infos du commit: {e}")
-        return "unknown", "Commit inconnu", "unknown"
-
-def get_file_content(filepath: str) -> str:
-    """Lit le contenu d'un fichier avec gestion d'erreur détaillée"""
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+def record_phase(name: str, seconds: float) -> None:
+    """Cumule une durée mesurée hors d'un bloc (premier token, génération en streaming)"""
+    with METRICS_LOCK:
+        PHASE_TIMINGS[name] = PHASE_TIMINGS.get(name, 0.0) + seconds
+
+def count_metric(name: str) -> None:
+    """Incrémente un compteur d'événements du run"""
+    with METRICS_LOCK:
+        METRIC_COUNTERS[name] = METRIC_COUNTERS.get(name, 0) + 1
+
+def record_token_usage(usage, model: str = MODEL_NAME) -> None:
+    """Cumule l'usage renvoyé par la Responses API (plusieurs appels en review par morceaux)"""
+    if usage is None:
+        return
+    input_details = getattr(usage, "input_tokens_details", None)
+    output_details = getattr(usage, "output_tokens_details", None)
+    counts = {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "cached_tokens": getattr(input_details, "cached_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "reasoning_tokens": getattr(output_details, "reasoning_tokens", 0) or 0,
+    }
+    with METRICS_LOCK:
+        TOKEN_USAGE["calls"] += 1
+        per_model = TOKEN_USAGE_BY_MODEL.setdefault(model, dict.fromkeys(counts, 0))
+        for key, value in counts.items():
+            TOKEN_USAGE[key] += value
+            per_model[key] += value
+    print(f"🧮 Tokens: {counts['input_tokens']} entrée ({counts['cached_tokens']} en cache) • "
+          f"{counts['output_tokens']} sortie ({counts['reasoning_tokens']} raisonnement)")
+
+def estimate_cost() -> Optional[float]:
+    """Coût estimé en USD des appels du run, None si un modèle appelé n'a pas de tarif connu"""
+    cost = 0.0
+    for model, usage in TOKEN_USAGE_BY_MODEL.items():
+        pricing = MODEL_PRICING.get(model)
+        if not pricing:
+            return None
+        input_price, cached_price, output_price = pricing
+        uncached = usage["input_tokens"] - usage["cached_tokens"]
+        cost += uncached * input_price + usage["cached_tokens"] * cached_price + usage["output_tokens"] * output_price
+    return round(cost / 1_000_000, 6)
+
+def write_step_summary(metrics: dict) -> None:
+    """Tableau des mesures dans le résumé du job GitHub Actions"""
+    lines = [
+        "### 🤖 AI Code Review — mesures", "",
+        f"Prompt v{metrics['prompt_version']} (préfixe statique `{metrics['prompt_prefix_sha']}`)", "",
+        "| Phase | Durée (s) |", "|---|---:|"
+    ]
+    lines += [f"| {name} | {seconds:.3f} |" for name, seconds in metrics["phases"].items()]
+    tokens = metrics["tokens"]
+    cost = metrics["cost_usd"]
+    cached_ratio = tokens["cached_tokens"] / tokens["input_tokens"] if tokens["input_tokens"] else 0.0
+    lines += [
+        "",
+        "| Appels | Entrée | En cache | Sortie | Raisonnement | Coût estimé |",
+        "|---:|---:|---:|---:|---:|---:|",
+        f"| {tokens['calls']} | {tokens['input_tokens']} | {tokens['cached_tokens']} ({cached_ratio:.0%}) | {tokens['output_tokens']} "
+        f"| {tokens['reasoning_tokens']} | {f'${cost:.4f}' if cost is not None else 'n/a'} |",
+    ]
+    if metrics["counters"]:
+        lines += ["", " • ".join(f"{name}: {count}" for name, count in sorted(metrics["counters"].items()))]
+    if metrics["run"]:
+        run = {key: value for key, value in metrics["run"].items() if key != "notifications"}
+        run.update({name: "✅" if ok else "❌" for name, ok in metrics["run"].get("notifications", {}).items()})
+        lines += ["", " • ".join(f"{key}: {value}" for key, value in run.items())]
+    with open(GITHUB_STEP_SUMMARY, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def write_metrics() -> None:
+    """Écrit les mesures du run en JSON et dans le résumé CI (appelé à la sortie, quel que soit le chemin)"""
+    if not (METRICS_FILE or GITHUB_STEP_SUMMARY):
+        return
+    with METRICS_LOCK:
+        metrics = {
+            "model": MODEL_NAME,
+            "prompt_version": PROMPT_VERSION,
+            "prompt_prefix_sha": PROMPT_PREFIX_SHA,
+            "event": GITHUB_EVENT_NAME or "push",
+            "phases": {name: round(seconds, 4) for name, seconds in PHASE_TIMINGS.items()},
+            "run": dict(RUN_METRICS),
+            "tokens": dict(TOKEN_USAGE),
+            "tokens_by_model": {model: dict(usage) for model, usage in TOKEN_USAGE_BY_MODEL.items()},
+            "counters": dict(METRIC_COUNTERS),
+            "cost_usd": estimate_cost(),
+        }
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            if len(content) > 10000:
-                print(f"📄 {filepath}: {len(content)} caractères")
-            return content
-    except UnicodeDecodeError:
-        print(f"⚠️ Fichier {filepath} ignoré (encodage non UTF-8)")
-        return ""
-    except Exception as e:
-        print(f"❌ Erreur lecture {filepath}: {e}")
-        return ""
+        if METRICS_FILE:
+            with open(METRICS_FILE, "w", encoding="utf-8") as f:
+                json.dump(metrics, f, indent=2, ensure_ascii=False)
+        if GITHUB_STEP_SUMMARY:
+            write_step_summary(metrics)
+    except OSError as e:
+        print(f"⚠️ Impossible d'écrire les mesures: {e}")
 
-def analyze_code(files_content: str) -> Optional[str]:
-    """Envoie le code à l'IA pour analyse via la Responses API avec retry"""
-    if not files_content:
-        print("❌ Aucun contenu à analyser")
-        return None
+# --- PROMPT ---
+SYSTEM_PROMPT = "You are a senior code reviewer API. You output ONLY valid JSON, no markdown, no explanations. Be critical and objective in your scoring - vary scores based on actual code quality."
 
-    # Prompt amélioré avec critères détaillés et sans exemple biaisé
-    prompt = f"""
-Tu es un code reviewer senior expert. Analyse les CHANGEMENTS de code ci-dessous et évalue-les selon des critères stricts.
+# Préfixe statique (système + grille + schéma) envoyé octet pour octet à l'identique d'un run à l'autre,
+# pour que le cache de prompt du fournisseur le réutilise ; tout ce qui dépend du run vient après
+REVIEW_RUBRIC = """Tu es un code reviewer senior expert. Analyse les CHANGEMENTS de code fournis ensuite et évalue-les selon des critères stricts.
 
 CRITÈRES D'ÉVALUATION (sur 20) :
 
@@ -296,51 +528,1960 @@ CONSIGNES STRICTES :
 - Un refactoring majeur bien fait mérite 15-18/20
 - Identifie 2-4 points forts ET 2-4 points faibles réels
 
+CONSIGNE D'ÉVALUATION :
+L'ampleur des changements (indiquée dans le contexte du commit) doit influencer ta notation :
+- Changement très petit (<10 lignes) : Si c'est juste cosmétique ou trivial, note 8-12/20. Si c'est un fix critique bien fait, note 13-16/20.
+- Changement petit (10-50 lignes) : Évalue la qualité technique. Code basique: 10-13/20, code solide: 14-16/20.
+- Changement moyen (50-200 lignes) : Potentiel pour excellentes notes si bien architecturé (15-18/20).
+- Changement important (>200 lignes) : Évalue la cohérence globale et l'architecture (12-18/20 selon qualité).
+
+INSTRUCTIONS :
+Analyse les changements fournis (format diff git).
+- Les lignes '+' sont des ajouts, les lignes '-' sont des suppressions
+- Évalue la QUALITÉ de ces CHANGEMENTS, pas du fichier complet
+- Sois CRITIQUE et VARIE tes notes selon la vraie qualité
+- Si une ANALYSE LOCALE PRÉALABLE est fournie, ce sont des indices détectés automatiquement : vérifie chacun dans le diff, reprends ceux qui sont réels dans les points faibles et ignore les faux positifs
+
 RETOURNE UNIQUEMENT CE JSON (sans ```json, sans texte avant/après) :
-{{
+{
     "score_global": <nombre 0-20>,
-    "details": {{
+    "details": {
         "SOLID": <nombre 0-20>,
         "Clarte": <nombre 0-20>,
         "Securite": <nombre 0-20>,
         "Performance": <nombre 0-20>
-    }},
+    },
     "resume": "<phrase courte résumant l'analyse>",
     "points_forts": ["<point fort 1>", "<point fort 2>"],
     "points_faibles": ["<point faible 1>", "<point faible 2>"],
     "conseil_mentor": "<conseil concret et actionnable pour améliorer le code>"
-}}
+}"""
+
+STATIC_PROMPT_PREFIX = SYSTEM_PROMPT + REVIEW_RUBRIC  # Partie commune à tous les appels, estimée pour le budget
+PROMPT_PREFIX_SHA = hashlib.sha256(STATIC_PROMPT_PREFIX.encode("utf-8")).hexdigest()[:12]
+PROMPT_CACHE_KEY = f"ai-review-v{PROMPT_VERSION}-{PROMPT_PREFIX_SHA}"  # Route les appels vers le même cache côté fournisseur
 
-CHANGEMENTS À ANALYSER :
-{files_content}
+# Partie variable : contexte du commit et diffs, suivis du rappel de format
+REVIEW_PROMPT_TEMPLATE = """{files_content}
 
 RAPPEL : Retourne UNIQUEMENT le JSON, sans markdown, sans explications."""
 
-    max_retries = 2
-    for attempt in range(max_retries):
+def build_review_input(prompt: str) -> List[dict]:
+    """Messages de l'appel : préfixe statique d'abord, partie propre au run en dernier"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": REVIEW_RUBRIC},
+        {"role": "user", "content": prompt}
+    ]
+
+def extract_json_object(text: str) -> Optional[dict]:
+    """Premier objet JSON complet d'un texte libre (bloc markdown, prose avant/après), via raw_decode"""
+    decoder = json.JSONDecoder()
+    index = text.find('{')
+    while index != -1:
         try:
-            print(f"🤖 Tentative {attempt + 1}/{max_retries} d'analyse IA...")
-            response = client.responses.create(
-                model=MODEL_NAME,
-                input=[
-                    {"role": "system", "content": "You are a senior code reviewer API. You output ONLY valid JSON, no markdown, no explanations. Be critical and objective in your scoring - vary scores based on actual code quality."},
-                    {"role": "user", "content": prompt}
-                ],
-                reasoning={"effort": "medium"}  # Augmenté pour analyse approfondie
-            )
-
-            output = response.output_text.strip()
-            print(f"✅ Réponse IA reçue ({len(output)} caractères)")
-            return output
+            data, _ = decoder.raw_decode(text, index)
+            if isinstance(data, dict):
+                return data
+        except json.JSONDecodeError:
+            pass
+        index = text.find('{', index + 1)
+    return None
 
-        except Exception as e:
-            print(f"⚠️ Erreur API OpenAI (tentative {attempt + 1}/{max_retries}): {e}")
-            if attempt == max_retries - 1:
-                print(f"❌ Échec définitif après {max_retries} tentatives")
-                return None
+def parse_review_report(report_json: str) -> Optional[ReviewReport]:
+    """Extrait et valide le rapport JSON renvoyé par l'IA"""
+    from ai_reviewer_models import ReviewReport, ValidationError
+
+    # Sortie structurée : le texte est directement le JSON ; sinon extraction locale
+    try:
+        data = json.loads(report_json)
+    except json.JSONDecodeError:
+        data = extract_json_object(report_json)
+        if data is None:
+            count_metric("report_invalid_json")
+            print("❌ JSON invalide reçu de l'IA")
+            print(f"Extrait du contenu: {report_json[:500]}...")
+            return None
+        count_metric("report_extracted")
+
+    try:
+        report = ReviewReport(**data)
+    except (TypeError, ValidationError) as e:
+        count_metric("report_schema_error")
+        print("❌ Schéma JSON invalide (validation Pydantic échouée):")
+        print(e)
+        return None
+    count_metric("report_valid")
+    return report
+
+def compile_path_filter():
+    """Compile les exclusions et les extensions valides en une seule expression régulière"""
+    exclusions = []
+    for pattern in EXCLUDED_PATTERNS:
+        if '*' in pattern:
+            # Pattern avec wildcard : suffixe du chemin
+            exclusions.append(re.escape(pattern.replace('*', '')) + r"\Z")
+        elif pattern.endswith('/'):
+            # Pattern de dossier : composant exact du chemin
+            exclusions.append(r"(?:\A|/)" + re.escape(pattern.rstrip('/')) + r"(?:/|\Z)")
+        else:
+            # Pattern exact : sous-chaîne du chemin
+            exclusions.append(re.escape(pattern))
+    extensions = "|".join(re.escape(ext) for ext in VALID_EXTENSIONS)
+    return re.compile(rf"\A(?!.*(?:{'|'.join(exclusions)})).*(?:{extensions})\Z", re.DOTALL)
+
+def build_pathspecs() -> List[str]:
+    """Traduit les mêmes règles en pathspecs git pour que les fichiers exclus ne soient jamais émis"""
+    pathspecs = [f":(top)*{ext}" for ext in VALID_EXTENSIONS]
+    for pattern in EXCLUDED_PATTERNS:
+        if '*' in pattern:
+            pathspecs.append(f":(top,exclude)*{pattern.replace('*', '')}")
+        elif pattern.endswith('/'):
+            pathspecs.append(f":(top,exclude,glob)**/{pattern.rstrip('/')}/**")
+        else:
+            pathspecs.append(f":(top,exclude)*{pattern}*")
+    return pathspecs
+
+PATH_FILTER = compile_path_filter()
+PATHSPECS = build_pathspecs()
+
+def should_analyze_file(filepath: str) -> bool:
+    """Vérifie si un fichier doit être analysé (filtre les fichiers exclus)"""
+    return PATH_FILTER.match(filepath) is not None
+
+@dataclass
+class FileChange:
+    """Fichier modifié tel que décrit par une seule passe `git diff`"""
+    path: str
+    added: int = 0
+    deleted: int = 0
+    binary: bool = False
+    patch: str = ""
+    old_path: Optional[str] = None  # Chemin d'origine en cas de renommage/copie
+    status: str = "M"  # Statut git (A, M, D, R, C...) lu dans la sortie --raw
+    truncated: bool = False  # Patch coupé au plafond d'octets : les hunks lus ne décrivent pas tout le fichier
+
+@dataclass
+class PreviousReview:
+    """Dernière review postée sur la PR, relue depuis le marqueur caché de son commentaire"""
+    comment_id: int
+    last_sha: str
+    history: List[dict]
+
+@dataclass
+class ReviewContext:
+    """Informations du commit transmises aux destinations des notifications"""
+    commit_hash: str
+    commit_message: str
+    commit_author: str
+    change_context: str = ""
+    lines_changed: int = 0
+    reviewed_sha: str = ""
+    review_scope: str = "complète"
+    previous_review: Optional[PreviousReview] = None
+    commit_reviews: List[Tuple[str, str, Optional[int]]] = field(default_factory=list)  # (hash, message, note) en mode per-commit
+    engine: str = MODEL_NAME  # Modèle (et effort) ou heuristique ayant produit la note
+    pr_number: str = ""  # PR à commenter (vide pour un push)
+
+@dataclass
+class RangeReview:
+    """Résultat de la review d'une plage de révisions (push, PR ou commit isolé)"""
+    commit_hash: str
+    commit_message: str
+    commit_author: str
+    report: Optional[ReviewReport] = None
+    files: int = 0
+    lines_added: int = 0
+    lines_deleted: int = 0
+    diff_chars: int = 0
+    estimated_tokens: int = 0
+    review_mode: str = ""
+    engine: str = ""
+
+@dataclass
+class ReviewRoute:
+    """Modèle et effort de raisonnement retenus pour un changement"""
+    model: str
+    effort: str
+
+    def describe(self) -> str:
+        return f"{self.model} (effort {self.effort})"
+
+@dataclass
+class ReviewEvent:
+    """Push ou PR à reviewer, lu depuis l'environnement du workflow ou depuis un payload de webhook"""
+    name: str = "push"  # "push" ou "pull_request"
+    sha: str = ""  # Push : tête après le push ; PR : tête de la branche (vide : HEAD)
+    before: str = ""  # Push : tête avant le push (zéros pour une nouvelle branche)
+    base_ref: str = ""  # PR : branche cible
+    base_sha: str = ""  # PR reçue par webhook : tête de la branche cible (pas de commit de merge local)
+    pr_number: str = ""
+    branch: str = ""
+    superseded: threading.Event = field(default_factory=threading.Event)  # Mode service : tête plus récente reçue
+    notified: bool = False  # Notifications envoyées (la review ne peut plus être remplacée)
+
+    @property
+    def is_pull_request(self) -> bool:
+        return self.name == "pull_request"
+
+def event_from_env() -> ReviewEvent:
+    """Événement du run CI, décrit par les variables d'environnement GitHub Actions"""
+    is_pull_request = GITHUB_EVENT_NAME == "pull_request"
+    return ReviewEvent(
+        name="pull_request" if is_pull_request else "push",
+        sha=(GITHUB_HEAD_SHA if is_pull_request else GITHUB_SHA) or "",
+        before=GITHUB_EVENT_BEFORE or "",
+        base_ref=(GITHUB_BASE_REF or "") if is_pull_request else "",
+        pr_number=(GITHUB_PR_NUMBER or "") if is_pull_request else "",
+        branch="" if is_pull_request else (GITHUB_REF_NAME or "")
+    )
+
+def has_revision(revision: str) -> bool:
+    """Vrai si le commit est présent dans le dépôt local"""
+    result = subprocess.run(["git", "cat-file", "-e", f"{revision}^{{commit}}"], capture_output=True)
+    return result.returncode == 0
+
+def get_parent_revision(revision: str) -> str:
+    """Premier parent d'un commit, ou l'arbre vide pour le commit racine"""
+    result = subprocess.run(["git", "rev-parse", "--verify", "-q", f"{revision}~1^{{commit}}"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else EMPTY_TREE_SHA
+
+def get_new_branch_base(head: str, branch: str) -> Optional[str]:
+    """Base d'une nouvelle branche : parent du plus ancien commit poussé absent des autres branches distantes"""
+    # La branche distante elle-même pointe déjà sur la tête poussée (checkout CI, fetch du service)
+    exclude = [f"--exclude=origin/{branch}"] if branch else []
+    try:
+        commits = run_git(["rev-list", "--reverse", "--topo-order", head, "--not", *exclude, "--remotes"]).split()
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️ Impossible de situer la nouvelle branche: {e}")
+        return None
+    return get_parent_revision(commits[0]) if commits else None
+
+def get_diff_range(event: ReviewEvent) -> List[str]:
+    """Retourne la plage de révisions à comparer (contexte PR ou push)"""
+    if event.is_pull_request and event.base_sha and event.sha:
+        # Mode service : pas de commit de merge, la PR est comparée à son point de départ sur la cible
+        try:
+            return [run_git(["merge-base", event.base_sha, event.sha]).strip(), event.sha]
+        except subprocess.CalledProcessError:
+            return [event.base_sha, event.sha]
+    if event.is_pull_request and event.base_ref:
+        return [f"origin/{event.base_ref}", "HEAD"]
+
+    # Push : tous les commits poussés (before..after), pas seulement le dernier
+    head = event.sha or "HEAD"
+    before = event.before.strip()
+    if before.strip("0"):
+        if has_revision(before):
+            return [before, head]
+        print(f"⚠️ {before[:7]} absent de l'historique (force push ?), review du dernier commit")
+    elif before:
+        base = get_new_branch_base(head, event.branch)
+        if base:
+            print(f"ℹ️ Nouvelle branche, review depuis {base[:7]}")
+            return [base, head]
+        print("ℹ️ Nouvelle branche sans commit propre, review du dernier commit")
+    return [get_parent_revision(head), head]
+
+def list_push_commits(diff_range: List[str]) -> List[str]:
+    """Commits de la plage, du plus ancien au plus récent (merges exclus)"""
+    base, head = diff_range
+    revisions = [head] if base == EMPTY_TREE_SHA else [f"{base}..{head}"]
+    try:
+        return run_git(["rev-list", "--reverse", "--no-merges", *revisions]).split()
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️ Impossible de lister les commits du push: {e}")
+        return []
+
+def run_git(args: List[str]) -> str:
+    """Exécute une commande git et retourne sa sortie (décodage UTF-8 tolérant)"""
+    result = subprocess.run(
+        ["git", *args],
+        capture_output=True, text=True, encoding="utf-8", errors="replace", check=True
+    )
+    return result.stdout
+
+def parse_numstat(output: str) -> List[FileChange]:
+    """Parse la sortie de `git diff --raw --numstat -z` en enregistrements par fichier"""
+    records = []
+    statuses = {}
+    fields = output.split('\0')
+    i = 0
+    while i < len(fields):
+        if fields[i].startswith(':'):
+            # Entrée --raw : ":<modes> <shas> <statut>\0<chemin>\0", deux chemins pour un renommage/copie
+            status = fields[i].rsplit(' ', 1)[-1][:1]
+            paths = 2 if status in ('R', 'C') else 1
+            if i + paths < len(fields):
+                statuses[fields[i + paths]] = status
+            i += paths + 1
+            continue
+
+        parts = fields[i].split('\t', 2)
+        if len(parts) < 3:
+            i += 1
+            continue
+
+        added, deleted, path = parts
+        old_path = None
+        if path:
+            i += 1
+        else:
+            # Renommage/copie : "<ajouts>\t<suppressions>\t\0<ancien>\0<nouveau>\0"
+            old_path = fields[i + 1] if i + 1 < len(fields) else None
+            path = fields[i + 2] if i + 2 < len(fields) else ""
+            i += 3
+
+        binary = added == '-' or deleted == '-'
+        records.append(FileChange(
+            path=path,
+            added=0 if binary else int(added),
+            deleted=0 if binary else int(deleted),
+            binary=binary,
+            old_path=old_path,
+            status=statuses.get(path, "M")
+        ))
+    return records
+
+def unquote_git_path(path: str) -> str:
+    """Décode un chemin cité par git ("...") avec échappements octaux UTF-8"""
+    if not path.startswith('"'):
+        return path
+    try:
+        return ast.literal_eval(path).encode('latin-1').decode('utf-8')
+    except (ValueError, SyntaxError, UnicodeError):
+        return path.strip('"')
+
+def get_section_path(section: str) -> Optional[str]:
+    """Retrouve le chemin (côté destination) d'une section de diff"""
+    first_line, _, rest = section.partition('\n')
+    for line in rest.split('\n'):
+        # git termine par une tabulation les chemins contenant un espace (une vraie tabulation serait citée)
+        line = line.rstrip('\t')
+        if line.startswith(("rename to ", "copy to ")):
+            return unquote_git_path(line.split(" to ", 1)[1])
+        if line.startswith("+++ ") and line != "+++ /dev/null":
+            return unquote_git_path(line[4:])[2:]
+        if line.startswith("@@"):
+            break
+    # Sans "+++" (binaire, mode, suppression) : "diff --git a/X b/X" avec X identique des deux côtés
+    header = first_line[len("diff --git "):]
+    if header.startswith('"'):
+        return unquote_git_path(header[header.index('" "') + 2:] if '" "' in header else header)[2:]
+    return header[2:2 + (len(header) - 5) // 2]
+
+def get_rename_args() -> List[str]:
+    """Détection des renommages/copies si la passe de compaction correspondante est active"""
+    return ["-M", "-C"] if "renames" in COMPACTION_PASSES else ["--no-renames"]
+
+def get_changed_files(diff_range: List[str]) -> List[FileChange]:
+    """Récupère les fichiers modifiés et leurs statistiques en un seul appel git"""
+    try:
+        # Filtres poussés dans git : fichiers exclus jamais émis ; --raw donne le statut (suppression)
+        with timed_phase("changed_files"):
+            output = run_git(["diff", "--raw", "--numstat", "-z", *get_rename_args(), *diff_range, "--", *PATHSPECS])
+            records = [r for r in parse_numstat(output) if r.path]
+
+        # Filet de sécurité : mêmes règles, compilées une seule fois
+        with timed_phase("filtering"):
+            valid_files = [r for r in records if should_analyze_file(r.path)]
+
+        excluded_count = len(records) - len(valid_files)
+        if excluded_count > 0:
+            print(f"📋 {excluded_count} fichier(s) exclu(s) par les filtres")
+
+        if len(valid_files) > MAX_FILES_ANALYZED:
+            print(f"⚠️ Trop de fichiers modifiés ({len(valid_files)}). Limitation à {MAX_FILES_ANALYZED} fichiers.")
+            return valid_files[:MAX_FILES_ANALYZED]
+
+        return valid_files
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"❌ Erreur lors de la récupération des fichiers: {e}")
+        return []
+
+def read_diff_sections(args: List[str], total_limit: int) -> Tuple[List[str], Optional[str], int]:
+    """Lit un `git diff` en flux, une section par fichier, et arrête git dès qu'un plafond est atteint
+
+    Retourne les sections lues, le plafond atteint ("file", "total" ou None) et les octets retenus."""
+    process = subprocess.Popen(["git", *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    sections = []
+    current: List[bytes] = []
+    file_bytes = total_bytes = 0
+    stop = None
+    try:
+        while True:
+            # Lecture bornée par la place restante : une ligne géante (bundle minifié) n'est jamais chargée en entier
+            room = min(MAX_PATCH_BYTES_PER_FILE - file_bytes, total_limit - total_bytes)
+            line = process.stdout.readline(max(room + 1, DIFF_HEADER_PROBE_BYTES))
+            if not line:
+                break
+            if line.startswith(b"diff --git ") and current:
+                sections.append(b"".join(current).decode("utf-8", errors="replace"))
+                current, file_bytes = [], 0
+            if total_bytes + len(line) > total_limit:
+                stop = "total"
+            elif file_bytes + len(line) > MAX_PATCH_BYTES_PER_FILE:
+                stop = "file"
+            if stop:
+                current.append(f" … [diff tronqué : plafond de {MAX_PATCH_BYTES_PER_FILE if stop == 'file' else total_limit} octets]\n".encode("utf-8"))
+                break
+            current.append(line)
+            file_bytes += len(line)
+            total_bytes += len(line)
+        if current:
+            sections.append(b"".join(current).decode("utf-8", errors="replace"))
+    finally:
+        if stop:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if not stop and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ["git", *args])
+    return sections, stop, total_bytes
+
+def describe_without_patch(change: FileChange) -> Optional[str]:
+    """Ligne de métadonnées remplaçant le diff d'un fichier dont le patch n'apporterait rien au modèle"""
+    if change.binary:
+        return "[Fichier binaire : diff non transmis]\n"
+    if change.status == "D":
+        return f"[Fichier supprimé : -{change.deleted} lignes, diff non transmis]\n"
+    if change.added + change.deleted > MAX_PATCH_LINES_PER_FILE:
+        return f"[Fichier volumineux : +{change.added}/-{change.deleted} lignes, au-delà de {MAX_PATCH_LINES_PER_FILE}, diff non transmis]\n"
+    return None
+
+def load_file_patches(changes: List[FileChange], diff_range: List[str]) -> None:
+    """Charge les diffs des fichiers retenus, en flux et sous plafonds d'octets
 
+    Les fichiers binaires, supprimés ou trop volumineux (d'après numstat) ne sont pas demandés à git."""
+    remaining = []
+    for change in changes:
+        metadata = describe_without_patch(change)
+        if metadata:
+            change.patch = metadata
+            count_metric("patch_skipped")
+        else:
+            remaining.append(change)
+    if len(remaining) < len(changes):
+        print(f"📎 {len(changes) - len(remaining)} fichier(s) binaire(s), supprimé(s) ou volumineux décrit(s) sans diff")
+
+    budget = MAX_PATCH_BYTES_TOTAL
+    while remaining:
+        # L'ancien chemin d'un renommage doit faire partie du pathspec pour que git l'apparie
+        paths = [c.path for c in remaining] + [c.old_path for c in remaining if c.old_path]
+        pathspecs = [f":(literal){path}" for path in paths]
+        try:
+            sections, stop, used = read_diff_sections(["diff", *get_rename_args(), *diff_range, "--", *pathspecs], budget)
+        except subprocess.CalledProcessError as e:
+            print(f"⚠️ Erreur lors de la récupération des diffs: {e}")
+            return
+
+        by_path = {get_section_path(section): section for section in sections}
+        for change in remaining:
+            change.patch = by_path.get(change.path, change.patch)
+        budget -= used
+        if not stop:
+            return
+
+        truncated = get_section_path(sections[-1]) if sections else None
+        for change in remaining:
+            change.truncated = change.truncated or change.path == truncated
+        count_metric("patch_truncated")
+        if stop == "total":
+            missing = [c for c in remaining if c.path not in by_path]
+            print(f"✂️ Plafond de {MAX_PATCH_BYTES_TOTAL} octets de diff atteint: {truncated} tronqué, {len(missing)} fichier(s) sans diff")
+            return
+
+        # Fichier trop gros : git est relancé pour les fichiers suivants, le reste du gros fichier n'est jamais lu
+        print(f"✂️ Diff de {truncated} tronqué à {MAX_PATCH_BYTES_PER_FILE} octets")
+        following = [c for c in remaining if c.path not in by_path]
+        if len(following) == len(remaining):
+            return
+        remaining = following
+
+def format_file_diff(change: FileChange) -> str:
+    """Formate le diff d'un fichier pour le prompt (une seule copie du patch)"""
+    separator = "=" * 60
+    patch = change.patch if change.patch else "[Diff non disponible]\n"
+    return (
+        f"\n{separator}\nFICHIER: {change.path}\n"
+        f"Lignes ajoutées: +{change.added} | Lignes supprimées: -{change.deleted}\n"
+        f"{separator}\n{patch}\n"
+    )
+
+def get_commit_info(revision: str = "HEAD"):
+    """Récupère le hash court, le message et l'auteur d'un commit (HEAD par défaut) en un seul appel"""
+    try:
+        output = run_git(["log", "-1", "--abbrev=7", "--format=%h%x00%s%x00%an", revision])
+        commit_hash, commit_message, commit_author = output.rstrip('\n').split('\0', 2)
+        return commit_hash, commit_message, commit_author
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"⚠️ Erreur lors de la récupération des infos du commit: {e}")
+        return "unknown", "Commit inconnu", "unknown"
+
+# --- REVIEW INCRÉMENTALE DES PR ---
+def github_request(method: str, path_or_url: str, **kwargs):
+    """Appel direct à l'API REST GitHub (dépôt et numéro de PR connus : pas de résolution préalable)"""
+    url = path_or_url if path_or_url.startswith("http") else f"{GITHUB_API_URL}{path_or_url}"
+    headers = {
+        "Authorization": f"Bearer {GITHUB_TOKEN}",
+        "Accept": "application/vnd.github+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
+    response = call_with_retry("GitHub", http_request, method, url, headers=headers, **kwargs)
+    response.raise_for_status()
+    return response
+
+def get_pr_comments(pr_number: str) -> List[dict]:
+    """Commentaires de la PR, toutes pages confondues (du plus ancien au plus récent)"""
+    comments = []
+    url = f"/repos/{GITHUB_REPOSITORY}/issues/{pr_number}/comments"
+    params = {"per_page": 100}
+    while url:
+        response = github_request("GET", url, params=params)
+        comments.extend(response.json())
+        url = response.links.get("next", {}).get("url")
+        params = None  # L'URL de la page suivante porte déjà ses paramètres
+    return comments
+
+def resolve_revision(revision: str) -> str:
+    """Retourne le SHA complet d'une révision"""
+    return run_git(["rev-parse", "--verify", f"{revision}^{{commit}}"]).strip()
+
+def is_ancestor(ancestor: str, descendant: str) -> bool:
+    """Vrai si `ancestor` est dans l'historique de `descendant` (faux après un force push)"""
+    result = subprocess.run(["git", "merge-base", "--is-ancestor", ancestor, descendant], capture_output=True)
+    return result.returncode == 0
+
+def parse_review_state(body: str) -> Optional[dict]:
+    """Extrait l'état (dernier SHA, historique) caché dans un commentaire de review"""
+    match = re.search(rf"<!-- {REVIEW_STATE_MARKER} (.*?) -->", body or "")
+    if not match:
+        return None
+    try:
+        state = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+    return state if isinstance(state, dict) and state.get("last_sha") else None
+
+def is_review_bot_comment(comment: dict) -> bool:
+    """Vrai si le commentaire a été écrit par le bot de review (seul auteur dont l'état est fiable)"""
+    user = comment.get("user") or {}
+    return user.get("type") == "Bot" and user.get("login") == REVIEW_BOT_LOGIN
+
+def find_previous_review(pr_number: str) -> Optional[PreviousReview]:
+    """Cherche le dernier commentaire de review du bot sur la PR"""
+    if not GITHUB_TOKEN or not GITHUB_REPOSITORY or not pr_number:
+        return None
+    try:
+        for comment in reversed(get_pr_comments(pr_number)):
+            # Un contributeur pourrait recopier le marqueur pour faire sauter ou réduire la review
+            if not is_review_bot_comment(comment):
+                continue
+            state = parse_review_state(comment.get("body") or "")
+            if state:
+                return PreviousReview(comment["id"], state["last_sha"], state.get("history", []))
+    except (OSError, ValueError, RetryableHTTPError, CircuitOpenError, TimeoutError) as e:
+        # requests.RequestException hérite d'OSError, une réponse non JSON lève ValueError
+        print(f"⚠️ Impossible de relire la review précédente: {e}")
     return None
 
+# --- CACHE DES REVIEWS ---
+def normalize_diff(changes: List[FileChange]) -> str:
+    """Normalise les diffs pour qu'un rebase sans changement de contenu donne la même clé"""
+    parts = []
+    for change in changes:
+        parts.append(f"FICHIER {change.path} +{change.added}/-{change.deleted}")
+        for line in change.patch.replace('\r\n', '\n').split('\n'):
+            # Les hashes de blobs et les numéros de lignes dépendent de la base, pas du changement
+            if line.startswith("index "):
+                continue
+            parts.append(re.sub(r"^@@ [^@]* @@", "@@", line))
+    return "\n".join(parts)
+
+def compute_cache_key(changes: List[FileChange], route: ReviewRoute) -> str:
+    """Clé de cache : hash du diff normalisé, du modèle et de l'effort retenus par le routage, et de la version du prompt"""
+    digest = hashlib.sha256()
+    digest.update(f"{route.model}\0{route.effort}\0{PROMPT_VERSION}\0{PROMPT_PREFIX_SHA}\0".encode("utf-8"))
+    digest.update(normalize_diff(changes).encode("utf-8", errors="replace"))
+    return digest.hexdigest()
+
+def load_cached_review(cache_key: str) -> Optional[ReviewReport]:
+    """Retourne le rapport validé en cache pour cette clé, s'il existe et n'a pas expiré"""
+    from ai_reviewer_models import ReviewReport, ValidationError
+    path = os.path.join(REVIEW_CACHE_DIR, f"{cache_key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) > REVIEW_CACHE_MAX_AGE_DAYS * 86400:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            report = ReviewReport.model_validate_json(f.read())
+        # Rafraîchit la date d'accès pour l'éviction LRU
+        os.utime(path)
+        return report
+    except FileNotFoundError:
+        return None
+    except (OSError, ValidationError) as e:
+        print(f"⚠️ Entrée de cache illisible ({cache_key[:12]}): {e}")
+        return None
+
+def store_cached_review(cache_key: str, report: ReviewReport) -> None:
+    """Enregistre un rapport validé dans le cache puis applique l'éviction"""
+    try:
+        os.makedirs(REVIEW_CACHE_DIR, exist_ok=True)
+        path = os.path.join(REVIEW_CACHE_DIR, f"{cache_key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(report.model_dump_json())
+        os.replace(tmp_path, path)
+        prune_review_cache()
+    except OSError as e:
+        print(f"⚠️ Impossible d'écrire dans le cache des reviews: {e}")
+
+def prune_review_cache() -> None:
+    """Supprime les entrées expirées puis les plus anciennes au-delà de la taille maximale"""
+    entries = []
+    now = time.time()
+    for entry in os.scandir(REVIEW_CACHE_DIR):
+        if not entry.name.endswith(".json"):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime > REVIEW_CACHE_MAX_AGE_DAYS * 86400:
+            os.remove(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= REVIEW_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total_size -= size
+
+# --- VALIDATION INCRÉMENTALE DU STREAMING ---
+class ReportStreamValidator:
+    """Suit la structure du JSON reçu par morceaux et détecte au plus tôt une sortie hors schéma"""
+
+    def __init__(self):
+        from ai_reviewer_models import ReviewReport
+        self.fields = set(ReviewReport.model_fields)
+        self.prefix = ""
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.expect_key = False
+        self.key = None
+        self.closed = False
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Consomme un morceau de texte ; retourne la raison de l'abandon si la sortie ne peut plus être valide"""
+        for char in chunk:
+            error = self._feed_char(char)
+            if error:
+                return error
+        return None
+
+    def _feed_char(self, char: str) -> Optional[str]:
+        if self.closed:
+            # Après l'objet racine, seuls des espaces ou la fin d'un bloc ``` sont tolérés
+            if not char.isspace() and char != '`':
+                return "texte après le JSON"
+            return None
+
+        if self.depth == 0:
+            if char == '{':
+                self.depth = 1
+                self.expect_key = True
+            elif not char.isspace():
+                # Tolère un bloc ```json d'ouverture, que parse_review_report sait nettoyer
+                self.prefix += char
+                if not "```json".startswith(self.prefix):
+                    return f"texte avant le JSON ({self.prefix[:20]!r})"
+            return None
+
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                if self.key is not None:
+                    if self.key not in self.fields:
+                        return f"clé inattendue {self.key!r}"
+                    self.key = None
+            elif self.key is not None:
+                self.key += char
+            return None
+
+        if char == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect_key:
+                self.key = ""
+                self.expect_key = False
+        elif char in '{[':
+            self.depth += 1
+        elif char in '}]':
+            self.depth -= 1
+            if self.depth == 0:
+                self.closed = True
+        elif char == ',' and self.depth == 1:
+            self.expect_key = True
+        return None
+
+@lru_cache(maxsize=1)
+def get_review_text_format() -> dict:
+    """Format de sortie json_schema strict, généré depuis les modèles Pydantic"""
+    from ai_reviewer_models import review_report_json_schema
+    return {"type": "json_schema", "name": "review_report", "schema": review_report_json_schema(), "strict": True}
+
+def is_unsupported_format_error(error: Exception) -> bool:
+    """Vrai si l'API refuse le paramètre text.format (modèle sans sortie structurée)"""
+    param = getattr(error, "param", None) or ""
+    return param.startswith("text") or "json_schema" in str(error) or getattr(error, "code", None) == "unsupported_parameter"
+
+def create_review_response(prompt: str, route: ReviewRoute, **kwargs):
+    """Appel à la Responses API, en sortie structurée tant que le modèle l'accepte"""
+    global STRUCTURED_OUTPUT
+    params = dict(
+        model=route.model,
+        input=build_review_input(prompt),
+        reasoning={"effort": route.effort},  # Selon l'ampleur du changement (MODEL_ROUTES)
+        prompt_cache_key=PROMPT_CACHE_KEY,
+        timeout=min(MODEL_TIMEOUT, max(remaining_time_budget(), 1)),
+        **kwargs
+    )
+    if STRUCTURED_OUTPUT:
+        from openai import BadRequestError
+        try:
+            return get_openai_client().responses.create(text={"format": get_review_text_format()}, **params)
+        except BadRequestError as e:
+            if not is_unsupported_format_error(e):
+                raise
+            # Le JSON sera extrait localement du texte libre (parse_review_report)
+            STRUCTURED_OUTPUT = False
+            count_metric("structured_output_unsupported")
+            print(f"⚠️ Sortie structurée refusée par {route.model} ({e}), extraction locale du JSON")
+    return get_openai_client().responses.create(**params)
+
+def raise_incomplete_response(response) -> None:
+    """Réponse coupée (plafond de tokens, filtre) : réessayée comme une sortie invalide plutôt qu'un JSON tronqué"""
+    count_metric("response_incomplete")
+    reason = getattr(getattr(response, "incomplete_details", None), "reason", None)
+    raise ModelOutputError(f"réponse incomplète ({reason or 'raison inconnue'})")
+
+def request_review_output(prompt: str, route: ReviewRoute) -> str:
+    """Appel classique : attend la réponse complète de la Responses API"""
+    started_at = time.monotonic()
+    response = create_review_response(prompt, route)
+    print(f"⏱️ Génération: {time.monotonic() - started_at:.2f}s")
+    record_phase("model_generation", time.monotonic() - started_at)
+    record_token_usage(response.usage, route.model)
+    if getattr(response, "status", None) == "incomplete":
+        raise_incomplete_response(response)
+    return response.output_text
+
+def stream_review_output(prompt: str, route: ReviewRoute) -> str:
+    """Appel en streaming : valide la sortie au fil de l'eau et abandonne dès qu'elle sort du schéma"""
+    started_at = time.monotonic()
+    first_token_at = None
+    validator = ReportStreamValidator()
+    output = []
+
+    stream = create_review_response(prompt, route, stream=True)
+    try:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                output.append(event.delta)
+                error = validator.feed(event.delta)
+                if error:
+                    count_metric("stream_aborted")
+                    raise ModelOutputError(f"sortie hors schéma interrompue après {len(''.join(output))} caractères: {error}")
+            elif event.type == "response.completed":
+                record_token_usage(event.response.usage, route.model)
+            elif event.type == "response.incomplete":
+                record_token_usage(event.response.usage, route.model)
+                raise_incomplete_response(event.response)
+            elif event.type in ("response.failed", "error"):
+                raise ModelOutputError(f"génération échouée ({event.type})")
+    finally:
+        stream.close()
+        # Mesuré aussi pour un flux interrompu : la latence du modèle reste visible dans les mesures du run
+        total = time.monotonic() - started_at
+        if first_token_at is not None:
+            record_phase("model_first_token", first_token_at - started_at)
+        record_phase("model_generation", total)
+
+    ttft = f"{first_token_at - started_at:.2f}s" if first_token_at else "n/a"
+    print(f"⏱️ Premier token: {ttft} • Génération: {total:.2f}s")
+    return "".join(output)
+
+def analyze_code(files_content: str, route: ReviewRoute) -> Optional[str]:
+    """Envoie le code à l'IA pour analyse via la Responses API avec retry"""
+    if not files_content:
+        print("❌ Aucun contenu à analyser")
+        return None
+
+    prompt = REVIEW_PROMPT_TEMPLATE.format(files_content=files_content)
+
+    try:
+        # Retry avec backoff sur les erreurs transitoires et les sorties hors schéma
+        request_output = stream_review_output if STREAMING_REVIEW else request_review_output
+        output = call_with_retry("OpenAI", request_output, prompt, route).strip()
+        print(f"✅ Réponse IA reçue ({len(output)} caractères)")
+        return output
+    except Exception as e:
+        print(f"❌ Échec définitif de l'analyse IA: {e}")
+        return None
+
+# --- BUDGET DE TOKENS ---
+TOKEN_PATTERN = re.compile(r"\w+|([^\w\s])\1*|\n")
+
+# Fichiers où l'indentation porte du sens : un changement d'indentation n'y est jamais cosmétique
+INDENT_SENSITIVE_EXTENSIONS = ('.py', '.yaml', '.yml')
+
+# Priorité des extensions (0 = la plus haute) : code source d'abord, configuration en dernier
+EXTENSION_PRIORITY = {
+    '.py': 0, '.ts': 0, '.vue': 0,
+    '.js': 1, '.php': 1,
+    '.css': 2, '.scss': 2,
+    '.yaml': 3, '.yml': 3,
+}
+
+def estimate_tokens(text: str) -> int:
+    """Estime localement le nombre de tokens (mots et suites de ponctuation par ~4 caractères, sauts de ligne)"""
+    return sum((len(match.group()) + 3) // 4 for match in TOKEN_PATTERN.finditer(text))
+
+def get_diff_budget(context_header: str) -> int:
+    """Tokens disponibles pour les diffs une fois le préfixe statique, le template et l'en-tête comptés"""
+    overhead = estimate_tokens(STATIC_PROMPT_PREFIX + REVIEW_PROMPT_TEMPLATE + context_header)
+    return max(MAX_PROMPT_TOKENS - overhead - OMITTED_SUMMARY_RESERVE_TOKENS, 0)
+
+def is_whitespace_only_hunk(hunk: str, path: str = "") -> bool:
+    """Vrai si le hunk ne change que des espaces : lignes vides, espaces de fin de ligne, indentation hors Python/YAML
+
+    Compare l'ancien côté (contexte et `-`) au nouveau (contexte et `+`), ligne à ligne : une instruction déplacée
+    au-delà d'une ligne de contexte, une ligne coupée ou jointe, ou un espace modifié à l'intérieur d'une ligne
+    (littéral de chaîne compris), reste un vrai changement."""
+    indent_sensitive = path.endswith(INDENT_SENSITIVE_EXTENSIONS)
+
+    def side(marker: str) -> List[str]:
+        return [
+            line[1:].rstrip() if indent_sensitive else line[1:].strip()
+            for line in hunk.split('\n')[1:]
+            if line[:1] in (' ', marker) and line[1:].strip()
+        ]
+
+    return side('-') == side('+')
+
+def split_hunks(patch: str) -> Tuple[str, List[str]]:
+    """Sépare l'en-tête d'un diff de fichier de ses hunks (@@ ... @@)"""
+    header = []
+    hunks = []
+    for line in patch.splitlines(keepends=True):
+        if line.startswith("@@"):
+            hunks.append(line)
+        elif hunks:
+            hunks[-1] += line
+        else:
+            header.append(line)
+    return "".join(header), hunks
+
+def count_hunk_lines(hunk: str) -> Tuple[int, int]:
+    """Compte les lignes ajoutées et supprimées d'un hunk"""
+    lines = hunk.split('\n')
+    return sum(1 for line in lines if line.startswith('+')), sum(1 for line in lines if line.startswith('-'))
+
+def pack_diffs(changes: List[FileChange], budget: int) -> Tuple[str, List[str]]:
+    """Remplit le budget avec des hunks entiers par priorité et résume les fichiers omis"""
+    split_changes = [split_hunks(change.patch) for change in changes]
+    header_costs = []
+    candidates = []
+    for file_index, (change, (header, hunks)) in enumerate(zip(changes, split_changes)):
+        extension_rank = EXTENSION_PRIORITY.get(os.path.splitext(change.path)[1], len(EXTENSION_PRIORITY))
+        if hunks:
+            header_costs.append(estimate_tokens(format_file_diff(FileChange(change.path)) + header))
+        else:
+            # Fichier sans hunk (binaire, vide) : son bloc complet est une seule unité
+            header_costs.append(estimate_tokens(format_file_diff(change)))
+            candidates.append((False, extension_rank, 0, file_index, 0, "", 0))
+        for hunk_index, hunk in enumerate(hunks):
+            added, deleted = count_hunk_lines(hunk)
+            candidates.append((is_whitespace_only_hunk(hunk, change.path), extension_rank, -(added + deleted), file_index, hunk_index, hunk, estimate_tokens(hunk)))
+
+    # Glouton par priorité : un hunk entre s'il tient encore, l'en-tête du fichier est payé au premier hunk retenu
+    selected = {}
+    used = 0
+    for *_, file_index, hunk_index, hunk, tokens in sorted(candidates, key=lambda c: c[:5]):
+        cost = tokens if file_index in selected else tokens + header_costs[file_index]
+        if used + cost > budget:
+            continue
+        selected.setdefault(file_index, []).append((hunk_index, hunk))
+        used += cost
+
+    # Prompt assemblé en un seul buffer à la fin
+    parts = []
+    omitted = []
+    for file_index, (change, (header, hunks)) in enumerate(zip(changes, split_changes)):
+        kept = sorted(selected.get(file_index, []))
+        if not kept:
+            omitted.append(f"{change.path} (+{change.added}/-{change.deleted})")
+            continue
+        if hunks and len(kept) < len(hunks):
+            kept_indexes = {index for index, _ in kept}
+            missing = [count_hunk_lines(h) for index, h in enumerate(hunks) if index not in kept_indexes]
+            omitted.append(f"{change.path} : {len(missing)} hunk(s) omis (+{sum(a for a, _ in missing)}/-{sum(d for _, d in missing)})")
+        partial = FileChange(change.path, change.added, change.deleted, change.binary, header + "".join(h for _, h in kept) if hunks else change.patch)
+        parts.append(format_file_diff(partial))
+
+    if omitted:
+        parts.append(f"\n{'='*60}\nFICHIERS NON INCLUS (budget de tokens atteint) :\n")
+        parts.extend(f"- {line}\n" for line in omitted)
+    return "".join(parts), omitted
+
+# --- COMPACTION DES DIFFS ---
+# Lignes ajoutées ressemblant à des données (JSON/objets littéraux, listes de nombres, base64)
+DATA_LITERAL_ATOM = (
+    r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''  # Chaînes
+    r'|-?\d[\w.+-]*(?![\w.+-])'             # Nombres (non redécoupables)
+    r'|true|false|null'
+    r'|[A-Za-z_$][\w$]*\s*:'                # Clés d'objet JS non citées
+    r'|[\[\]{}(),:]'
+)
+DATA_LITERAL_PATTERN = re.compile(
+    rf'^\s*(?:(?:(?:{DATA_LITERAL_ATOM})\s*)+;?|[A-Za-z0-9+/=]{{60,}})\s*$'
+)
+# Balises : données dans les fichiers SVG/XML, ailleurs seulement sans attribut (jamais dans un template .vue,
+# où bindings, handlers et v-html doivent rester visibles)
+MARKUP_DATA_EXTENSIONS = ('.svg', '.xml')
+MARKUP_DATA_PATTERN = re.compile(r'^\s*<[^>]*>?\s*$')
+BARE_TAG_PATTERN = re.compile(r'^\s*</?[\w:.-]+\s*/?>\s*$')
+
+def is_data_literal_line(path: str, text: str) -> bool:
+    """Vrai si la ligne ajoutée ressemble à une donnée littérale dans ce type de fichier"""
+    if DATA_LITERAL_PATTERN.match(text):
+        return True
+    if path.endswith('.vue'):
+        return False
+    if path.endswith(MARKUP_DATA_EXTENSIONS):
+        return bool(MARKUP_DATA_PATTERN.match(text))
+    return bool(BARE_TAG_PATTERN.match(text))
+
+def trim_hunk_context(hunk: str) -> str:
+    """Réduit le contexte d'un hunk : les petits hunks gardent 3 lignes, les gros COMPACTION_CONTEXT_LINES"""
+    lines = hunk.split('\n')
+    body = lines[1:]
+    changed = [i for i, line in enumerate(body) if line[:1] in ('+', '-')]
+    context = 3 if len(changed) <= COMPACTION_SMALL_HUNK_LINES else COMPACTION_CONTEXT_LINES
+
+    # Distance de chaque ligne au changement le plus proche (deux balayages)
+    distance = [len(body)] * len(body)
+    last = None
+    for i in range(len(body)):
+        if body[i][:1] in ('+', '-'):
+            last = i
+        if last is not None:
+            distance[i] = i - last
+    last = None
+    for i in reversed(range(len(body))):
+        if body[i][:1] in ('+', '-'):
+            last = i
+        if last is not None:
+            distance[i] = min(distance[i], last - i)
+
+    kept = [lines[0]]
+    skipped = False
+    for i, line in enumerate(body):
+        if not line.startswith(' ') or distance[i] <= context:
+            if skipped:
+                kept.append(" …")
+                skipped = False
+            kept.append(line)
+        else:
+            skipped = True
+    return '\n'.join(kept)
+
+def collapse_literal_runs(hunk: str, path: str = "") -> str:
+    """Remplace les longues suites de lignes de données ajoutées par un résumé d'une ligne"""
+    lines = hunk.split('\n')
+    result = []
+    run = []
+
+    def flush():
+        if len(run) >= COMPACTION_LITERAL_RUN:
+            result.extend(run[:3])
+            result.append(f"+… [{len(run) - 3} lignes de données littérales omises]")
+        else:
+            result.extend(run)
+        run.clear()
+
+    for line in lines:
+        if line.startswith('+') and is_data_literal_line(path, line[1:]):
+            run.append(line)
+        else:
+            flush()
+            result.append(line)
+    flush()
+    return '\n'.join(result)
+
+def get_blob_sizes(revision: str, paths: List[str]) -> Dict[str, int]:
+    """Tailles des fichiers à une révision, en un seul appel `git cat-file --batch-check`"""
+    if not paths:
+        return {}
+    result = subprocess.run(
+        ["git", "cat-file", "--batch-check=%(objectsize)"],
+        input="".join(f"{revision}:{path}\n" for path in paths),
+        capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    sizes = {}
+    for path, line in zip(paths, result.stdout.splitlines()):
+        if line.isdigit():
+            sizes[path] = int(line)
+    return sizes
+
+def compact_changes(changes: List[FileChange], diff_range: List[str]) -> Dict[str, Dict[str, int]]:
+    """Applique les passes de compaction actives et retourne les octets/tokens économisés par passe"""
+    savings = {}
+
+    def apply(name: str, transform) -> None:
+        before = sum(len(c.patch) for c in changes)
+        before_tokens = sum(estimate_tokens(c.patch) for c in changes)
+        for change in changes:
+            header, hunks = split_hunks(change.patch)
+            if hunks:
+                change.patch = transform(change.path, header, hunks)
+        savings[name] = {
+            "bytes": before - sum(len(c.patch) for c in changes),
+            "tokens": before_tokens - sum(estimate_tokens(c.patch) for c in changes)
+        }
+
+    if "whitespace" in COMPACTION_PASSES:
+        apply("whitespace", lambda path, header, hunks: header + (
+            "".join(h for h in hunks if not is_whitespace_only_hunk(h, path)) or "[Changements d'espaces uniquement]\n"
+        ))
+
+    if "renames" in COMPACTION_PASSES:
+        # Déjà appliquée par git (-M -C) : l'économie est la taille du fichier qui n'est plus envoyé en entier
+        renamed = [c for c in changes if c.old_path]
+        sizes = get_blob_sizes(diff_range[-1], [c.path for c in renamed])
+        saved = sum(max(sizes.get(c.path, 0) - len(c.patch), 0) for c in renamed)
+        savings["renames"] = {"bytes": saved, "tokens": saved // 4}
+
+    if "literals" in COMPACTION_PASSES:
+        apply("literals", lambda path, header, hunks: header + "".join(collapse_literal_runs(h, path) for h in hunks))
+
+    if "context" in COMPACTION_PASSES:
+        apply("context", lambda path, header, hunks: header + "".join(trim_hunk_context(h) for h in hunks))
+
+    for name, saved in savings.items():
+        print(f"🗜️ Compaction {name}: -{saved['bytes']} octets (~{saved['tokens']} tokens)")
+    return savings
+
+# --- REVIEW PAR MORCEAUX (MAP-REDUCE) ---
+def split_by_tokens(text: str, limit: int) -> List[str]:
+    """Découpe un texte en fin de ligne en morceaux d'au plus `limit` tokens estimés"""
+    pieces = []
+    current = ""
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        tokens = estimate_tokens(line)
+        if current and current_tokens + tokens > limit:
+            pieces.append(current)
+            current = ""
+            current_tokens = 0
+        current += line
+        current_tokens += tokens
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_oversized_change(change: FileChange, budget: int) -> List[FileChange]:
+    """Découpe le diff d'un fichier trop volumineux en parties de hunks complets"""
+    header, hunks = split_hunks(change.patch)
+    limit = max(budget - estimate_tokens(header), 1)
+    groups = []
+    current = ""
+    current_tokens = 0
+    for hunk in hunks:
+        # Dernier recours : un hunk seul plus grand que le budget est coupé en fin de ligne
+        for piece in split_by_tokens(hunk, limit) if estimate_tokens(hunk) > limit else [hunk]:
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > limit:
+                groups.append(current)
+                current = ""
+                current_tokens = 0
+            current += piece
+            current_tokens += tokens
+    if current:
+        groups.append(current)
+
+    parts = []
+    for index, group in enumerate(groups, start=1):
+        added, deleted = count_hunk_lines(group)
+        parts.append(FileChange(
+            path=f"{change.path} (partie {index}/{len(groups)})",
+            added=added,
+            deleted=deleted,
+            binary=change.binary,
+            patch=header + group
+        ))
+    return parts
+
+def chunk_changes(changes: List[FileChange], budget: int) -> List[List[FileChange]]:
+    """Regroupe les fichiers en morceaux dont le contenu formaté tient dans le budget de tokens"""
+    pieces = []
+    for change in changes:
+        if change.patch and estimate_tokens(format_file_diff(change)) > budget:
+            overhead = estimate_tokens(format_file_diff(FileChange(f"{change.path} (partie 00/00)")))
+            pieces.extend(split_oversized_change(change, budget - overhead))
+        else:
+            pieces.append(change)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(format_file_diff(piece))
+        if current and current_tokens + tokens > budget:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def merge_review_reports(partials: List[Tuple[ReviewReport, int]], unit: str = "parties") -> ReviewReport:
+    """Fusionne les rapports partiels, notes pondérées par le nombre de lignes modifiées"""
+    from ai_reviewer_models import ReviewDetails, ReviewReport
+    total_weight = sum(weight for _, weight in partials)
+
+    def weighted(get_score) -> int:
+        return round(sum(get_score(report) * weight for report, weight in partials) / total_weight)
+
+    # Les morceaux les plus lourds donnent le ton du résumé, du conseil et des points listés en premier
+    ordered = [report for report, _ in sorted(partials, key=lambda p: p[1], reverse=True)]
+
+    def merged_points(attribute: str) -> List[str]:
+        points = []
+        for report in ordered:
+            for point in getattr(report, attribute):
+                if point not in points and point != "Aucun point identifié":
+                    points.append(point)
+        return points[:5]
+
+    return ReviewReport(
+        score_global=weighted(lambda r: r.score_global),
+        details=ReviewDetails(
+            SOLID=weighted(lambda r: r.details.SOLID),
+            Clarte=weighted(lambda r: r.details.Clarte),
+            Securite=weighted(lambda r: r.details.Securite),
+            Performance=weighted(lambda r: r.details.Performance)
+        ),
+        resume=f"[{len(partials)} {unit}] {ordered[0].resume}"[:200],
+        points_forts=merged_points('points_forts'),
+        points_faibles=merged_points('points_faibles'),
+        conseil_mentor=ordered[0].conseil_mentor
+    )
+
+def review_in_chunks(context_header: str, changes: List[FileChange], route: ReviewRoute) -> Optional[ReviewReport]:
+    """Analyse le changement par morceaux en parallèle (map) puis fusionne les rapports (reduce)"""
+    chunks = chunk_changes(changes, get_diff_budget(context_header + "PARTIE 00/00 DU CHANGEMENT\n"))
+    print(f"🧩 Review en {len(chunks)} morceaux ({MAX_PARALLEL_REVIEWS} en parallèle max)")
+
+    def review_chunk(index: int, chunk: List[FileChange]) -> Optional[Tuple[ReviewReport, int]]:
+        content = context_header + f"PARTIE {index}/{len(chunks)} DU CHANGEMENT\n"
+        content += "".join(format_file_diff(change) for change in chunk)
+        report_json = analyze_code(content, route)
+        report = parse_review_report(report_json) if report_json else None
+        if not report:
+            return None
+        return report, max(sum(c.added + c.deleted for c in chunk), 1)
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_REVIEWS) as executor:
+        results = list(executor.map(review_chunk, range(1, len(chunks) + 1), chunks))
+
+    partials = [result for result in results if result]
+    if len(partials) < len(chunks):
+        print(f"⚠️ {len(chunks) - len(partials)} morceau(x) sur {len(chunks)} sans rapport valide")
+    if not partials:
+        return None
+    return merge_review_reports(partials)
+
+# --- LECTURE DES FICHIERS (GIT CAT-FILE) ---
+class BlobReader:
+    """Processus `git cat-file --batch` persistant, partagé par l'analyse locale et le contexte étendu
+
+    Un seul processus git pour tout le run (ou toute la vie du service), redémarré s'il s'arrête."""
+
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            if self.process and self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.wait()
+            self.process = None
+
+    def read_one(self, name: str, max_bytes: int) -> Optional[bytes]:
+        """Contenu d'un objet, None s'il est absent, n'est pas un blob ou dépasse max_bytes (lu puis jeté)"""
+        self.process.stdin.write(name.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise OSError("git cat-file arrêté")
+        header = line.split()
+        if len(header) != 3 or not header[2].isdigit():
+            return None  # "<objet> missing"
+        size = int(header[2])
+        if header[1] == b"blob" and size <= max_bytes:
+            content = self.process.stdout.read(size + 1)
+            if len(content) != size + 1:
+                raise OSError("git cat-file arrêté")
+            return content[:-1]
+        remaining = size + 1
+        while remaining:
+            chunk = self.process.stdout.read(min(remaining, 64 * 1024))
+            if not chunk:
+                raise OSError("git cat-file arrêté")
+            remaining -= len(chunk)
+        return None
+
+    def read(self, revision: str, paths: List[str], max_bytes: int = MAX_BLOB_BYTES) -> Dict[str, str]:
+        contents = {}
+        with self.lock:
+            try:
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                for path in paths:
+                    if '\n' in path:
+                        continue  # Non adressable par le protocole ligne à ligne de --batch
+                    content = self.read_one(f"{revision}:{path}", max_bytes)
+                    if content is not None:
+                        contents[path] = content.decode("utf-8", errors="replace")
+            except (OSError, ValueError) as e:
+                print(f"⚠️ git cat-file interrompu ({e}), {len(contents)}/{len(paths)} fichier(s) lus")
+                self.process = None
+        return contents
+
+@lru_cache(maxsize=1)
+def get_blob_reader() -> BlobReader:
+    reader = BlobReader()
+    atexit.register(reader.close)
+    return reader
+
+def read_blobs(revision: str, paths: List[str]) -> Dict[str, str]:
+    """Contenu des fichiers à une révision, lus par le processus `git cat-file --batch` partagé"""
+    if not paths:
+        return {}
+    return get_blob_reader().read(revision, paths)
+
+# --- ANALYSE LOCALE PRÉALABLE ---
+@lru_cache(maxsize=1)
+def get_prepass_pool() -> ProcessPoolExecutor:
+    """Pool de processus partagé par les reviews du run (forkserver : sûr avec les threads en cours)"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=PREPASS_WORKERS, mp_context=context)
+
+def run_prepass(changes: List[FileChange], revision: str) -> Optional[list]:
+    """Indices locaux (await/requêtes en boucle, boucles imbriquées, fonctions qui grossissent, secrets)
+
+    Retourne None si l'analyse n'a pas pu aboutir dans le délai."""
+    from ai_reviewer_analysis import analyze_file_safe
+    targets = [c for c in changes if c.path.endswith(PREPASS_EXTENSIONS) and split_hunks(c.patch)[1]]
+    contents = read_blobs(revision, [c.path for c in targets])
+    jobs = [(c.path, contents[c.path], c.patch) for c in targets if c.path in contents]
+    if not jobs:
+        return []
+
+    try:
+        if PREPASS_WORKERS < 2 or sum(c.added for c in targets) < PREPASS_POOL_MIN_LINES:
+            results = [analyze_file_safe(*job) for job in jobs]
+        else:
+            chunksize = max(len(jobs) // (PREPASS_WORKERS * 2), 1)
+            results = list(get_prepass_pool().map(analyze_file_safe, *zip(*jobs), timeout=PREPASS_TIMEOUT, chunksize=chunksize))
+    except (FutureTimeoutError, BrokenExecutor, OSError) as e:
+        print(f"⚠️ Analyse locale abandonnée ({type(e).__name__}), review sans indices")
+        count_metric("prepass_failed")
+        return None
+
+    findings = []
+    for result in results:
+        if result is None:
+            count_metric("prepass_file_error")
+        else:
+            findings.extend(result)
+    findings.sort(key=lambda finding: (finding[0], finding[1]))
+    print(f"🔎 Analyse locale: {len(jobs)} fichier(s), {len(findings)} indice(s)")
+    return findings
+
+def format_prepass_table(findings: list) -> str:
+    """Tableau compact des indices pour l'en-tête du prompt"""
+    if not findings:
+        return "ANALYSE LOCALE PRÉALABLE : aucun indice détecté\n\n"
+    lines = ["ANALYSE LOCALE PRÉALABLE (indices automatiques à vérifier) :", "| Fichier:ligne | Indice | Détail |", "|---|---|---|"]
+    for path, line, kind, detail in findings[:PREPASS_MAX_FINDINGS]:
+        lines.append(f"| {path}:{line} | {kind} | {detail.replace('|', '/')} |")
+    if len(findings) > PREPASS_MAX_FINDINGS:
+        lines.append(f"| … | {len(findings) - PREPASS_MAX_FINDINGS} autre(s) indice(s) | |")
+    return "\n".join(lines) + "\n\n"
+
+# --- CONTEXTE DES FONCTIONS ENGLOBANTES ---
+HUNK_RANGE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+LITERAL_RUN_MARKER = re.compile(r"^\+… \[(\d+) lignes de données littérales omises\]$")
+
+def parse_hunk_range(hunk: str) -> Optional[Tuple[int, int, int, int, str]]:
+    """Début et taille des côtés ancien et nouveau d'un hunk, suivis du libellé de fonction ajouté par git"""
+    match = HUNK_RANGE.match(hunk.split('\n', 1)[0])
+    if not match:
+        return None
+    old_start, old_count, new_start, new_count, label = match.groups()
+    return int(old_start), int(old_count or 1), int(new_start), int(new_count or 1), label
+
+def expand_hunk(hunk: str, lines: List[str], python: bool, shown_until: int, next_first: int) -> Optional[Tuple[str, int]]:
+    """Hunk élargi à son bloc englobant et fin (exclue) de la plage affichée ; None s'il n'y a rien à élargir
+
+    Les lignes de la nouvelle version sont relues dans le blob : le contexte retiré par la compaction est
+    restauré, sans déborder sur les lignes déjà montrées par le hunk précédent ni sur le hunk suivant."""
+    from ai_reviewer_analysis import find_enclosing_block
+    parsed = parse_hunk_range(hunk)
+    if not parsed or parsed[3] == 0:
+        return None
+    old_start, old_count, new_start, new_count, label = parsed
+    first, stop = new_start - 1, new_start - 1 + new_count
+    if stop > len(lines):
+        return None
+    block = find_enclosing_block(lines, first, stop - 1, python, FUNCTION_CONTEXT_MAX_LINES)
+    if block is None:
+        return None
+    start = max(block[0], shown_until)
+    end = min(max(block[1] + 1, stop), next_first)
+
+    body = [f" {lines[index]}" for index in range(start, first)]
+    position = first
+    for line in hunk.split('\n')[1:]:
+        if not line or line == " …":
+            continue
+        marker = LITERAL_RUN_MARKER.match(line)
+        if marker:
+            body.append(line)
+            position += int(marker.group(1))
+        elif line[0] in ('-', '\\'):
+            body.append(line)
+        else:
+            # Ligne ajoutée ou de contexte : les lignes sautées depuis la précédente redeviennent du contexte
+            while position < stop and lines[position] != line[1:]:
+                body.append(f" {lines[position]}")
+                position += 1
+            if position >= stop:
+                return None  # Hunk et blob désalignés : hunk laissé tel quel
+            body.append(line)
+            position += 1
+    body.extend(f" {lines[index]}" for index in range(position, end))
+
+    extra = (first - start) + (end - stop)
+    header = f"@@ -{old_start - (first - start)},{old_count + extra} +{start + 1},{end - start} @@{label}"
+    expanded = header + "\n" + "\n".join(body) + "\n"
+    return (expanded, end) if expanded != hunk else None
+
+def expand_function_context(changes: List[FileChange], revision: str, budget: int) -> int:
+    """Élargit les hunks du code à leur fonction englobante tant que le budget le permet ; retourne les tokens ajoutés"""
+    targets = [c for c in changes if c.path.endswith(FUNCTION_CONTEXT_EXTENSIONS) and split_hunks(c.patch)[1]]
+    # Même priorité que le remplissage du prompt : le code source profite du budget avant la configuration
+    targets.sort(key=lambda c: EXTENSION_PRIORITY.get(os.path.splitext(c.path)[1], len(EXTENSION_PRIORITY)))
+    contents = read_blobs(revision, [c.path for c in targets])
+    used = 0
+    expanded = 0
+    for change in targets:
+        if change.path not in contents:
+            continue
+        lines = contents[change.path].split('\n')
+        python = change.path.endswith('.py')
+        header, hunks = split_hunks(change.patch)
+        ranges = [parse_hunk_range(hunk) for hunk in hunks]
+        shown_until = 0
+        for index, hunk in enumerate(hunks):
+            following = ranges[index + 1] if index + 1 < len(ranges) else None
+            next_first = following[2] - 1 if following else len(lines)
+            result = expand_hunk(hunk, lines, python, shown_until, next_first)
+            if result:
+                cost = estimate_tokens(result[0]) - estimate_tokens(hunk)
+                if used + cost <= budget:
+                    hunks[index], shown_until = result
+                    used += cost
+                    expanded += 1
+                    continue
+            if ranges[index]:
+                shown_until = ranges[index][2] - 1 + ranges[index][3]
+        change.patch = header + "".join(hunks)
+
+    RUN_METRICS["function_context"] = {"hunks": expanded, "tokens": used}
+    print(f"🧩 Contexte étendu: {expanded} hunk(s) élargi(s) à leur fonction (~{used} tokens)")
+    return used
+
+# --- ROUTAGE ET NOTATION LOCALE ---
+def get_change_magnitude(total_changes: int) -> Tuple[int, str]:
+    """Niveau (index dans CHANGE_MAGNITUDES) et libellé de l'ampleur d'un changement"""
+    for level, (limit, label) in enumerate(CHANGE_MAGNITUDES):
+        if limit is None or total_changes < limit:
+            return level, label
+    return len(CHANGE_MAGNITUDES) - 1, CHANGE_MAGNITUDES[-1][1]
+
+def route_review(changes: List[FileChange], level: int, prepass: bool = False) -> ReviewRoute:
+    """Choisit modèle et effort de raisonnement d'après l'ampleur, les types de fichiers et l'analyse locale"""
+    mix = "config" if all(c.path.endswith(CONFIG_EXTENSIONS) for c in changes) else "code"
+    model, effort = MODEL_ROUTES[mix][level]
+    if prepass and level in PREPASS_LOWERED_LEVELS and effort == "medium":
+        effort = "low"
+    return ReviewRoute(model, effort)
+
+def scan_comment_line(path: str, line: str, closing: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """Vrai si la ligne est vide ou entièrement un commentaire, et fermeture du bloc encore ouvert après elle"""
+    text = line.strip()
+    if not text:
+        return True, closing
+    if closing:
+        if closing not in text:
+            return True, closing
+        # Bloc refermé : la ligne n'est un commentaire que si rien ne suit la fermeture
+        return not text.split(closing, 1)[1].strip(), None
+    extension = os.path.splitext(path)[1]
+    if text.startswith(COMMENT_PREFIXES.get(extension, ())) and not text.startswith("#["):  # #[...] : attribut PHP 8
+        return True, None
+    for opening, block_closing in BLOCK_COMMENTS.get(extension, ()):
+        if text.startswith(opening):
+            rest = text[len(opening):]
+            if block_closing not in rest:
+                return True, block_closing
+            return not rest.split(block_closing, 1)[1].strip(), None
+    return False, None
+
+def is_comment_only_hunk(path: str, hunk: str) -> bool:
+    """Vrai si toutes les lignes modifiées du hunk sont des commentaires
+
+    L'état des commentaires bloc est suivi séparément sur l'ancienne et la nouvelle version, depuis le
+    début du hunk : une ligne "* ..." dont l'ouverture "/*" n'est pas visible compte comme du code."""
+    closing = {'-': None, '+': None}
+    for line in hunk.split('\n')[1:]:
+        marker = line[:1]
+        if marker == ' ':
+            for side in closing:
+                _, closing[side] = scan_comment_line(path, line[1:], closing[side])
+        elif marker in closing:
+            comment, closing[marker] = scan_comment_line(path, line[1:], closing[marker])
+            if not comment:
+                return False
+    return True
+
+def classify_trivial_change(changes: List[FileChange]) -> Optional[str]:
+    """"whitespace" ou "comments" si tous les hunks ne touchent qu'espaces ou commentaires, None sinon"""
+    kind = "whitespace"
+    for change in changes:
+        _, hunks = split_hunks(change.patch)
+        if not hunks or change.truncated:
+            # Fichier décrit sans diff (binaire, supprimé, volumineux) ou coupé au plafond : rien ne prouve que c'est trivial
+            return None
+        for hunk in hunks:
+            if is_whitespace_only_hunk(hunk, change.path):
+                continue
+            if not is_comment_only_hunk(change.path, hunk):
+                return None
+            kind = "comments"
+    return kind
+
+def score_trivial_change(kind: str, changes: List[FileChange]) -> ReviewReport:
+    """Note déterministe d'un changement cosmétique (barème du prompt : 8-12/20 pour du trivial)"""
+    from ai_reviewer_models import ReviewDetails, ReviewReport
+    total = sum(c.added + c.deleted for c in changes)
+    if kind == "whitespace":
+        clarte, subject = 11, "Mise en forme uniquement (espaces, indentation)"
+        advice = "Confie la mise en forme à un formateur automatique (Prettier, Black, php-cs-fixer) lancé avant chaque commit."
+    else:
+        clarte, subject = 13, "Commentaires et documentation uniquement"
+        advice = "Garde les commentaires pour expliquer le pourquoi ; un nommage explicite rend souvent le quoi inutile."
+    return ReviewReport(
+        score_global=10 if kind == "whitespace" else 11,
+        details=ReviewDetails(SOLID=10, Clarte=clarte, Securite=10, Performance=10),
+        resume=f"{subject} : {len(changes)} fichier(s), {total} ligne(s), aucun changement de comportement. Noté localement.",
+        points_forts=["Aucun risque de régression : le code exécuté est inchangé"],
+        points_faibles=["Changement cosmétique : rien à évaluer sur la conception, la sécurité ou la performance"],
+        conseil_mentor=advice
+    )
+
+# --- REVIEW D'UNE PLAGE DE RÉVISIONS ---
+def review_changes(changed_files: List[FileChange], diff_range: List[str], commit_hash: str,
+                   commit_message: str, commit_author: str) -> RangeReview:
+    """Charge, compacte et fait analyser les changements d'une plage (cache, morceaux ou appel unique)"""
+    print(f"📌 Commit: {commit_message} ({commit_hash})")
+    print(f"👤 Auteur: {commit_author}")
+
+    print(f"\n📋 Fichiers détectés: {len(changed_files)}")
+    for change in changed_files:
+        print(f"  - {change.path}")
+
+    # Un seul appel git pour les diffs de tous les fichiers retenus
+    with timed_phase("diff_ingestion"):
+        load_file_patches(changed_files, diff_range)
+
+    total_added = sum(c.added for c in changed_files)
+    total_deleted = sum(c.deleted for c in changed_files)
+
+    # Espaces ou commentaires seulement : note locale, avant que la compaction ne réécrive les hunks
+    trivial_kind = classify_trivial_change(changed_files) if LOCAL_FAST_PATH else None
+    if trivial_kind:
+        print(f"\n⚡ Changement trivial ({trivial_kind}) : note calculée localement, pas d'appel à l'IA")
+        count_metric("local_review")
+        return RangeReview(
+            commit_hash=commit_hash,
+            commit_message=commit_message,
+            commit_author=commit_author,
+            report=score_trivial_change(trivial_kind, changed_files),
+            files=len(changed_files),
+            lines_added=total_added,
+            lines_deleted=total_deleted,
+            diff_chars=sum(len(c.patch) for c in changed_files),
+            review_mode="local",
+            engine="heuristique locale"
+        )
+
+    # Indices locaux calculés sur les hunks complets, avant compaction
+    findings = None
+    if PREPASS:
+        with timed_phase("prepass"):
+            findings = run_prepass(changed_files, diff_range[-1])
+
+    with timed_phase("prompt_build"):
+        compact_changes(changed_files, diff_range)
+    total_chars = sum(len(c.patch) for c in changed_files)
+
+    # Ampleur du changement, qui décide aussi du modèle et de l'effort de raisonnement
+    total_changes = total_added + total_deleted
+    magnitude_level, change_magnitude = get_change_magnitude(total_changes)
+    route = route_review(changed_files, magnitude_level, prepass=findings is not None)
+    count_metric(f"route_{route.effort}")
+    print(f"\n🚀 Analyse IA en cours avec {route.describe()}...\n")
+
+    # En-tête propre au run, placé après le préfixe statique (grille et consignes d'ampleur)
+    context_header = f"""CONTEXTE DU COMMIT :
+Commit: {commit_hash}
+Message: {commit_message}
+Fichiers modifiés: {len(changed_files)}
+Ampleur: {change_magnitude} (+{total_added}/-{total_deleted} lignes)
+
+{format_prepass_table(findings) if findings is not None else ""}CHANGEMENTS À ANALYSER :
+"""
+
+    with timed_phase("prompt_build"):
+        diff_budget = get_diff_budget(context_header)
+        total_tokens = sum(estimate_tokens(format_file_diff(change)) for change in changed_files)
+        # Budget restant (diff entier déjà inclus) : les hunks sont élargis à leur fonction, avant le calcul de la clé de cache
+        if FUNCTION_CONTEXT and total_tokens < diff_budget:
+            total_tokens += expand_function_context(changed_files, diff_range[-1], diff_budget - total_tokens)
+            total_chars = sum(len(c.patch) for c in changed_files)
+
+    print(f"📊 Changements détectés: {change_magnitude}")
+    print(f"📊 Détails: +{total_added} / -{total_deleted} lignes sur {len(changed_files)} fichier(s)")
+    print(f"📊 Total à analyser: {total_chars} caractères (~{total_tokens} tokens, budget diffs: {diff_budget})")
+    RUN_METRICS["diff_budget"] = diff_budget
+
+    # Un diff identique déjà analysé (rebase, re-run, même arbre sur une autre branche) n'est pas renvoyé à l'IA
+    with timed_phase("prompt_build"):
+        cache_key = compute_cache_key(changed_files, route)
+    cached_report = load_cached_review(cache_key)
+
+    if cached_report:
+        print(f"♻️ Review trouvée en cache ({cache_key[:12]}), pas d'appel à l'IA")
+        review_mode = "cache"
+        validated_report = cached_report
+    elif CHUNKED_REVIEW and total_tokens > diff_budget:
+        # Changement trop gros pour un seul appel : tout le diff est couvert par morceaux
+        review_mode = "chunked"
+        with timed_phase("model_call"):
+            validated_report = review_in_chunks(context_header, changed_files, route)
+        if validated_report:
+            store_cached_review(cache_key, validated_report)
+    else:
+        # Hunks entiers retenus par priorité, les fichiers omis sont résumés avec leurs stats
+        review_mode = "single"
+        with timed_phase("prompt_build"):
+            files_content, omitted = pack_diffs(changed_files, diff_budget)
+        if omitted:
+            print(f"⚠️ Budget de {MAX_PROMPT_TOKENS} tokens atteint: {len(omitted)} fichier(s) omis ou partiels")
+            for line in omitted:
+                print(f"  - {line}")
+
+        with timed_phase("model_call"):
+            report = analyze_code(context_header + files_content, route)
+        # Rapport extrait et validé une seule fois pour toutes les destinations
+        with timed_phase("parse"):
+            validated_report = parse_review_report(report) if report else None
+        if validated_report:
+            store_cached_review(cache_key, validated_report)
+
+    return RangeReview(
+        commit_hash=commit_hash,
+        commit_message=commit_message,
+        commit_author=commit_author,
+        report=validated_report,
+        files=len(changed_files),
+        lines_added=total_added,
+        lines_deleted=total_deleted,
+        diff_chars=total_chars,
+        estimated_tokens=total_tokens,
+        review_mode=review_mode,
+        engine=route.describe()
+    )
+
+def review_commit(sha: str) -> Optional[RangeReview]:
+    """Review d'un commit isolé contre son parent ; None s'il ne touche aucun fichier analysé"""
+    commit_range = [get_parent_revision(sha), sha]
+    changes = get_changed_files(commit_range)
+    if not changes:
+        return None
+    with timed_phase("diff_ingestion"):
+        commit_hash, commit_message, commit_author = get_commit_info(sha)
+    return review_changes(changes, commit_range, commit_hash, commit_message, commit_author)
+
+def review_pushed_commits(commits: List[str]) -> List[RangeReview]:
+    """Review de chaque commit du push, en parallèle (mode per-commit)"""
+    if len(commits) > MAX_COMMITS_REVIEWED:
+        print(f"⚠️ {len(commits)} commits poussés, seuls les {MAX_COMMITS_REVIEWED} derniers sont reviewés")
+        commits = commits[-MAX_COMMITS_REVIEWED:]
+    print(f"🧵 Review de {len(commits)} commits ({MAX_PARALLEL_COMMITS} en parallèle max)")
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_COMMITS) as executor:
+        reviews = list(executor.map(review_commit, commits))
+    return [review for review in reviews if review]
+
+def merge_commit_reviews(reviews: List[RangeReview]) -> RangeReview:
+    """Agrège les reviews par commit en une seule (notes pondérées par le nombre de lignes modifiées)"""
+    reviewed = [(r.report, max(r.lines_added + r.lines_deleted, 1)) for r in reviews if r.report]
+    if len(reviewed) < len(reviews):
+        print(f"⚠️ {len(reviews) - len(reviewed)} commit(s) sur {len(reviews)} sans rapport valide")
+    head = reviews[-1]
+    return RangeReview(
+        commit_hash=f"{reviews[0].commit_hash}..{head.commit_hash}",
+        commit_message=f"{len(reviews)} commits reviewés : {head.commit_message}",
+        commit_author=head.commit_author,
+        report=merge_review_reports(reviewed, unit="commits") if reviewed else None,
+        files=sum(r.files for r in reviews),
+        lines_added=sum(r.lines_added for r in reviews),
+        lines_deleted=sum(r.lines_deleted for r in reviews),
+        diff_chars=sum(r.diff_chars for r in reviews),
+        estimated_tokens=sum(r.estimated_tokens for r in reviews),
+        review_mode="per-commit",
+        engine=", ".join(sorted({r.engine for r in reviews}))
+    )
+
+# --- BACKFILL HISTORIQUE ---
+def iter_commits(revisions: List[str], filters: List[str]):
+    """Commits d'une plage `git rev-list`, du plus ancien au plus récent, lus au fil de l'eau"""
+    process = subprocess.Popen(
+        ["git", "rev-list", "--reverse", "--no-merges", *filters, *revisions, "--"],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        for line in process.stdout:
+            yield line.strip()
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            print(f"⚠️ git rev-list a échoué (code {process.returncode})")
+
+def load_backfill_checkpoint(path: str) -> set:
+    """SHAs déjà traités : le fichier JSONL de sortie sert lui-même de point de reprise"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["sha"])
+            except (ValueError, KeyError, TypeError):
+                continue  # Ligne tronquée par une interruption
+    return done
+
+def wait_for_model_circuit() -> None:
+    """Met le worker en pause tant que le circuit du modèle est ouvert (dans la limite de l'échéance)"""
+    cooldown = get_circuit_cooldown("OpenAI")
+    if cooldown > 0:
+        print(f"⏸️ Circuit OpenAI ouvert : backfill en pause {cooldown:.0f}s")
+        time.sleep(min(cooldown, max(remaining_time_budget(), 0)))
+
+def backfill_commit(sha: str) -> dict:
+    """Enregistrement JSONL d'un commit : rapport validé, commit ignoré ou erreur
+
+    Un commit dont la review échoue parce que le circuit du modèle s'est ouvert (rafale de 429) est
+    repris après la pause, au lieu d'être consommé comme un échec."""
+    try:
+        for attempt in range(BACKFILL_CIRCUIT_ATTEMPTS):
+            wait_for_model_circuit()
+            review = review_commit(sha)
+            if review is None or review.report is not None or not get_circuit_cooldown("OpenAI"):
+                break
+            count_metric("backfill_circuit_pause")
+        if review is None:
+            return {"sha": sha, "skipped": "aucun fichier pertinent"}
+        if review.report is None:
+            return {"sha": sha, "error": "aucun rapport valide"}
+        date = run_git(["show", "-s", "--format=%aI", sha]).strip()
+        return {
+            "sha": sha,
+            "date": date,
+            "author": review.commit_author,
+            "message": review.commit_message,
+            "files": review.files,
+            "lines_added": review.lines_added,
+            "lines_deleted": review.lines_deleted,
+            "review_mode": review.review_mode,
+            "engine": review.engine,
+            "report": review.report.model_dump(),
+        }
+    except Exception as e:
+        return {"sha": sha, "error": str(e)}
+
+def run_backfill(args: argparse.Namespace) -> int:
+    """Note tout un historique dans un fichier JSONL, reprenable, sans aucune notification"""
+    global RUN_DEADLINE
+    # Pas d'échéance globale par défaut : un backfill peut durer des heures
+    RUN_DEADLINE = time.monotonic() + args.time_budget if args.time_budget else float("inf")
+
+    filters = [f"--{name.replace('_', '-')}={getattr(args, name)}" for name in ("since", "until", "author", "max_count")
+               if getattr(args, name)]
+    done = load_backfill_checkpoint(args.output)
+    if done:
+        print(f"♻️ Reprise: {len(done)} commit(s) déjà présents dans {args.output}")
+
+    counts = {"reviewed": 0, "skipped": 0, "failed": 0}
+
+    def write_record(out, record: dict) -> None:
+        status = "failed" if "error" in record else "skipped" if "skipped" in record else "reviewed"
+        counts[status] += 1
+        if status == "failed":
+            # Non écrit : le commit sera retenté à la prochaine reprise
+            print(f"❌ {record['sha'][:7]}: {record['error']}")
+            return
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        score = f"{record['report']['score_global']}/20" if status == "reviewed" else "ignoré"
+        print(f"📈 [{sum(counts.values())}] {record['sha'][:7]} {score}")
+
+    print(f"🗂️ Backfill de {' '.join(args.revisions)} vers {args.output} ({args.workers} en parallèle max)")
+    with open(args.output, "a+", encoding="utf-8") as out:
+        # Une interruption en pleine écriture laisse une ligne sans fin : la suivante ne doit pas s'y coller
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                out.write("\n")
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            pending = set()
+            for sha in iter_commits(args.revisions, filters):
+                if sha in done:
+                    continue
+                # Nombre de commits en vol borné : l'historique n'est jamais chargé en entier
+                if len(pending) >= args.workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write_record(out, future.result())
+                pending.add(executor.submit(backfill_commit, sha))
+            for future in wait(pending).done:
+                write_record(out, future.result())
+
+    RUN_METRICS.update(backfill=counts)
+    print(f"✅ Backfill terminé: {counts['reviewed']} noté(s), {counts['skipped']} ignoré(s), {counts['failed']} en échec")
+    return 1 if counts["failed"] else 0
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Sans sous-commande : review CI du push ou de la PR courante"""
+    parser = argparse.ArgumentParser(description="AI Code Reviewer - CulturiaQuests")
+    subparsers = parser.add_subparsers(dest="command")
+    backfill = subparsers.add_parser("backfill", help="Note un historique de commits dans un fichier JSONL (sans notification)")
+    backfill.add_argument("revisions", nargs="*", default=["HEAD"], help="Révisions passées à git rev-list (ex: v1.0..main)")
+    backfill.add_argument("--since", help="Commits postérieurs à cette date (git rev-list --since)")
+    backfill.add_argument("--until", help="Commits antérieurs à cette date (git rev-list --until)")
+    backfill.add_argument("--author", help="Filtre sur l'auteur (git rev-list --author)")
+    backfill.add_argument("--max-count", type=int, help="Nombre maximum de commits parcourus")
+    backfill.add_argument("--output", default="ai-review-backfill.jsonl", help="Fichier JSONL de sortie et de reprise")
+    backfill.add_argument("--workers", type=int, default=MAX_PARALLEL_COMMITS, help="Commits analysés en parallèle")
+    backfill.add_argument("--time-budget", type=float, default=0, help="Échéance globale en secondes (0 : aucune)")
+    serve = subparsers.add_parser("serve", help="Service HTTP local recevant les webhooks push/PR de GitHub")
+    serve.add_argument("--host", default="127.0.0.1", help="Adresse d'écoute")
+    serve.add_argument("--port", type=int, default=8080, help="Port d'écoute (0 : port libre choisi par le système)")
+    serve.add_argument("--workers", type=int, default=SERVICE_MAX_WORKERS, help="Reviews exécutées en parallèle")
+    return parser.parse_args(argv)
+
+# --- FILE D'ENVOI DISCORD ---
+@dataclass
+class DiscordMessage:
+    """Embed de review en attente d'envoi, avec la mention de son auteur"""
+    embed: dict
+    mention: str = ""
+    queued_at: float = field(default_factory=time.time)
+    delivered: Optional[bool] = None  # None : en attente ; False : rejeté par Discord
+
+def get_embed_chars(embed: dict) -> int:
+    """Texte d'un embed compté par Discord dans la limite par message"""
+    fields = embed.get("fields", [])
+    return (len(embed.get("title", "")) + len(embed.get("description", "")) + len(embed.get("footer", {}).get("text", ""))
+            + sum(len(f["name"]) + len(f["value"]) for f in fields))
+
+class DiscordQueue:
+    """File d'envoi du webhook Discord partagée par les reviews du processus
+
+    Les embeds en attente partent par lots de DISCORD_MAX_EMBEDS_PER_MESSAGE, au rythme annoncé par les
+    en-têtes X-RateLimit-* ; ceux qu'une erreur transitoire empêche d'envoyer sont écrits dans le cache."""
+
+    def __init__(self, outbox_path: str):
+        self.outbox_path = outbox_path
+        self.lock = threading.Lock()  # Protège pending
+        self.send_lock = threading.Lock()  # Un seul envoi à la fois : le quota du webhook est commun
+        self.reset_at = 0.0  # Instant (monotonic) de réinitialisation d'un quota épuisé
+        self.pending: List[DiscordMessage] = self.load_outbox()
+
+    def load_outbox(self) -> List[DiscordMessage]:
+        """Messages non livrés par un run précédent, hors messages expirés"""
+        messages = []
+        try:
+            with open(self.outbox_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        messages.append(DiscordMessage(**json.loads(line)))
+                    except (ValueError, TypeError):
+                        continue
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            print(f"⚠️ File d'envoi Discord illisible: {e}")
+            return []
+        messages = [m for m in messages if time.time() - m.queued_at <= REVIEW_CACHE_MAX_AGE_DAYS * 86400][-DISCORD_OUTBOX_MAX_MESSAGES:]
+        if messages:
+            print(f"📮 {len(messages)} message(s) Discord en attente d'un run précédent")
+        return messages
+
+    def save_outbox(self, messages: List[DiscordMessage]) -> None:
+        """Réécrit la file persistée, supprimée une fois vide"""
+        try:
+            if not messages:
+                if os.path.exists(self.outbox_path):
+                    os.remove(self.outbox_path)
+                return
+            os.makedirs(os.path.dirname(self.outbox_path) or ".", exist_ok=True)
+            tmp_path = f"{self.outbox_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for message in messages:
+                    f.write(json.dumps({"embed": message.embed, "mention": message.mention, "queued_at": message.queued_at}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.outbox_path)
+            print(f"💾 {len(messages)} message(s) Discord conservé(s) pour le prochain envoi")
+        except OSError as e:
+            print(f"⚠️ Impossible d'écrire la file d'envoi Discord: {e}")
+
+    def take_batch(self) -> List[DiscordMessage]:
+        """Premiers messages en attente tenant dans un seul message Discord (au moins un)"""
+        batch = []
+        chars = 0
+        with self.lock:
+            while self.pending and len(batch) < DISCORD_MAX_EMBEDS_PER_MESSAGE:
+                size = get_embed_chars(self.pending[0].embed)
+                if batch and chars + size > DISCORD_MAX_EMBED_CHARS_PER_MESSAGE:
+                    break
+                batch.append(self.pending.pop(0))
+                chars += size
+        return batch
+
+    def update_rate_limit(self, headers) -> None:
+        """Mémorise l'épuisement du quota annoncé par le webhook (X-RateLimit-Remaining / Reset-After)"""
+        reset_after = parse_duration(headers.get("x-ratelimit-reset-after", ""))
+        if headers.get("x-ratelimit-remaining") == "0" and reset_after is not None:
+            self.reset_at = time.monotonic() + min(reset_after, RETRY_MAX_HEADER_DELAY)
+
+    def post(self, payload: dict):
+        try:
+            response = http_request("POST", DISCORD_WEBHOOK, json=payload)
+        except RetryableHTTPError as e:
+            # 429 : Retry-After est appliqué par call_with_retry, le quota est mémorisé pour les lots suivants
+            self.update_rate_limit(e.response.headers)
+            raise
+        self.update_rate_limit(response.headers)
+        return response
+
+    def send_batch(self, batch: List[DiscordMessage]) -> Optional[bool]:
+        """Envoie un lot : True si livré, False si rejeté par Discord, None si à réessayer plus tard"""
+        wait = self.reset_at - time.monotonic()
+        if wait > 0:
+            if wait >= remaining_time_budget():
+                return None
+            print(f"⏳ Quota du webhook Discord atteint, envoi dans {wait:.1f}s")
+            time.sleep(wait)
+
+        payload = {"embeds": [message.embed for message in batch]}
+        mentions = list(dict.fromkeys(message.mention for message in batch if message.mention))
+        if mentions:
+            notice = "Nouvelle code review disponible !" if len(batch) == 1 else f"{len(batch)} nouvelles code reviews disponibles !"
+            payload["content"] = f"{' '.join(mentions)} {notice}"
+        try:
+            response = call_with_retry("Discord", self.post, payload)
+        except (OSError, RetryableHTTPError, CircuitOpenError, TimeoutError) as e:
+            # requests.RequestException hérite d'OSError
+            print(f"❌ Erreur réseau Discord: {e}")
+            return None
+
+        count_metric("discord_messages")
+        if response.status_code in (200, 204):
+            print("✅ Rapport envoyé sur Discord avec succès" if len(batch) == 1 else f"✅ {len(batch)} rapports envoyés sur Discord en un message")
+            return True
+        print(f"⚠️ Discord a répondu avec le code {response.status_code}")
+        return False
+
+    def flush(self) -> None:
+        """Vide la file par lots ; sur erreur transitoire, le reste attend le prochain envoi ou le prochain run"""
+        with self.send_lock:
+            attempted = False
+            while True:
+                batch = self.take_batch()
+                if not batch:
+                    break
+                attempted = True
+                delivered = self.send_batch(batch)
+                if delivered is None:
+                    # Gardé en tête de file (les plus anciens abandonnés au-delà du plafond) et persisté
+                    with self.lock:
+                        self.pending[:0] = batch
+                        del self.pending[:-DISCORD_OUTBOX_MAX_MESSAGES]
+                    count_metric("discord_deferred")
+                    break
+                for message in batch:
+                    message.delivered = delivered
+            if attempted:
+                with self.lock:
+                    remaining = list(self.pending)
+                self.save_outbox(remaining)
+
+    def deliver(self, message: DiscordMessage) -> bool:
+        """Met un embed en file et vide la file : il part avec les messages déjà en attente"""
+        with self.lock:
+            self.pending.append(message)
+        self.flush()
+        return message.delivered is True
+
+@lru_cache(maxsize=1)
+def get_discord_queue() -> DiscordQueue:
+    """File partagée par le run (ou par toutes les reviews du service), chargée depuis le cache"""
+    return DiscordQueue(os.path.join(REVIEW_CACHE_DIR, DISCORD_OUTBOX_FILE))
+
+# --- NOTIFICATIONS ---
 def get_discord_mention(author: str) -> str:
     """Retourne la mention Discord de l'auteur si connu, sinon le nom"""
     # Normalise le nom (lowercase et supprime les espaces)
@@ -354,39 +2495,10 @@ def get_discord_mention(author: str) -> str:
     else:
         return author
 
-def send_discord_notification(report_json: str, commit_hash: str, commit_message: str, commit_author: str, change_context: str = "") -> bool:
-    """Envoie le rapport formaté sur Discord avec validation stricte"""
+def send_discord_notification(report: ReviewReport, context: ReviewContext) -> bool:
+    """Envoie le rapport formaté sur Discord, groupé avec les messages en attente"""
     try:
-        # Nettoyage des balises Markdown et espaces
-        cleaned_json = report_json.replace("```json", "").replace("```", "").strip()
-        
-        # Nettoyage supplémentaire : extraction du JSON si du texte est présent avant/après
-        # Cherche le premier { et le dernier }
-        start_idx = cleaned_json.find('{')
-        end_idx = cleaned_json.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1:
-            cleaned_json = cleaned_json[start_idx:end_idx+1]
-        
-        # Tentative de parsing JSON brut
-        try:
-            raw_data = json.loads(cleaned_json)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON invalide reçu de l'IA: {e}")
-            print(f"Extrait du contenu: {cleaned_json[:500]}...")
-            return False
-        
-        # Validation stricte avec Pydantic
-        try:
-            validated_report = ReviewReport(**raw_data)
-        except ValidationError as e:
-            print(f"❌ Schéma JSON invalide (validation Pydantic échouée):")
-            print(e)
-            print(f"Données reçues: {raw_data}")
-            return False
-        
-        # Conversion en dict avec données validées et sanitées
-        data = validated_report.model_dump()
+        data = report.model_dump()
         
         # Couleur selon la note (Vert >= 15, Orange >= 10, Rouge < 10)
         score = data['score_global']
@@ -407,12 +2519,20 @@ def send_discord_notification(report_json: str, commit_hash: str, commit_message
         if len(points_faibles_text) > 1024:
             points_faibles_text = points_faibles_text[:1020] + "..."
 
+        # Mode per-commit : une ligne par commit du push dans l'embed agrégé
+        commits_text = "\n".join(
+            f"`{commit_hash}` {f'{score}/20' if score is not None else 'échec'} — {message[:60]}"
+            for commit_hash, message, score in context.commit_reviews
+        )
+        if len(commits_text) > 1024:
+            commits_text = commits_text[:1020] + "..."
+
         # Construction de la description avec contexte des changements
-        author_mention = get_discord_mention(commit_author)
-        description = f"**{commit_message[:100]}** (`{commit_hash}`)\n"
+        author_mention = get_discord_mention(context.commit_author)
+        description = f"**{context.commit_message[:100]}** (`{context.commit_hash}`)\n"
         description += f"👤 Auteur : {author_mention}\n"
-        if change_context:
-            description += f"📦 {change_context}\n"
+        if context.change_context:
+            description += f"📦 {context.change_context}\n"
         description += f"\n{data['resume'][:200]}"
 
         embed = {
@@ -427,38 +2547,23 @@ def send_discord_notification(report_json: str, commit_hash: str, commit_message
                 {"name": "✅ Top", "value": points_forts_text, "inline": False},
                 {"name": "⚠️ Flop", "value": points_faibles_text, "inline": False},
                 {"name": "💡 Conseil", "value": data['conseil_mentor'][:300], "inline": False}
-            ],
-            "footer": {"text": f"Moteur: {MODEL_NAME} • CulturiaQuests CI/CD"}
+            ] + ([{"name": "📚 Commits", "value": commits_text, "inline": False}] if commits_text else []),
+            "footer": {"text": f"Moteur: {context.engine} • CulturiaQuests CI/CD"}
         }
 
-        # Prépare le payload avec mention de l'auteur
-        payload = {"embeds": [embed]}
+        # Mention en texte si l'auteur est connu (pour notifier), regroupée avec celles du même message
+        message = DiscordMessage(embed, author_mention if author_mention.startswith("<@") else "")
+        return get_discord_queue().deliver(message)
 
-        # Ajoute une mention en texte si l'auteur est connu (pour notifier)
-        if author_mention.startswith("<@"):
-            payload["content"] = f"{author_mention} Nouvelle code review disponible !"
-
-        response = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
-        
-        if response.status_code == 204:
-            print("✅ Rapport envoyé sur Discord avec succès")
-            return True
-        else:
-            print(f"⚠️ Discord a répondu avec le code {response.status_code}")
-            return False
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Erreur réseau Discord: {e}")
-        return False
     except Exception as e:
         print(f"❌ Erreur inattendue lors de l'envoi Discord: {e}")
         return False
 
-def post_github_pr_comment(report_json: str, change_context: str = "") -> bool:
+def post_github_pr_comment(report: ReviewReport, context: ReviewContext) -> bool:
     """Poste un commentaire de review sur la Pull Request GitHub"""
     try:
         # Vérifie si on est dans le contexte d'une PR
-        if GITHUB_EVENT_NAME != "pull_request" or not GITHUB_PR_NUMBER:
+        if not context.pr_number:
             print("ℹ️ Pas de PR détectée, skip du commentaire GitHub")
             return False
 
@@ -466,26 +2571,7 @@ def post_github_pr_comment(report_json: str, change_context: str = "") -> bool:
             print("⚠️ GITHUB_TOKEN ou GITHUB_REPOSITORY manquant")
             return False
 
-        # Nettoyage et parsing du JSON
-        cleaned_json = report_json.replace("```json", "").replace("```", "").strip()
-        start_idx = cleaned_json.find('{')
-        end_idx = cleaned_json.rfind('}')
-
-        if start_idx != -1 and end_idx != -1:
-            cleaned_json = cleaned_json[start_idx:end_idx+1]
-
-        try:
-            raw_data = json.loads(cleaned_json)
-            validated_report = ReviewReport(**raw_data)
-            data = validated_report.model_dump()
-        except (json.JSONDecodeError, ValidationError) as e:
-            print(f"❌ JSON invalide pour GitHub: {e}")
-            return False
-
-        # Connexion à GitHub
-        g = Github(GITHUB_TOKEN)
-        repo = g.get_repo(GITHUB_REPOSITORY)
-        pr = repo.get_pull(int(GITHUB_PR_NUMBER))
+        data = report.model_dump()
 
         # Construction du commentaire
         score = data['score_global']
@@ -503,6 +2589,16 @@ def post_github_pr_comment(report_json: str, change_context: str = "") -> bool:
         # Barre de progression visuelle
         progress_bar = "█" * (score // 2) + "░" * (10 - score // 2)
 
+        # Historique cumulé des reviews de la PR (une ligne par push analysé)
+        previous = context.previous_review
+        history = (previous.history if previous else []) + [
+            {"sha": context.reviewed_sha[:7], "score": score, "lines": context.lines_changed, "scope": context.review_scope}
+        ]
+        history_rows = "\n".join(f"| `{h['sha']}` ({h.get('scope', 'complète')}) | {h['score']}/20 | {h.get('lines', 0)} |" for h in history)
+        total_lines = sum(max(h.get("lines", 0), 1) for h in history)
+        cumulative_score = round(sum(h["score"] * max(h.get("lines", 0), 1) for h in history) / total_lines)
+        state = json.dumps({"last_sha": context.reviewed_sha, "history": history}, separators=(",", ":"))
+
         points_forts = "\n".join([f"- ✅ {p}" for p in data['points_forts'][:5]])
         points_faibles = "\n".join([f"- ⚠️ {p}" for p in data['points_faibles'][:5]])
 
@@ -531,138 +2627,179 @@ def post_github_pr_comment(report_json: str, change_context: str = "") -> bool:
 ### 💡 Conseil du mentor
 {data['conseil_mentor']}
 
+### 📈 Historique des reviews
+
+| Push | Score | Lignes |
+|------|-------|--------|
+{history_rows}
+
+**Score cumulé : {cumulative_score}/20** (pondéré par les lignes modifiées)
+
 ---
-📦 {change_context}
-🤖 Analyse par {MODEL_NAME} • [CulturiaQuests CI/CD](https://github.com/{GITHUB_REPOSITORY}/actions)
+📦 {context.change_context}
+🤖 Analyse par {context.engine} • [CulturiaQuests CI/CD](https://github.com/{GITHUB_REPOSITORY}/actions)
+<!-- {REVIEW_STATE_MARKER} {state} -->
 """
 
-        # Poste le commentaire
-        pr.create_issue_comment(comment_body)
-        print(f"✅ Commentaire posté sur PR #{GITHUB_PR_NUMBER}")
+        # Met à jour le commentaire existant plutôt que d'en ajouter un nouveau à chaque push (une seule requête)
+        if previous:
+            github_request("PATCH", f"/repos/{GITHUB_REPOSITORY}/issues/comments/{previous.comment_id}", json={"body": comment_body})
+            print(f"✅ Commentaire mis à jour sur PR #{context.pr_number}")
+        else:
+            github_request("POST", f"/repos/{GITHUB_REPOSITORY}/issues/{context.pr_number}/comments", json={"body": comment_body})
+            print(f"✅ Commentaire posté sur PR #{context.pr_number}")
         return True
 
-    except GithubException as e:
+    except (OSError, RetryableHTTPError, CircuitOpenError, TimeoutError) as e:
+        # requests.HTTPError (4xx non transitoire) hérite d'OSError
         print(f"❌ Erreur GitHub API: {e}")
         return False
     except Exception as e:
         print(f"❌ Erreur inattendue lors du posting GitHub: {e}")
         return False
 
-if __name__ == "__main__":
-    print("="*60)
-    print("🤖 AI Code Reviewer - CulturiaQuests")
-    print("="*60)
-    
-    # Vérification des variables d'environnement
-    if not API_KEY:
-        print("❌ OPENAI_API_KEY non définie")
-        sys.exit(1)
-    if not DISCORD_WEBHOOK:
-        print("❌ DISCORD_WEBHOOK_URL non définie")
-        sys.exit(1)
-    
-    changed_files = get_changed_files()
-    
-    if not changed_files:
-        print("ℹ️ Aucun fichier de code pertinent modifié.")
-        sys.exit(0)
-
-    # Récupération des informations du commit
-    commit_hash, commit_message, commit_author = get_commit_info()
-    print(f"📌 Commit: {commit_message} ({commit_hash})")
-    print(f"👤 Auteur: {commit_author}")
-
-    print(f"\n📋 Fichiers détectés: {len(changed_files)}")
-    for f in changed_files:
-        print(f"  - {f}")
-    
-    print(f"\n🚀 Analyse IA en cours avec {MODEL_NAME}...\n")
-
-    content_to_analyze = ""
-    total_chars = 0
-    total_added = 0
-    total_deleted = 0
-
-    for file in changed_files:
-        # Récupération du diff au lieu du contenu complet
-        file_diff = get_file_diff(file)
-        stats = get_file_stats(file)
+# Destinations des notifications : (nom, fonction d'envoi, timeout en secondes)
+NOTIFICATION_SINKS = [
+    ("Discord", send_discord_notification, 60),
+    ("GitHub", post_github_pr_comment, 60),
+]
 
-        total_added += stats['added']
-        total_deleted += stats['deleted']
+def run_sink(name: str, send, report: ReviewReport, context: ReviewContext) -> bool:
+    """Exécute une destination en mesurant sa durée propre"""
+    with timed_phase(f"notify_{name.lower()}"):
+        return send(report, context)
 
-        total_chars += len(file_diff)
+def dispatch_notifications(report: ReviewReport, context: ReviewContext) -> Dict[str, bool]:
+    """Envoie le rapport à toutes les destinations en parallèle, chacune avec son propre timeout"""
+    executor = ThreadPoolExecutor(max_workers=len(NOTIFICATION_SINKS))
+    started_at = time.monotonic()
+    futures = [(name, timeout, executor.submit(run_sink, name, send, report, context)) for name, send, timeout in NOTIFICATION_SINKS]
 
-    # Détermine l'ampleur du changement
-    total_changes = total_added + total_deleted
-    if total_changes < 10:
-        change_magnitude = "TRÈS PETIT (ajustement mineur)"
-    elif total_changes < 50:
-        change_magnitude = "PETIT (modification simple)"
-    elif total_changes < 200:
-        change_magnitude = "MOYEN (feature ou refactoring)"
+    results = {}
+    for name, timeout, future in futures:
+        try:
+            results[name] = future.result(timeout=max(started_at + timeout - time.monotonic(), 0))
+        except FutureTimeoutError:
+            print(f"⚠️ Notification {name} abandonnée après {timeout}s")
+            results[name] = False
+        except Exception as e:
+            print(f"❌ Erreur inattendue pour la notification {name}: {e}")
+            results[name] = False
+
+    # Ne bloque pas la fin du script sur une destination qui a dépassé son timeout
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+# --- REVIEW D'UN ÉVÉNEMENT (PUSH OU PR) ---
+def is_superseded(event: ReviewEvent) -> bool:
+    """Vrai (et journalisé) si une tête plus récente de la même branche a été reçue entre-temps"""
+    if event.superseded.is_set():
+        print(f"⏭️ Review de {event.sha[:7] or 'HEAD'} abandonnée : une tête plus récente est en attente")
+        return True
+    return False
+
+def run_review(event: ReviewEvent) -> int:
+    """Review complète d'un push ou d'une PR, notifications comprises ; retourne le code de sortie"""
+    diff_range = get_diff_range(event)
+    head_revision = diff_range[1]
+    if event.is_pull_request:
+        print(f"🔀 Contexte: Pull Request #{event.pr_number} (base: {event.base_ref})")
     else:
-        change_magnitude = "IMPORTANT (refactoring majeur ou nouvelle feature)"
-
-    # En-tête contextuel enrichi
-    content_to_analyze = f"""
-CONTEXTE DU COMMIT :
-Commit: {commit_hash}
-Message: {commit_message}
-Fichiers modifiés: {len(changed_files)}
-Ampleur: {change_magnitude} (+{total_added}/-{total_deleted} lignes)
-
-CONSIGNE D'ÉVALUATION :
-L'ampleur des changements doit influencer ta notation :
-- Changement très petit (<10 lignes) : Si c'est juste cosmétique ou trivial, note 8-12/20. Si c'est un fix critique bien fait, note 13-16/20.
-- Changement petit (10-50 lignes) : Évalue la qualité technique. Code basique: 10-13/20, code solide: 14-16/20.
-- Changement moyen (50-200 lignes) : Potentiel pour excellentes notes si bien architecturé (15-18/20).
-- Changement important (>200 lignes) : Évalue la cohérence globale et l'architecture (12-18/20 selon qualité).
+        print(f"📤 Contexte: Push direct ({diff_range[0][:7]}..{diff_range[1][:7]})")
+    reviewed_sha = ""
+    review_scope = "complète"
+    previous_review = None
 
-INSTRUCTIONS :
-Analyse les changements ci-dessous (format diff git).
-- Les lignes '+' sont des ajouts, les lignes '-' sont des suppressions
-- Évalue la QUALITÉ de ces CHANGEMENTS, pas du fichier complet
-- Sois CRITIQUE et VARIE tes notes selon la vraie qualité
-
-"""
+    # Chemin rapide : git seul décide s'il y a quelque chose à analyser, avant tout import lourd
+    changed_files = get_changed_files(diff_range)
 
-    # Ajout des diffs de chaque fichier
-    for file in changed_files:
-        file_diff = get_file_diff(file)
-        stats = get_file_stats(file)
-
-        content_to_analyze += f"\n{'='*60}\n"
-        content_to_analyze += f"FICHIER: {file}\n"
-        content_to_analyze += f"Lignes ajoutées: +{stats['added']} | Lignes supprimées: -{stats['deleted']}\n"
-        content_to_analyze += f"{'='*60}\n"
-        content_to_analyze += file_diff if file_diff else "[Nouveau fichier ou fichier binaire]\n"
-        content_to_analyze += "\n"
-
-    print(f"📊 Changements détectés: {change_magnitude}")
-    print(f"📊 Détails: +{total_added} / -{total_deleted} lignes sur {len(changed_files)} fichier(s)")
-    print(f"📊 Total à analyser: {total_chars} caractères")
-    
-    # Troncation de sécurité avec logging détaillé
-    if len(content_to_analyze) > MAX_CONTENT_LENGTH:
-        original_length = len(content_to_analyze)
-        content_to_analyze = content_to_analyze[:MAX_CONTENT_LENGTH]
-        truncated_chars = original_length - MAX_CONTENT_LENGTH
-        print(f"⚠️ Contenu tronqué: {truncated_chars} caractères supprimés (limite: {MAX_CONTENT_LENGTH})")
-        print(f"⚠️ Cela représente {(truncated_chars/original_length)*100:.1f}% du contenu total")
-        content_to_analyze += f"\n\n... [TRONQUÉ: {truncated_chars} caractères omis] ..."
-
-    report = analyze_code(content_to_analyze)
-
-    if report:
+    if not changed_files:
+        print("ℹ️ Aucun fichier de code pertinent modifié.")
+        return 0
+
+    if event.is_pull_request:
+        reviewed_sha = resolve_revision(event.sha or "HEAD")
+        previous_review = find_previous_review(event.pr_number) if INCREMENTAL_REVIEW else None
+
+    if previous_review:
+        if previous_review.last_sha == reviewed_sha:
+            print(f"ℹ️ {reviewed_sha[:7]} déjà reviewé, rien de nouveau à analyser.")
+            return 0
+        if is_ancestor(previous_review.last_sha, reviewed_sha):
+            # Seuls les commits poussés depuis la dernière review sont analysés
+            diff_range = [previous_review.last_sha, reviewed_sha]
+            review_scope = f"incrémentale depuis {previous_review.last_sha[:7]}"
+            print(f"🔁 Review incrémentale: {previous_review.last_sha[:7]}..{reviewed_sha[:7]}")
+            changed_files = get_changed_files(diff_range)
+            if not changed_files:
+                print("ℹ️ Aucun fichier de code pertinent modifié depuis la dernière review.")
+                return 0
+        else:
+            print("⚠️ Dernier SHA reviewé absent de l'historique (force push ?), review complète")
+
+    push_commits = list_push_commits(diff_range) if not event.is_pull_request else []
+    commit_reviews: List[RangeReview] = []
+
+    # Mode service : une tête plus récente est arrivée pour cette branche, la review suivante couvrira ces commits
+    if is_superseded(event):
+        return 0
+
+    if PUSH_REVIEW_MODE == "per-commit" and len(push_commits) > 1:
+        # Un rapport par commit, agrégé en une seule notification
+        commit_reviews = review_pushed_commits(push_commits)
+        if not commit_reviews:
+            print("ℹ️ Aucun commit du push ne modifie de fichier de code pertinent.")
+            return 0
+        review = merge_commit_reviews(commit_reviews)
+        review.files = len(changed_files)
+    else:
+        # Récupération des informations du commit
+        with timed_phase("diff_ingestion"):
+            commit_hash, commit_message, commit_author = get_commit_info(head_revision)
+        if len(push_commits) > 1:
+            commit_message = f"{commit_message} (+{len(push_commits) - 1} commit(s))"
+        review = review_changes(changed_files, diff_range, commit_hash, commit_message, commit_author)
+
+    validated_report = review.report
+    total_changes = review.lines_added + review.lines_deleted
+    RUN_METRICS.update(
+        files=review.files, lines_added=review.lines_added, lines_deleted=review.lines_deleted,
+        diff_chars=review.diff_chars, estimated_tokens=review.estimated_tokens,
+        review_scope=review_scope, review_mode=review.review_mode, commits=max(len(push_commits), 1)
+    )
+
+    if validated_report and is_superseded(event):
+        return 0
+
+    if validated_report:
         # Ajout du contexte des changements pour les notifications
-        change_context = f"{len(changed_files)} fichier(s) • +{total_added}/-{total_deleted} lignes"
-
-        # Notification Discord
-        discord_success = send_discord_notification(report, commit_hash, commit_message, commit_author, change_context)
+        change_context = f"{review.files} fichier(s) • +{review.lines_added}/-{review.lines_deleted} lignes"
+        if len(push_commits) > 1:
+            change_context = f"{len(push_commits)} commits • {change_context}"
+        review_context = ReviewContext(
+            commit_hash=review.commit_hash,
+            commit_message=review.commit_message,
+            commit_author=review.commit_author,
+            change_context=change_context,
+            lines_changed=total_changes,
+            reviewed_sha=reviewed_sha,
+            review_scope=review_scope,
+            previous_review=previous_review,
+            commit_reviews=[
+                (r.commit_hash, r.commit_message, r.report.score_global if r.report else None)
+                for r in commit_reviews
+            ],
+            engine=review.engine,
+            pr_number=event.pr_number if event.is_pull_request else ""
+        )
 
-        # Commentaire GitHub (si PR)
-        github_success = post_github_pr_comment(report, change_context)
+        # Discord et commentaire GitHub (si PR) envoyés en parallèle
+        with timed_phase("notify"):
+            results = dispatch_notifications(validated_report, review_context)
+        RUN_METRICS["notifications"] = results
+        event.notified = True
+        discord_success = results["Discord"]
+        github_success = results["GitHub"]
 
         # Récapitulatif
         print("\n" + "="*60)
@@ -673,20 +2810,261 @@ Analyse les changements ci-dessous (format diff git).
 
         if github_success:
             print("✅ Commentaire GitHub posté")
-        elif GITHUB_EVENT_NAME == "pull_request":
+        elif event.is_pull_request:
             print("⚠️ Échec commentaire GitHub")
 
         print("="*60)
 
         # Exit code basé sur le succès de l'analyse (pas des notifications)
-        if discord_success or github_success:
+        if any(results.values()):
             print("✅ Workflow terminé avec succès")
-            sys.exit(0)
+            return 0
         else:
             print("⚠️ Analyse terminée mais échec des notifications")
-            sys.exit(1)
+            return 1
     else:
         print("\n" + "="*60)
         print("❌ Échec de l'analyse IA")
         print("="*60)
-        sys.exit(1)
\ No newline at end of file
+        return 1
+
+# --- MODE SERVICE (WEBHOOKS) ---
+GIT_FETCH_LOCK = threading.Lock()  # Un seul `git fetch` à la fois sur le dépôt local
+
+def event_from_webhook(event_name: str, payload: dict) -> Optional[Tuple[str, ReviewEvent]]:
+    """Clé de coalescence (branche ou PR) et événement à reviewer, None si le payload est ignoré"""
+    if event_name == "push":
+        ref = payload.get("ref") or ""
+        after = payload.get("after") or ""
+        if not ref.startswith("refs/heads/") or payload.get("deleted") or not after.strip("0"):
+            return None
+        branch = ref[len("refs/heads/"):]
+        return f"push:{branch}", ReviewEvent(name="push", sha=after, before=payload.get("before") or "", branch=branch)
+
+    if event_name == "pull_request":
+        pull = payload.get("pull_request") or {}
+        if payload.get("action") not in PR_REVIEW_ACTIONS or pull.get("draft"):
+            return None
+        number = str(pull.get("number") or payload.get("number") or "")
+        head = pull.get("head") or {}
+        base = pull.get("base") or {}
+        if not number or not head.get("sha"):
+            return None
+        return f"pr:{number}", ReviewEvent(
+            name="pull_request", sha=head["sha"], base_ref=base.get("ref") or "", base_sha=base.get("sha") or "",
+            pr_number=number, branch=head.get("ref") or ""
+        )
+    return None
+
+def verify_webhook_signature(body: bytes, signature: str) -> bool:
+    """Signature HMAC SHA-256 du corps, telle qu'envoyée par GitHub"""
+    import hmac
+    expected = "sha256=" + hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+def fetch_event_revisions(event: ReviewEvent) -> None:
+    """Récupère depuis origin les commits de l'événement absents du dépôt local"""
+    missing = [sha for sha in (event.sha, event.before, event.base_sha) if sha.strip("0") and not has_revision(sha)]
+    if not missing:
+        return
+    with GIT_FETCH_LOCK:
+        try:
+            run_git(["fetch", "--quiet", "--no-tags", "origin", *missing])
+        except subprocess.CalledProcessError as e:
+            print(f"⚠️ git fetch impossible pour {', '.join(sha[:7] for sha in missing)}: {e}")
+
+class ReviewService:
+    """File de reviews par branche/PR : une seule review en cours par clé, les têtes intermédiaires sont fusionnées"""
+
+    def __init__(self, workers: int):
+        self.condition = threading.Condition()
+        self.pending: Dict[str, ReviewEvent] = {}  # Ordre d'insertion : première arrivée, première servie
+        self.running: Dict[str, ReviewEvent] = {}
+        self.own_before: Dict[str, str] = {}  # Push en attente : `before` de son propre payload
+        self.counters = {"received": 0, "ignored": 0, "coalesced": 0, "superseded": 0, "completed": 0, "failed": 0}
+        for index in range(workers):
+            threading.Thread(target=self.work, name=f"review-{index + 1}", daemon=True).start()
+
+    def submit(self, key: str, event: ReviewEvent) -> str:
+        """Met l'événement en file ; remplace la review en attente de la même clé et interrompt celle en cours"""
+        with self.condition:
+            self.counters["received"] += 1
+            status = "queued"
+            own_before = event.before
+            pending = self.pending.get(key)
+            if pending:
+                # La review en attente n'a pas démarré : la nouvelle tête la remplace, la plage couvre les deux push
+                self.counters["coalesced"] += 1
+                status = "coalesced"
+                event.before = pending.before or event.before
+                own_before = self.own_before.get(key, own_before)
+            running = self.running.get(key)
+            if running and not running.notified and not running.superseded.is_set():
+                running.superseded.set()
+                self.counters["superseded"] += 1
+                status = "superseding"
+                # Si la review en cours s'arrête, ses commits sont repris par la suivante
+                event.before = running.before or event.before
+            self.pending[key] = event
+            self.own_before[key] = own_before
+            self.condition.notify()
+        return status
+
+    def next_event(self) -> Tuple[str, ReviewEvent]:
+        """Prochaine review dont la clé n'a pas déjà une review en cours (bloquant)"""
+        with self.condition:
+            while True:
+                key = next((k for k in self.pending if k not in self.running), None)
+                if key:
+                    event = self.pending.pop(key)
+                    self.own_before.pop(key, None)
+                    self.running[key] = event
+                    return key, event
+                self.condition.wait()
+
+    def work(self) -> None:
+        while True:
+            key, event = self.next_event()
+            print(f"\n🛰️ Review {key} @ {event.sha[:7]}")
+            try:
+                fetch_event_revisions(event)
+                exit_code = run_review(event)
+            except Exception as e:
+                print(f"❌ Review {key} en échec: {e}")
+                exit_code = 1
+            with self.condition:
+                del self.running[key]
+                self.counters["completed" if exit_code == 0 else "failed"] += 1
+                successor = self.pending.get(key)
+                if successor and event.notified and key in self.own_before:
+                    # Review allée jusqu'aux notifications : la suivante repart de son propre `before`
+                    successor.before = self.own_before[key]
+                self.condition.notify_all()
+
+    def status(self) -> dict:
+        with self.condition:
+            return {
+                "pending": {key: event.sha for key, event in self.pending.items()},
+                "running": {key: event.sha for key, event in self.running.items()},
+                "counters": dict(self.counters),
+                "tokens": dict(TOKEN_USAGE),
+            }
+
+def make_webhook_handler(service: ReviewService):
+    """Handler HTTP : POST d'un webhook GitHub, GET /status pour l'état de la file"""
+    from http.server import BaseHTTPRequestHandler
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.split("?")[0] in ("/status", "/health"):
+                return self.send_json(200, service.status())
+            self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > WEBHOOK_MAX_BODY_BYTES:
+                return self.send_json(413, {"error": "payload trop volumineux"})
+            body = self.rfile.read(length)
+            if WEBHOOK_SECRET and not verify_webhook_signature(body, self.headers.get("X-Hub-Signature-256", "")):
+                return self.send_json(401, {"error": "signature invalide"})
+
+            event_name = self.headers.get("X-GitHub-Event", "")
+            if event_name == "ping":
+                return self.send_json(200, {"status": "pong"})
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                return self.send_json(400, {"error": "JSON invalide"})
+            repository = (payload.get("repository") or {}).get("full_name")
+            if GITHUB_REPOSITORY and repository and repository != GITHUB_REPOSITORY:
+                return self.send_json(422, {"error": f"dépôt inattendu: {repository}"})
+
+            parsed = event_from_webhook(event_name, payload)
+            if not parsed:
+                with service.condition:
+                    service.counters["ignored"] += 1
+                return self.send_json(202, {"status": "ignored"})
+            key, event = parsed
+            self.send_json(202, {"status": service.submit(key, event), "key": key, "sha": event.sha})
+
+    return WebhookHandler
+
+def warm_up_clients() -> None:
+    """Construit une fois pour toutes les clients et schémas réutilisés par chaque review"""
+    started = time.perf_counter()
+    get_openai_client()
+    get_http_session()
+    get_review_text_format()
+    import ai_reviewer_analysis  # noqa: F401 - analyse locale des reviews à venir
+    print(f"🔥 Clients prêts en {time.perf_counter() - started:.2f}s")
+
+def is_loopback_host(host: str) -> bool:
+    """Vrai si l'adresse d'écoute n'est joignable que depuis la machine locale"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def run_service(args: argparse.Namespace) -> int:
+    """Sous-commande serve : reçoit les webhooks et exécute les reviews sur un pool borné"""
+    global RUN_DEADLINE
+    from http.server import ThreadingHTTPServer
+    # Pas d'échéance globale pour un processus long : chaque appel garde ses propres timeouts
+    RUN_DEADLINE = float("inf")
+    if not WEBHOOK_SECRET:
+        # Sans signature, quiconque atteint le port déclenche des git fetch et des appels modèle payants
+        if not is_loopback_host(args.host):
+            print(f"❌ AI_REVIEW_WEBHOOK_SECRET requise pour écouter sur {args.host} (hors boucle locale)")
+            return 1
+        print("⚠️ AI_REVIEW_WEBHOOK_SECRET non définie : signatures des webhooks non vérifiées (écoute locale uniquement)")
+    warm_up_clients()
+
+    service = ReviewService(max(args.workers, 1))
+    server = ThreadingHTTPServer((args.host, args.port), make_webhook_handler(service))
+    host, port = server.server_address[:2]
+    print(f"🛰️ Service en écoute sur http://{host}:{port} ({max(args.workers, 1)} review(s) en parallèle)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Arrêt du service")
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    # Enregistré ici : les processus de l'analyse locale (spawn) réimportent ce module sans écrire de mesures
+    atexit.register(write_metrics)
+    args = parse_args(sys.argv[1:])
+
+    print("="*60)
+    print("🤖 AI Code Reviewer - CulturiaQuests")
+    print("="*60)
+    
+    # Vérification des variables d'environnement
+    if not API_KEY:
+        print("❌ OPENAI_API_KEY non définie")
+        sys.exit(1)
+    if args.command == "backfill":
+        sys.exit(run_backfill(args))
+    if not DISCORD_WEBHOOK:
+        print("❌ DISCORD_WEBHOOK_URL non définie")
+        sys.exit(1)
+    if args.command == "serve":
+        sys.exit(run_service(args))
+
+    sys.exit(run_review(event_from_env()))
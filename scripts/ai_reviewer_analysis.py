@@ -0,0 +1,234 @@
+# scripts/ai_reviewer_analysis.py
+# Analyse locale préalable des fichiers modifiés, exécutée dans un pool de processus par ai_reviewer.py (stdlib uniquement)
+# Sert aussi à retrouver la fonction englobante d'un hunk (contexte étendu du prompt)
+import re
+from typing import Dict, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+LARGE_FUNCTION_LINES = 60  # Taille à partir de laquelle la croissance d'une fonction est signalée
+FUNCTION_GROWTH_LINES = 15  # Lignes nettes ajoutées dans la fonction par le changement
+MAX_DETAIL_CHARS = 80
+
+# Un indice = (chemin, ligne dans la nouvelle version, type, détail)
+Finding = Tuple[str, int, str, str]
+
+# --- MOTIFS ---
+PYTHON_LOOP = re.compile(r"^\s*(?:async\s+)?(?:for|while)\b.*:\s*(?:#.*)?$")
+PYTHON_FUNCTION = re.compile(r"^\s*(?:async\s+)?def\s+(\w+)")
+PYTHON_CLASS = re.compile(r"^\s*class\s+(\w+)")
+
+JS_LOOP = re.compile(r"^\s*(?:\}\s*)?(?:for(?:\s+await)?\s*\(|while\s*\(|do\s*\{?\s*$)|\.forEach\(")
+# Callbacks de tableau : une requête y est répétée (N+1), mais un await n'y est pas séquentiel
+JS_CALLBACK = re.compile(r"\.(?:map|flatMap|filter|reduce|some|every|find)\(\s*(?:async\s*)?(?:\([^)]*\)|\w+)\s*=>")
+JS_FUNCTION = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)"
+    r"|^\s*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*=\s*(?:async\s*)?(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|\w+\s*=>)"
+    r"|^\s*(?:(?:public|private|protected|static|async|get|set)\s+)*(?!(?:if|for|while|switch|catch|return|function)\b)(\w+)\s*\([^;]*\)\s*(?::\s*[^{;]+)?\{\s*$"
+)
+JS_CLASS = re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(\w+)")
+
+# Accès base de données ou réseau (Strapi, Nuxt, fetch/axios ; DB-API, requests, ORM côté Python)
+JS_QUERY = re.compile(
+    r"\bstrapi\.(?:db|entityService|documents|query|service)\b|\$fetch\(|\buseFetch\(|\bfetch\(|\baxios\b"
+    r"|\.(?:findOne|findMany|findFirst|findWithCount|findPage|upsert|query)\("
+)
+PYTHON_QUERY = re.compile(
+    r"\.execute(?:many)?\(|\bsession\.(?:query|get|post|put|execute)\b|\brequests\.(?:get|post|put|patch|delete)\("
+    r"|\.objects\.(?:get|filter|create)\(|\burlopen\("
+)
+AWAIT = re.compile(r"\bawait\b")
+
+SECRET_HINTS = ("key", "secret", "token", "passw", "pwd")  # Préfiltre : la regex complète n'est lancée que sur ces lignes
+SECRET_ASSIGNMENT = re.compile(
+    r"(?i)\b([\w-]*(?:api[_-]?key|secret|token|passw(?:or)?d|pwd|private[_-]?key|access[_-]?key)[\w-]*)['\"]?\s*[:=]\s*['\"]([^'\"\s]{8,})['\"]"
+)
+SECRET_FORMATS = re.compile(
+    r"AKIA[0-9A-Z]{16}|\bsk-[A-Za-z0-9_-]{20,}|\bgh[pousr]_[A-Za-z0-9]{30,}|\bxox[abprs]-[A-Za-z0-9-]{10,}|-----BEGIN [A-Z ]*PRIVATE KEY-----"
+)
+# Valeurs manifestement factices ou lues depuis l'environnement
+PLACEHOLDER = re.compile(r"(?i)^(?:x+|\*+|changeme|example|placeholder|dummy|test|your[_-].*|<.*>|\$\{.*\}|process\.env.*)$")
+
+STRING_LITERAL = re.compile(r"'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|`(?:\\.|[^`\\])*`")
+LINE_COMMENT = re.compile(r"//.*$")
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+# --- LECTURE DU DIFF ---
+def parse_patch_lines(patch: str) -> Tuple[List[int], Dict[int, int]]:
+    """Lignes ajoutées (numérotation de la nouvelle version) et suppressions rattachées à leur position"""
+    added = []
+    deleted: Dict[int, int] = {}
+    line_number = 0
+    in_hunk = False
+    for line in patch.split('\n'):
+        match = HUNK_HEADER.match(line)
+        if match:
+            line_number = int(match.group(1))
+            in_hunk = True
+            continue
+        if not in_hunk or not line:
+            continue
+        if line.startswith('+'):
+            added.append(line_number)
+            line_number += 1
+        elif line.startswith('-'):
+            deleted[line_number] = deleted.get(line_number, 0) + 1
+        elif line.startswith(' '):
+            line_number += 1
+    return added, deleted
+
+# --- BLOCS (BOUCLES, FONCTIONS) ---
+def python_block_end(lines: List[str], start: int) -> int:
+    """Dernière ligne (index) du bloc indenté ouvert à la ligne start"""
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    end = start
+    for index in range(start + 1, len(lines)):
+        text = lines[index]
+        if not text.strip():
+            continue
+        if len(text) - len(text.lstrip()) <= indent:
+            break
+        end = index
+    return end
+
+def strip_code(line: str) -> str:
+    """Retire chaînes et commentaire de fin de ligne avant le comptage des accolades"""
+    return LINE_COMMENT.sub("", STRING_LITERAL.sub('""', line))
+
+def brace_block_end(codes: List[str], start: int) -> int:
+    """Dernière ligne (index) du bloc entre accolades ouvert à la ligne start (ou instruction seule)"""
+    depth = 0
+    parens = 0
+    opened = False
+    for index in range(start, len(codes)):
+        code = codes[index]
+        if not opened and parens == 0 and index > start and code.strip() and not code.strip().startswith('{'):
+            # Boucle sans accolades : une seule instruction
+            return index
+        for char in code:
+            if char == '(':
+                parens += 1
+            elif char == ')':
+                parens -= 1
+            elif char == '{':
+                depth += 1
+                opened = True
+            elif char == '}' and opened:
+                depth -= 1
+                if depth == 0:
+                    return index
+        if index == start and not opened and parens == 0 and code.rstrip().endswith(';'):
+            # Tout tient sur la ligne : items.forEach(x => f(x));
+            return index
+    return len(codes) - 1
+
+def find_blocks(codes: List[str], python: bool) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, int, str]]]:
+    """Boucles (début, fin, type) et fonctions (début, fin, nom) de la nouvelle version du fichier"""
+    loops = []
+    functions = []
+    block_end = python_block_end if python else brace_block_end
+    for index, code in enumerate(codes):
+        if python:
+            if PYTHON_LOOP.match(code):
+                loops.append((index, block_end(codes, index), "loop"))
+            match = PYTHON_FUNCTION.match(code)
+        else:
+            if JS_LOOP.search(code) and not code.lstrip().startswith("} while"):
+                loops.append((index, block_end(codes, index), "loop"))
+            elif JS_CALLBACK.search(code):
+                loops.append((index, block_end(codes, index), "callback"))
+            match = JS_FUNCTION.match(code)
+        if match:
+            name = next(group for group in match.groups() if group)
+            functions.append((index, block_end(codes, index), name))
+    return loops, functions
+
+def find_enclosing_block(lines: List[str], first: int, last: int, python: bool, max_lines: int) -> Optional[Tuple[int, int]]:
+    """Fonction (ou à défaut classe) la plus proche englobant les lignes first à last (index), si elle fait au plus max_lines lignes
+
+    Seule une fenêtre de max_lines lignes autour du hunk est lue : un bloc plus grand ne serait pas retenu."""
+    if first >= len(lines):
+        return None
+    while last > first and not lines[last].strip():
+        last -= 1  # Lignes vides de contexte en fin de hunk : hors de tout bloc
+    low = max(first - max_lines, 0)
+    window = lines[low:min(first + max_lines + 1, len(lines))]
+    codes = window if python else [strip_code(line) for line in window]
+    definitions = (PYTHON_FUNCTION, PYTHON_CLASS) if python else (JS_FUNCTION, JS_CLASS)
+    block_end = python_block_end if python else brace_block_end
+    for index in range(first - low, -1, -1):
+        if not any(pattern.match(codes[index]) for pattern in definitions):
+            continue
+        end = block_end(codes, index)
+        if end + low < last:
+            continue  # Définition voisine, déjà refermée avant le hunk
+        # Le bloc englobant le plus proche est trop grand : ceux qui le contiennent le sont aussi
+        return (index + low, end + low) if end - index < max_lines else None
+    return None
+
+# --- ANALYSE ---
+def shorten(text: str) -> str:
+    text = text.strip()
+    return text if len(text) <= MAX_DETAIL_CHARS else text[:MAX_DETAIL_CHARS - 1] + "…"
+
+def find_secrets(path: str, lines: List[str], added: List[int]) -> List[Finding]:
+    """Littéraux ressemblant à des secrets sur les lignes ajoutées (valeur jamais recopiée)"""
+    findings = []
+    for number in added:
+        if number > len(lines):
+            continue
+        line = lines[number - 1]
+        lowered = line.lower()
+        match = SECRET_ASSIGNMENT.search(line) if any(hint in lowered for hint in SECRET_HINTS) else None
+        if match and not PLACEHOLDER.match(match.group(2)):
+            findings.append((path, number, "secret en clair ?", f"{match.group(1)} = littéral de {len(match.group(2))} caractères"))
+        elif SECRET_FORMATS.search(line):
+            findings.append((path, number, "secret en clair ?", "format de clé reconnu (valeur masquée)"))
+    return findings
+
+def analyze_file(path: str, content: str, patch: str) -> List[Finding]:
+    """Indices de performance et de sécurité sur les lignes ajoutées d'un fichier"""
+    added, deleted = parse_patch_lines(patch)
+    if not added:
+        return []
+    lines = content.split('\n')
+    python = path.endswith('.py')
+    query = PYTHON_QUERY if python else JS_QUERY
+    # Chaînes et commentaires retirés une seule fois (Python : l'indentation suffit, lignes gardées telles quelles)
+    codes = lines if python else [strip_code(line) for line in lines]
+    loops, functions = find_blocks(codes, python)
+    findings = find_secrets(path, lines, added)
+
+    for number in added:
+        index = number - 1
+        if index >= len(lines):
+            continue
+        code = codes[index]
+        enclosing = [(start, end, kind) for start, end, kind in loops if start < index <= end]
+        if not enclosing:
+            continue
+        sequential = [loop for loop in enclosing if loop[2] == "loop"]
+        if query.search(code):
+            findings.append((path, number, "requête dans une boucle (N+1)", shorten(lines[index])))
+        elif sequential and AWAIT.search(code):
+            findings.append((path, number, "await dans une boucle", shorten(lines[index])))
+        if any(start == index for start, _, _ in loops) and sequential:
+            findings.append((path, number, "boucle imbriquée ajoutée", f"profondeur {len(sequential) + 1} : {shorten(lines[index])}"))
+
+    for start, end, name in functions:
+        size = end - start + 1
+        if size < LARGE_FUNCTION_LINES:
+            continue
+        # Numéros de ligne 1-based : la fonction couvre les lignes start + 1 à end + 1
+        growth = sum(1 for number in added if start < number <= end + 1)
+        growth -= sum(count for position, count in deleted.items() if start < position <= end + 1)
+        if growth >= FUNCTION_GROWTH_LINES:
+            findings.append((path, start + 1, "fonction qui grossit", f"{name} : {size} lignes (+{growth})"))
+    return findings
+
+def analyze_file_safe(path: str, content: str, patch: str) -> Optional[List[Finding]]:
+    """Point d'entrée des processus du pool : une erreur d'analyse n'interrompt pas la review"""
+    try:
+        return analyze_file(path, content, patch)
+    except Exception:
+        return None
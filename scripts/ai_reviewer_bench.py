@@ -0,0 +1,601 @@
+# scripts/ai_reviewer_bench.py
+# Banc d'essai hors ligne de ai_reviewer.py : dépôts git synthétiques et faux services HTTP locaux
+#
+# Usage :
+#   python scripts/ai_reviewer_bench.py
+#   python scripts/ai_reviewer_bench.py --scenarios 50-fichiers,5000-lignes --runs 5 --output bench.json
+#   python scripts/ai_reviewer_bench.py --latency openai=1500 --error-rate openai=0.2
+#   python scripts/ai_reviewer_bench.py --compare bench-main.json
+#   python scripts/ai_reviewer_bench.py --scenarios service-3-push --runs 1
+from __future__ import annotations
+import os
+import sys
+import hmac
+import json
+import signal
+import hashlib
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+import urllib.request
+from dataclasses import dataclass, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+
+REVIEWER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai_reviewer.py")
+BENCH_REPOSITORY = "bench/repo"
+BENCH_PR_NUMBER = 1
+BENCH_WEBHOOK_SECRET = "bench"
+# Payloads GitHub enregistrés, partagés avec les tests du mode service
+WEBHOOKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "data", "webhooks")
+SERVICE_TIMEOUT = 120.0  # Démarrage puis vidage de la file du service (s)
+
+# Latences par défaut des faux services (ms)
+DEFAULT_LATENCY_MS = {"openai": 300, "discord": 30, "github": 30}
+RETRY_AFTER_MS = 100  # Délai annoncé sur les erreurs injectées, pour garder des runs courts
+
+PHASES = ["changed_files", "filtering", "diff_ingestion", "prepass", "prompt_build", "model_call", "model_first_token", "parse", "notify"]
+
+# Rapport renvoyé par le faux modèle (conforme à ReviewReport)
+STUB_REPORT = {
+    "score_global": 14,
+    "details": {"SOLID": 13, "Clarte": 15, "Securite": 14, "Performance": 12},
+    "resume": "Changement synthétique généré par le banc d'essai.",
+    "points_forts": ["Fonctions courtes"],
+    "points_faibles": ["Valeurs en dur"],
+    "conseil_mentor": "Extraire les constantes.",
+}
+
+@dataclass
+class Scenario:
+    """Forme du diff à produire : nombre de fichiers, lignes modifiées par fichier, type d'événement
+
+    event="service" lance `ai_reviewer.py serve` et lui envoie un webhook push par commit (pushes commits successifs).
+    """
+    name: str
+    files: int
+    lines_per_file: int
+    event: str = "push"
+    extension: str = ".ts"
+    generated_mb: int = 0
+    pushes: int = 1
+    model_call: bool = True  # Faux : aucun fichier à analyser, le run s'arrête avant le modèle
+
+SCENARIOS = {
+    s.name: s for s in [
+        Scenario("5-fichiers", files=5, lines_per_file=40),
+        Scenario("50-fichiers", files=50, lines_per_file=40),
+        Scenario("5000-lignes", files=5, lines_per_file=1000),
+        Scenario("pr-50-fichiers", files=50, lines_per_file=40, event="pull_request"),
+        Scenario("hors-filtre", files=20, lines_per_file=40, extension=".md", model_call=False),
+        Scenario("fichier-20mo", files=5, lines_per_file=40, generated_mb=20),
+        Scenario("service-3-push", files=5, lines_per_file=40, event="service", pushes=3),
+    ]
+}
+
+# --- DÉPÔTS SYNTHÉTIQUES ---
+def git(repo: str, *args: str) -> str:
+    """Exécute une commande git dans le dépôt synthétique"""
+    return subprocess.run(["git", "-C", repo, *args], check=True, capture_output=True, text=True).stdout.strip()
+
+def render_file(index: int, lines: int, version: int) -> str:
+    """Contenu d'un fichier : chaque ligne change entre la version 0 et la version 1"""
+    return "".join(
+        f"export function handler{index}_{n}(value: number): number {{ return value * {n + version}; }}\n"
+        for n in range(lines)
+    )
+
+def build_repo(scenario: Scenario, root: str) -> str:
+    """Crée un dépôt dont chaque commit après la base produit le diff du scénario"""
+    repo = os.path.join(root, scenario.name)
+    os.makedirs(repo)
+    git(repo, "init", "-q", "-b", "main")
+    git(repo, "config", "user.name", "bench")
+    git(repo, "config", "user.email", "bench@example.com")
+
+    paths = [os.path.join(repo, "src", f"module_{i}{scenario.extension}") for i in range(scenario.files)]
+    os.makedirs(os.path.join(repo, "src"))
+    messages = ["chore: base"] + [f"feat: changement synthétique {n + 1}" for n in range(scenario.pushes)]
+    for version, message in enumerate(messages):
+        for index, path in enumerate(paths):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(render_file(index, scenario.lines_per_file, version))
+        if scenario.generated_mb and version:
+            # Fichier généré ajouté d'un bloc (bundle, fixture) : le diff dépasse largement le budget
+            lines = scenario.generated_mb * 1024 * 1024 // 90
+            with open(os.path.join(repo, "src", f"generated{scenario.extension}"), "w", encoding="utf-8") as f:
+                f.write(render_file(scenario.files, lines, version))
+        git(repo, "add", "-A")
+        git(repo, "commit", "-q", "-m", message)
+
+    if scenario.event == "pull_request":
+        # Base de la PR : le checkout CI fournit origin/<base>
+        git(repo, "update-ref", "refs/remotes/origin/main", "HEAD~1")
+    return repo
+
+# --- FAUX SERVICES HTTP ---
+class StubServices:
+    """Responses API, webhook Discord et API GitHub simulés, avec latence et erreurs injectées"""
+
+    def __init__(self, latency_ms: Dict[str, float], error_rate: Dict[str, float], seed: int, legacy_model: bool = False):
+        self.latency_ms = latency_ms
+        self.legacy_model = legacy_model  # Modèle sans sortie structurée : text.format refusé, JSON entouré de markdown
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.injected_errors: Dict[str, int] = {}
+        self.comments: Dict[int, str] = {}
+        self.prompt_prefixes = set()  # Préfixes déjà vus, pour simuler le cache de prompt du fournisseur
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self) -> None:
+        """Compteurs et commentaires remis à zéro entre deux runs"""
+        with self.lock:
+            self.requests.clear()
+            self.injected_errors.clear()
+            self.comments.clear()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def enter(self, service: str) -> bool:
+        """Compte la requête, applique la latence et décide si une erreur est injectée"""
+        with self.lock:
+            self.requests[service] = self.requests.get(service, 0) + 1
+            failing = self.random.random() < self.error_rate.get(service, 0.0)
+            if failing:
+                self.injected_errors[service] = self.injected_errors.get(service, 0) + 1
+        time.sleep(self.latency_ms.get(service, 0) / 1000)
+        return failing
+
+    def comment(self, comment_id: int) -> dict:
+        return {
+            "id": comment_id,
+            "body": self.comments[comment_id],
+            "user": {"login": "github-actions[bot]", "type": "Bot"},  # Auteur des commentaires postés avec GITHUB_TOKEN
+            "url": f"{self.base_url}/repos/{BENCH_REPOSITORY}/issues/comments/{comment_id}",
+            "html_url": f"{self.base_url}/{BENCH_REPOSITORY}/pull/{BENCH_PR_NUMBER}#issuecomment-{comment_id}",
+        }
+
+    def make_handler(self):
+        stubs = self
+        repo_path = f"/repos/{BENCH_REPOSITORY}"
+        comments_path = f"{repo_path}/issues/{BENCH_PR_NUMBER}/comments"
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def read_body(self) -> dict:
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    return json.loads(raw or b"{}")
+                except ValueError:
+                    return {}
+
+            def send_json(self, status: int, payload=None, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if payload is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def route(self, service: str) -> bool:
+                """Latence et erreur injectée : True si la requête a déjà reçu sa réponse"""
+                if stubs.enter(service):
+                    self.send_json(503, {"message": "injected"}, {"retry-after-ms": str(RETRY_AFTER_MS)})
+                    return True
+                return False
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if self.route("github"):
+                    return
+                if path == repo_path:
+                    return self.send_json(200, {"url": f"{stubs.base_url}{repo_path}", "full_name": BENCH_REPOSITORY, "name": "repo"})
+                if path == f"{repo_path}/pulls/{BENCH_PR_NUMBER}":
+                    return self.send_json(200, {
+                        "number": BENCH_PR_NUMBER,
+                        "url": f"{stubs.base_url}{path}",
+                        "issue_url": f"{stubs.base_url}{repo_path}/issues/{BENCH_PR_NUMBER}",
+                    })
+                if path == comments_path:
+                    with stubs.lock:
+                        return self.send_json(200, [stubs.comment(c) for c in sorted(stubs.comments)])
+                if path.startswith(f"{repo_path}/issues/comments/"):
+                    comment_id = int(path.rsplit("/", 1)[1])
+                    with stubs.lock:
+                        if comment_id in stubs.comments:
+                            return self.send_json(200, stubs.comment(comment_id))
+                self.send_json(404, {"message": "Not Found"})
+
+            def do_PATCH(self):
+                body = self.read_body()
+                if self.route("github"):
+                    return
+                path = self.path.split("?")[0]
+                if path.startswith(f"{repo_path}/issues/comments/"):
+                    comment_id = int(path.rsplit("/", 1)[1])
+                    with stubs.lock:
+                        stubs.comments[comment_id] = body.get("body", "")
+                        return self.send_json(200, stubs.comment(comment_id))
+                self.send_json(404, {"message": "Not Found"})
+
+            def do_POST(self):
+                body = self.read_body()
+                path = self.path.split("?")[0]
+                if path.endswith("/responses"):
+                    if self.route("openai"):
+                        return
+                    if stubs.legacy_model and "text" in body:
+                        return self.send_json(400, {"error": {
+                            "message": "Unsupported parameter: 'text.format' is not supported with this model.",
+                            "type": "invalid_request_error", "param": "text.format", "code": "unsupported_parameter",
+                        }})
+                    return self.send_response_api(body)
+                if path == "/webhook":
+                    if self.route("discord"):
+                        return
+                    return self.send_json(204)
+                if path == comments_path:
+                    if self.route("github"):
+                        return
+                    with stubs.lock:
+                        comment_id = len(stubs.comments) + 1
+                        stubs.comments[comment_id] = body.get("body", "")
+                        return self.send_json(201, stubs.comment(comment_id))
+                self.send_json(404, {"message": "Not Found"})
+
+            def send_response_api(self, body: dict):
+                """Réponse de la Responses API, en un bloc ou en événements SSE selon `stream`"""
+                text = json.dumps(STUB_REPORT, ensure_ascii=False)
+                if stubs.legacy_model:
+                    text = f"```json\n{text}\n```"
+                # Usage approché (~4 caractères par token) ; tous les messages sauf le dernier forment le préfixe
+                # réutilisable, compté en cache à partir du deuxième appel (seuil de 1024 tokens du fournisseur)
+                messages = body.get("input", [])
+                prefix = json.dumps(messages[:-1]) if isinstance(messages, list) else ""
+                input_tokens = len(json.dumps(messages)) // 4
+                output_tokens = len(text) // 4
+                with stubs.lock:
+                    cached = prefix in stubs.prompt_prefixes and len(prefix) // 4 >= 1024
+                    stubs.prompt_prefixes.add(prefix)
+                cached_tokens = len(prefix) // 4 // 128 * 128 if cached else 0
+                response = {
+                    "id": "resp_bench", "object": "response", "created_at": int(time.time()),
+                    "model": body.get("model"), "status": "completed",
+                    "output": [{
+                        "type": "message", "id": "msg_bench", "role": "assistant", "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}],
+                    }],
+                    "usage": {
+                        "input_tokens": input_tokens, "output_tokens": output_tokens,
+                        "total_tokens": input_tokens + output_tokens,
+                        "input_tokens_details": {"cached_tokens": cached_tokens},
+                        "output_tokens_details": {"reasoning_tokens": 0},
+                    },
+                    "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                }
+                if not body.get("stream"):
+                    return self.send_json(200, response)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                events = [("response.created", {"response": {**response, "output": [], "status": "in_progress"}})]
+                events += [
+                    ("response.output_text.delta", {
+                        "delta": text[i:i + 32], "item_id": "msg_bench", "output_index": 0,
+                        "content_index": 0, "logprobs": [],
+                    })
+                    for i in range(0, len(text), 32)
+                ]
+                events.append(("response.completed", {"response": response}))
+                for sequence, (event, data) in enumerate(events):
+                    data = {**data, "type": event, "sequence_number": sequence}
+                    self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+                    self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+# --- EXÉCUTION ---
+def peak_rss_mb(rusage) -> float:
+    """ru_maxrss est en Ko sous Linux, en octets sous macOS"""
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(rusage.ru_maxrss / divisor, 1)
+
+def reviewer_env(scenario: Scenario, repo: str, stubs: StubServices, work_dir: str, streaming: bool) -> Dict[str, str]:
+    """Environnement du reviewer : tous les services pointent vers les faux services locaux"""
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{stubs.base_url}/v1",
+        "DISCORD_WEBHOOK_URL": f"{stubs.base_url}/webhook",
+        "GITHUB_API_URL": stubs.base_url,
+        "GITHUB_TOKEN": "bench",
+        "GITHUB_REPOSITORY": BENCH_REPOSITORY,
+        "GITHUB_EVENT_NAME": scenario.event,
+        "GITHUB_BASE_REF": "main" if scenario.event == "pull_request" else "",
+        "GITHUB_PR_NUMBER": str(BENCH_PR_NUMBER) if scenario.event == "pull_request" else "",
+        "GITHUB_HEAD_SHA": git(repo, "rev-parse", "HEAD"),
+        # Fixés explicitement : sous Actions, ceux du workflow seraient hérités et absents du dépôt synthétique
+        "GITHUB_SHA": git(repo, "rev-parse", "HEAD"),
+        "GITHUB_EVENT_BEFORE": git(repo, "rev-parse", "HEAD~1"),
+        "GITHUB_REF_NAME": "main",
+        "AI_REVIEW_CACHE_DIR": os.path.join(work_dir, "cache"),
+        "AI_REVIEW_METRICS_FILE": os.path.join(work_dir, "metrics.json"),
+        "AI_REVIEW_STREAMING": "true" if streaming else "false",
+        "GITHUB_STEP_SUMMARY": "",  # Le bench lancé en CI ne doit pas écrire dans le résumé du job
+    }
+
+def collect_run(scenario: Scenario, exit_code: int, wall: float, rusage, stubs: StubServices, work_dir: str, log_file: str) -> dict:
+    """Résultat d'un run : mesures écrites par le reviewer à sa sortie et requêtes reçues par les faux services"""
+    metrics = {}
+    metrics_file = os.path.join(work_dir, "metrics.json")
+    if os.path.exists(metrics_file):
+        with open(metrics_file, encoding="utf-8") as f:
+            metrics = json.load(f)
+
+    # Un run sorti en 0 sans rien mesurer (révisions introuvables, diff vide) ne doit pas passer pour un succès
+    problem = None
+    if not any(metrics.get("phases", {}).values()):
+        problem = "aucune phase mesurée"
+    elif scenario.model_call and not stubs.requests.get("openai"):
+        problem = "aucun appel au modèle"
+
+    return {
+        "exit_code": exit_code,
+        "problem": problem,
+        "wall_s": round(wall, 4),
+        "peak_rss_mb": peak_rss_mb(rusage),
+        "phases": metrics.get("phases", {}),
+        "tokens": metrics.get("tokens", {}),
+        "counters": metrics.get("counters", {}),
+        "requests": dict(stubs.requests),
+        "injected_errors": dict(stubs.injected_errors),
+        "log": log_file,
+    }
+
+def run_reviewer(scenario: Scenario, repo: str, stubs: StubServices, work_dir: str, streaming: bool) -> dict:
+    """Lance ai_reviewer.py sur le dépôt synthétique et collecte durées, mémoire et requêtes"""
+    if scenario.event == "service":
+        return run_service(scenario, repo, stubs, work_dir, streaming)
+    log_file = os.path.join(work_dir, "reviewer.log")
+    env = reviewer_env(scenario, repo, stubs, work_dir, streaming)
+
+    stubs.reset()
+    started = time.perf_counter()
+    with open(log_file, "w", encoding="utf-8") as log:
+        process = subprocess.Popen([sys.executable, REVIEWER_SCRIPT], cwd=repo, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 donne la mémoire du seul processus lancé, contrairement à RUSAGE_CHILDREN cumulé
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = exit_code = os.waitstatus_to_exitcode(status)
+    return collect_run(scenario, exit_code, time.perf_counter() - started, rusage, stubs, work_dir, log_file)
+
+# --- MODE SERVICE ---
+def push_payload(before: str, after: str) -> bytes:
+    """Payload push enregistré, réécrit pour le dépôt synthétique"""
+    with open(os.path.join(WEBHOOKS_DIR, "push.json"), encoding="utf-8") as f:
+        payload = json.load(f)
+    payload.update({"ref": "refs/heads/main", "before": before, "after": after})
+    payload["head_commit"]["id"] = payload["commits"][0]["id"] = after
+    payload["repository"]["full_name"] = BENCH_REPOSITORY
+    return json.dumps(payload).encode("utf-8")
+
+def post_webhook(base_url: str, event_name: str, body: bytes) -> dict:
+    """Envoie un webhook signé comme GitHub"""
+    signature = "sha256=" + hmac.new(BENCH_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    request = urllib.request.Request(f"{base_url}/webhook", data=body, method="POST", headers={
+        "Content-Type": "application/json", "X-GitHub-Event": event_name, "X-Hub-Signature-256": signature,
+    })
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+def get_service_status(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/status", timeout=10) as response:
+        return json.load(response)
+
+def wait_for_service_url(log_file: str, process: subprocess.Popen, deadline: float) -> Optional[str]:
+    """Adresse annoncée par le service dans son journal (port choisi par le système)"""
+    marker = "Service en écoute sur "
+    while time.monotonic() < deadline and process.poll() is None:
+        with open(log_file, encoding="utf-8") as f:
+            for line in f:
+                if marker in line:
+                    return line.split(marker, 1)[1].split()[0]
+        time.sleep(0.05)
+    return None
+
+def wait_until_idle(base_url: str, expected: int, deadline: float) -> Optional[dict]:
+    """Attend que tous les webhooks reçus soient traités"""
+    while time.monotonic() < deadline:
+        status = get_service_status(base_url)
+        if status["counters"]["received"] >= expected and not status["pending"] and not status["running"]:
+            return status
+        time.sleep(0.05)
+    return None
+
+def run_service(scenario: Scenario, repo: str, stubs: StubServices, work_dir: str, streaming: bool) -> dict:
+    """Lance `ai_reviewer.py serve`, envoie un push par commit à la suite et mesure jusqu'à la file vide"""
+    log_file = os.path.join(work_dir, "reviewer.log")
+    env = {
+        **reviewer_env(scenario, repo, stubs, work_dir, streaming),
+        "GITHUB_EVENT_NAME": "",  # Les événements arrivent par webhook
+        "AI_REVIEW_WEBHOOK_SECRET": BENCH_WEBHOOK_SECRET,
+    }
+    commits = git(repo, "rev-list", "--reverse", "HEAD").split()
+
+    stubs.reset()
+    deadline = time.monotonic() + SERVICE_TIMEOUT
+    with open(log_file, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(
+            [sys.executable, REVIEWER_SCRIPT, "serve", "--port", "0", "--workers", "1"],
+            cwd=repo, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        status = None
+        try:
+            base_url = wait_for_service_url(log_file, process, deadline)
+            # Chronomètre démarré une fois le service prêt : le démarrage est payé une seule fois par processus
+            started = time.perf_counter()
+            if base_url:
+                for before, after in zip(commits, commits[1:]):
+                    post_webhook(base_url, "push", push_payload(before, after))
+                status = wait_until_idle(base_url, len(commits) - 1, deadline)
+            wall = time.perf_counter() - started
+        finally:
+            # SIGINT : arrêt propre du service, les mesures sont écrites à la sortie
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+            _, exit_status, rusage = os.wait4(process.pid, 0)
+            process.returncode = exit_code = os.waitstatus_to_exitcode(exit_status)
+
+    if not status or status["counters"]["failed"]:
+        exit_code = exit_code or 1
+    run = collect_run(scenario, exit_code, wall, rusage, stubs, work_dir, log_file)
+    run["service"] = status["counters"] if status else {}
+    return run
+
+def summarize(runs: List[dict]) -> dict:
+    """Médianes des runs d'un scénario"""
+    return {
+        "wall_s": round(statistics.median(r["wall_s"] for r in runs), 4),
+        "peak_rss_mb": round(statistics.median(r["peak_rss_mb"] for r in runs), 1),
+        "phases": {
+            phase: round(statistics.median(r["phases"].get(phase, 0.0) for r in runs), 4)
+            for phase in PHASES
+        },
+        "failures": sum(1 for r in runs if r["exit_code"] != 0 or r["problem"]),
+    }
+
+def get_source_revision() -> str:
+    """Commit du dépôt contenant ai_reviewer.py, pour comparer des résultats entre commits"""
+    try:
+        return subprocess.run(
+            ["git", "-C", os.path.dirname(REVIEWER_SCRIPT), "rev-parse", "--short", "HEAD"],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def parse_service_values(values: List[str], defaults: Dict[str, float]) -> Dict[str, float]:
+    """Convertit des options `service=valeur` répétées en dictionnaire"""
+    result = dict(defaults)
+    for value in values:
+        service, _, amount = value.partition("=")
+        if service not in DEFAULT_LATENCY_MS or not amount:
+            raise argparse.ArgumentTypeError(f"Format attendu: {'|'.join(DEFAULT_LATENCY_MS)}=<valeur> (reçu: {value})")
+        result[service] = float(amount)
+    return result
+
+def print_summary(results: Dict[str, dict], baseline: Optional[dict]) -> None:
+    """Tableau des médianes sur stderr, avec l'écart relatif si un fichier de référence est fourni"""
+    columns = ["wall_s", *PHASES, "peak_rss_mb"]
+    print(f"\n{'scénario':<16}" + "".join(f"{c:>18}" for c in columns), file=sys.stderr)
+    for name, result in results.items():
+        summary = result["summary"]
+        values = {"wall_s": summary["wall_s"], "peak_rss_mb": summary["peak_rss_mb"], **summary["phases"]}
+        print(f"{name:<16}" + "".join(f"{values[c]:>18.3f}" for c in columns), file=sys.stderr)
+
+        reference = (baseline or {}).get("results", {}).get(name, {}).get("summary")
+        if reference:
+            ref_values = {"wall_s": reference["wall_s"], "peak_rss_mb": reference["peak_rss_mb"], **reference["phases"]}
+            deltas = [
+                f"{(values[c] - ref_values[c]) / ref_values[c] * 100:+.0f}%" if ref_values.get(c) else "-"
+                for c in columns
+            ]
+            print(f"{'  vs référence':<16}" + "".join(f"{d:>18}" for d in deltas), file=sys.stderr)
+        if summary["failures"]:
+            print(f"  ⚠️ {summary['failures']} run(s) en échec, voir {result['runs'][-1]['log']}", file=sys.stderr)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne de ai_reviewer.py")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Scénarios à exécuter, séparés par des virgules")
+    parser.add_argument("--runs", type=int, default=3, help="Runs par scénario (médiane retenue)")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=MS", help="Latence d'un faux service (openai, discord, github)")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="SERVICE=TAUX", help="Proportion de réponses 503 injectées (0 à 1)")
+    parser.add_argument("--no-stream", action="store_true", help="Désactive le streaming de la Responses API")
+    parser.add_argument("--legacy-model", action="store_true", help="Simule un modèle sans sortie structurée (JSON en markdown)")
+    parser.add_argument("--seed", type=int, default=0, help="Graine de l'injection d'erreurs")
+    parser.add_argument("--output", help="Fichier JSON de résultats (sinon sortie standard)")
+    parser.add_argument("--compare", help="Résultats JSON de référence (autre commit) à comparer")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"Scénario(s) inconnu(s): {', '.join(unknown)} (disponibles: {', '.join(SCENARIOS)})")
+    try:
+        latency = parse_service_values(args.latency, DEFAULT_LATENCY_MS)
+        error_rate = parse_service_values(args.error_rate, {})
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results: Dict[str, dict] = {}
+    stubs = StubServices(latency, error_rate, args.seed, legacy_model=args.legacy_model)
+    try:
+        with tempfile.TemporaryDirectory(prefix="ai-review-bench-") as root:
+            for name in names:
+                scenario = SCENARIOS[name]
+                repo = build_repo(scenario, root)
+                runs = []
+                for run in range(args.runs):
+                    work_dir = os.path.join(root, f"{name}-run{run}")
+                    os.makedirs(work_dir)
+                    runs.append(run_reviewer(scenario, repo, stubs, work_dir, streaming=not args.no_stream))
+                    problem = f", {runs[-1]['problem']}" if runs[-1]["problem"] else ""
+                    print(f"⏱️ {name} #{run + 1}: {runs[-1]['wall_s']:.2f}s (exit {runs[-1]['exit_code']}{problem})", file=sys.stderr)
+                results[name] = {"scenario": asdict(scenario), "runs": runs, "summary": summarize(runs)}
+
+            # Les logs vivent dans le répertoire temporaire : résumé affiché avant sa suppression
+            print_summary(results, baseline)
+    finally:
+        stubs.close()
+
+    for result in results.values():
+        for run in result["runs"]:
+            run.pop("log")
+
+    output = {
+        "revision": get_source_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "runs": args.runs, "latency_ms": latency, "error_rate": error_rate,
+            "streaming": not args.no_stream, "legacy_model": args.legacy_model,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+        print(f"💾 Résultats écrits dans {args.output}", file=sys.stderr)
+    else:
+        json.dump(output, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    return 1 if any(r["summary"]["failures"] for r in results.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# scripts/ai_reviewer_models.py
+# Chargé à la demande par ai_reviewer.py : pydantic n'est importé que lorsqu'un rapport doit être validé
+from typing import List, Optional
+from pydantic import BaseModel, ValidationError, Field, field_validator
+
+# --- VALIDATION SCHÉMA PYDANTIC ---
+class ReviewDetails(BaseModel):
+    SOLID: int = Field(ge=0, le=20)
+    Clarte: int = Field(ge=0, le=20)
+    Securite: int = Field(ge=0, le=20)
+    Performance: int = Field(ge=0, le=20)
+
+class ReviewReport(BaseModel):
+    score_global: int = Field(ge=0, le=20)
+    details: ReviewDetails
+    resume: str = Field(max_length=200)
+    points_forts: List[str] = Field(max_length=5)
+    points_faibles: List[str] = Field(max_length=5)
+    conseil_mentor: str = Field(max_length=300)
+    
+    @field_validator('points_forts', 'points_faibles')
+    @classmethod
+    def validate_list_items(cls, v):
+        if not v:
+            return ["Aucun point identifié"]
+        # Limite la longueur de chaque élément et sanitation
+        return [item[:150].strip() for item in v[:5]]
+    
+    @field_validator('resume', 'conseil_mentor')
+    @classmethod
+    def sanitize_text(cls, v):
+        # Supprime les caractères potentiellement problématiques
+        return v.replace('`', '').replace('*', '').strip()
+
+# --- SCHÉMA JSON DE LA SORTIE STRUCTURÉE ---
+# Mots-clés refusés par le mode strict de la Responses API (longueurs vérifiées ensuite par Pydantic)
+UNSUPPORTED_SCHEMA_KEYWORDS = {"title", "default", "minLength", "maxLength"}
+
+def to_strict_schema(schema: dict, defs: Optional[dict] = None) -> dict:
+    """Adapte un schéma Pydantic au mode strict : références inlinées, objets fermés, tous les champs requis"""
+    if defs is None:
+        defs = schema.get("$defs", {})
+    if "$ref" in schema:
+        return to_strict_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+
+    strict = {}
+    for key, value in schema.items():
+        if key in UNSUPPORTED_SCHEMA_KEYWORDS or key == "$defs":
+            continue
+        if key == "properties":
+            strict[key] = {name: to_strict_schema(prop, defs) for name, prop in value.items()}
+        elif key == "items":
+            strict[key] = to_strict_schema(value, defs)
+        else:
+            strict[key] = value
+
+    if "maxLength" in schema:
+        # La contrainte reste visible du modèle sous forme de description
+        strict["description"] = f"{schema['maxLength']} caractères maximum"
+    if strict.get("type") == "object":
+        strict["additionalProperties"] = False
+        strict["required"] = list(strict.get("properties", {}))
+    return strict
+
+def review_report_json_schema() -> dict:
+    """Schéma strict du rapport, dérivé de ReviewReport et ReviewDetails"""
+    return to_strict_schema(ReviewReport.model_json_schema())
@@ -0,0 +1,6 @@
+# scripts/tests/conftest.py
+# Les scripts ne sont pas un paquet : le dossier scripts/ est ajouté au chemin d'import des tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+# scripts/tests/test_backfill.py
+# Backfill : une rafale de 429 met les workers en pause au lieu de consommer l'historique en échecs
+from types import SimpleNamespace
+
+import ai_reviewer
+
+
+def open_circuit():
+    ai_reviewer.CIRCUIT_STATE["OpenAI"] = [ai_reviewer.CIRCUIT_BREAKER_THRESHOLD, ai_reviewer.time.monotonic()]
+
+
+def test_commit_is_retried_after_circuit_cooldown(monkeypatch):
+    monkeypatch.setattr(ai_reviewer, "CIRCUIT_BREAKER_COOLDOWN", 0.05)
+    monkeypatch.setattr(ai_reviewer, "CIRCUIT_STATE", {})
+    monkeypatch.setattr(ai_reviewer, "RUN_DEADLINE", float("inf"))
+    calls = []
+
+    def review_commit(sha):
+        calls.append(ai_reviewer.get_circuit_cooldown("OpenAI"))
+        if len(calls) == 1:
+            open_circuit()  # Rafale de 429 pendant la première review
+            return SimpleNamespace(report=None)
+        ai_reviewer.CIRCUIT_STATE["OpenAI"] = [0, 0.0]
+        return None
+
+    monkeypatch.setattr(ai_reviewer, "review_commit", review_commit)
+    record = ai_reviewer.backfill_commit("abc")
+    assert record == {"sha": "abc", "skipped": "aucun fichier pertinent"}
+    # Le second essai n'a eu lieu qu'une fois le circuit de nouveau passant
+    assert calls == [0.0, 0.0]
+
+
+def test_failure_without_open_circuit_is_not_retried(monkeypatch):
+    monkeypatch.setattr(ai_reviewer, "CIRCUIT_STATE", {})
+    calls = []
+    monkeypatch.setattr(ai_reviewer, "review_commit", lambda sha: calls.append(sha) or SimpleNamespace(report=None))
+    assert ai_reviewer.backfill_commit("abc") == {"sha": "abc", "error": "aucun rapport valide"}
+    assert calls == ["abc"]
@@ -0,0 +1,14 @@
+# scripts/tests/test_cold_start.py
+# Démarrage à froid : les modules lourds ne sont chargés que par les chemins qui s'en servent
+import os
+import subprocess
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ["openai", "pydantic", "requests", "email.utils", "multiprocessing", "concurrent.futures.process"]
+
+
+def test_import_does_not_load_heavy_modules():
+    code = f"import sys, ai_reviewer; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
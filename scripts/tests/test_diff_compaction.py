@@ -0,0 +1,52 @@
+# scripts/tests/test_diff_compaction.py
+# Compaction des diffs : seules les données littérales sont résumées, jamais le code ni les templates
+import ai_reviewer
+from ai_reviewer import COMPACTION_LITERAL_RUN, FileChange, collapse_literal_runs, compact_changes, is_whitespace_only_hunk
+
+RUN = COMPACTION_LITERAL_RUN + 4
+
+
+def hunk(*lines: str) -> str:
+    return "@@ -1,1 +1,{} @@\n{}\n".format(len(lines), "\n".join(lines))
+
+
+def test_json_literal_run_is_collapsed():
+    result = collapse_literal_runs(hunk(*(f'+  {{"id": {i}, "name": "poi {i}"}},' for i in range(RUN))), "data.ts")
+    assert f"+… [{RUN - 3} lignes de données littérales omises]" in result
+
+
+def test_vue_template_bindings_are_kept():
+    lines = [f'+  <UserRow :user="users[{i}]" @delete="deleteUser({i})" />' for i in range(RUN - 1)]
+    lines.append('+  <div v-html="comment.body" />')
+    result = collapse_literal_runs(hunk(*lines), "app/pages/admin.vue")
+    assert "omises" not in result
+    assert 'v-html="comment.body"' in result
+
+
+def test_attribute_free_tags_in_vue_are_kept():
+    result = collapse_literal_runs(hunk(*(["+<li>", "+</li>"] * RUN)), "app/components/List.vue")
+    assert "omises" not in result
+
+
+def test_tags_with_attributes_outside_vue_are_code():
+    lines = [f'+  <a href="/poi/{i}" onclick="track({i})">' for i in range(RUN)]
+    assert "omises" not in collapse_literal_runs(hunk(*lines), "render.ts")
+
+
+def test_svg_markup_is_data():
+    lines = [f'+  <path d="M{i} 0 L{i} 10" fill="#000"/>' for i in range(RUN)]
+    assert "omises" in collapse_literal_runs(hunk(*lines), "icons.svg")
+
+
+def test_statement_moved_across_context_is_kept(monkeypatch):
+    # `a` est désormais calculé après sa première utilisation : même lignes `-`/`+`, comportement différent
+    moved = "@@ -1,2 +1,2 @@\n-a = compute()\n b = a + 1\n+a = compute()\n"
+    assert not is_whitespace_only_hunk(moved, "calc.js")
+    monkeypatch.setattr(ai_reviewer, "COMPACTION_PASSES", ["whitespace"])
+    change = FileChange("calc.js", patch=f"--- a/calc.js\n+++ b/calc.js\n{moved}")
+    compact_changes([change], ["HEAD~1", "HEAD"])
+    assert "+a = compute()" in change.patch
+
+
+def test_reindent_around_context_is_whitespace():
+    assert is_whitespace_only_hunk("@@ -1,3 +1,3 @@\n-  a();\n+    a();\n b();\n-  c();\n+    c();\n", "x.js")
@@ -0,0 +1,49 @@
+# scripts/tests/test_diff_sections.py
+# Rattachement des sections de `git diff` à leur fichier (chemins avec espaces, renommages, citations)
+from ai_reviewer import get_section_path
+
+
+def test_path_with_space_drops_trailing_tab():
+    section = "diff --git a/my file.ts b/my file.ts\nindex 1..2 100644\n--- a/my file.ts\t\n+++ b/my file.ts\t\n@@ -1 +1 @@\n-a\n+b\n"
+    assert get_section_path(section) == "my file.ts"
+
+
+def test_rename_with_space():
+    section = "diff --git a/old name.ts b/new name.ts\nsimilarity index 90%\nrename from old name.ts\nrename to new name.ts\t\n"
+    assert get_section_path(section) == "new name.ts"
+
+
+def test_quoted_utf8_path():
+    section = 'diff --git "a/\\303\\274 q.ts" "b/\\303\\274 q.ts"\n--- "a/\\303\\274 q.ts"\n+++ "b/\\303\\274 q.ts"\n@@ -1 +1 @@\n'
+    assert get_section_path(section) == "ü q.ts"
+
+
+def test_binary_section_without_plus_lines():
+    assert get_section_path("diff --git a/img.png b/img.png\nBinary files differ\n") == "img.png"
+
+
+def test_single_huge_line_is_capped_per_file(tmp_path, monkeypatch):
+    import subprocess
+    import ai_reviewer
+
+    def git(*args):
+        subprocess.run(["git", *args], cwd=tmp_path, check=True, capture_output=True)
+
+    git("init", "-q")
+    git("-c", "user.email=a@b", "-c", "user.name=t", "commit", "-q", "--allow-empty", "-m", "base")
+    (tmp_path / "bundle.js").write_text("x" * 1_000_000 + "\n")
+    (tmp_path / "z.js").write_text("z\n")
+    git("add", "-A")
+    git("-c", "user.email=a@b", "-c", "user.name=t", "commit", "-q", "-m", "bundle")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ai_reviewer, "MAX_PATCH_BYTES_PER_FILE", 4096)
+    monkeypatch.setattr(ai_reviewer, "MAX_PATCH_BYTES_TOTAL", 64 * 1024)
+    changes = ai_reviewer.get_changed_files(["HEAD~1", "HEAD"])
+    ai_reviewer.load_file_patches(changes, ["HEAD~1", "HEAD"])
+    patches = {change.path: change.patch for change in changes}
+    assert len(patches["bundle.js"]) < 4096 + 100
+    assert "plafond de 4096 octets" in patches["bundle.js"]
+    # Le plafond par fichier ne consomme pas le budget total : le fichier suivant garde son diff
+    assert patches["z.js"].endswith("+z\n")
+    assert [change.path for change in changes if change.truncated] == ["bundle.js"]
@@ -0,0 +1,63 @@
+# scripts/tests/test_model_stream.py
+# Streaming de la Responses API : latences enregistrées dans les mesures, réponse coupée réessayée
+from types import SimpleNamespace
+
+import pytest
+
+import ai_reviewer
+from ai_reviewer import ModelOutputError, ReviewRoute
+
+ROUTE = ReviewRoute(model="gpt-test", effort="low")
+USAGE = SimpleNamespace(input_tokens=10, output_tokens=5)
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    monkeypatch.setattr(ai_reviewer, "PHASE_TIMINGS", {})
+    monkeypatch.setattr(ai_reviewer, "METRIC_COUNTERS", {})
+    monkeypatch.setattr(ai_reviewer, "TOKEN_USAGE", dict.fromkeys(ai_reviewer.TOKEN_USAGE, 0))
+    monkeypatch.setattr(ai_reviewer, "TOKEN_USAGE_BY_MODEL", {})
+
+    def start(*events):
+        fake = FakeStream([SimpleNamespace(**event) for event in events])
+        monkeypatch.setattr(ai_reviewer, "create_review_response", lambda prompt, route, **kwargs: fake)
+        return fake
+    return start
+
+
+def delta(text: str) -> dict:
+    return {"type": "response.output_text.delta", "delta": text}
+
+
+def test_latencies_are_recorded(stream):
+    stream(delta('{"score_global": 12'), delta("}"), {"type": "response.completed", "response": SimpleNamespace(usage=USAGE)})
+    assert ai_reviewer.stream_review_output("p", ROUTE) == '{"score_global": 12}'
+    assert set(ai_reviewer.PHASE_TIMINGS) == {"model_first_token", "model_generation"}
+    assert ai_reviewer.PHASE_TIMINGS["model_first_token"] <= ai_reviewer.PHASE_TIMINGS["model_generation"]
+
+
+def test_incomplete_response_is_retryable(stream):
+    response = SimpleNamespace(usage=USAGE, incomplete_details=SimpleNamespace(reason="max_output_tokens"))
+    fake = stream(delta('{"score_global": 12, "resume": "coup'), {"type": "response.incomplete", "response": response})
+    with pytest.raises(ModelOutputError, match="max_output_tokens") as error:
+        ai_reviewer.stream_review_output("p", ROUTE)
+    assert ai_reviewer.is_retryable_error(error.value)
+    assert fake.closed and ai_reviewer.METRIC_COUNTERS == {"response_incomplete": 1}
+
+
+def test_failed_response_is_retryable(stream):
+    stream({"type": "response.failed", "response": SimpleNamespace(usage=None)})
+    with pytest.raises(ModelOutputError):
+        ai_reviewer.stream_review_output("p", ROUTE)
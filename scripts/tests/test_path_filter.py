@@ -0,0 +1,60 @@
+# scripts/tests/test_path_filter.py
+# Filtre des fichiers : la regex compilée et les pathspecs git doivent suivre les règles d'EXCLUDED_PATTERNS
+import os
+import subprocess
+
+import pytest
+
+from ai_reviewer import EXCLUDED_PATTERNS, PATHSPECS, VALID_EXTENSIONS, should_analyze_file
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "data", "path_filter_corpus.txt")
+
+
+def load_corpus():
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip() and not line.startswith("#")]
+
+
+def reference_filter(filepath: str) -> bool:
+    """Règles d'origine, appliquées motif par motif (spécification du filtre compilé)"""
+    for pattern in EXCLUDED_PATTERNS:
+        if '*' in pattern:
+            if filepath.endswith(pattern.replace('*', '')):
+                return False
+        elif pattern.endswith('/'):
+            if pattern.rstrip('/') in filepath.split('/'):
+                return False
+        elif pattern in filepath:
+            return False
+    return filepath.endswith(VALID_EXTENSIONS)
+
+
+CORPUS = load_corpus()
+
+
+def test_corpus_covers_both_verdicts():
+    verdicts = [reference_filter(path) for path in CORPUS]
+    assert len(CORPUS) >= 500 and any(verdicts) and not all(verdicts)
+
+
+@pytest.mark.parametrize("path", CORPUS)
+def test_compiled_filter_matches_reference(path):
+    assert should_analyze_file(path) == reference_filter(path)
+
+
+def test_pathspecs_match_reference(tmp_path):
+    def git(*args):
+        return subprocess.run(["git", "-c", "core.quotePath=false", *args], cwd=tmp_path, check=True,
+                              capture_output=True, text=True, encoding="utf-8").stdout
+
+    git("init", "-q")
+    git("-c", "user.email=a@b", "-c", "user.name=t", "commit", "-q", "--allow-empty", "-m", "base")
+    for path in CORPUS:
+        full = tmp_path / path
+        full.parent.mkdir(parents=True, exist_ok=True)
+        full.write_text(path, encoding="utf-8")
+    git("add", "-A", "-f")
+    git("-c", "user.email=a@b", "-c", "user.name=t", "commit", "-q", "-m", "corpus")
+
+    listed = set(filter(None, git("diff", "--name-only", "-z", "HEAD~1", "HEAD", "--", *PATHSPECS).split("\0")))
+    assert listed == {path for path in CORPUS if reference_filter(path)}
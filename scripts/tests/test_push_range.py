@@ -0,0 +1,48 @@
+# scripts/tests/test_push_range.py
+# Plage reviewée pour un push : une nouvelle branche couvre tous ses commits, pas seulement le dernier
+import subprocess
+
+import pytest
+
+import ai_reviewer
+from ai_reviewer import ReviewEvent, get_diff_range
+
+NEW_BRANCH = "0" * 40
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """main publié sur origin, puis trois commits sur une branche poussée pour la première fois"""
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], cwd=tmp_path, check=True, capture_output=True, text=True).stdout.strip()
+
+    git("init", "-q", "-b", "main")
+    git("config", "user.email", "a@b")
+    git("config", "user.name", "t")
+    for n in range(2):
+        git("commit", "-q", "--allow-empty", "-m", f"main {n}")
+    git("update-ref", "refs/remotes/origin/main", "HEAD")
+    git("checkout", "-q", "-b", "feat/carte")
+    for n in range(3):
+        git("commit", "-q", "--allow-empty", "-m", f"feat {n}")
+    git("update-ref", "refs/remotes/origin/feat/carte", "HEAD")
+    monkeypatch.chdir(tmp_path)
+    return git
+
+
+def test_new_branch_covers_every_pushed_commit(repo):
+    head, base = repo("rev-parse", "HEAD"), repo("rev-parse", "main")
+    assert get_diff_range(ReviewEvent(sha=head, before=NEW_BRANCH, branch="feat/carte")) == [base, head]
+    assert len(ai_reviewer.list_push_commits([base, head])) == 3
+
+
+def test_new_branch_without_own_commit_reviews_last_commit(repo):
+    repo("checkout", "-q", "main")
+    repo("update-ref", "refs/remotes/origin/copie", "HEAD")
+    head = repo("rev-parse", "HEAD")
+    assert get_diff_range(ReviewEvent(sha=head, before=NEW_BRANCH, branch="copie")) == [repo("rev-parse", "HEAD~1"), head]
+
+
+def test_known_before_is_used(repo):
+    head, before = repo("rev-parse", "HEAD"), repo("rev-parse", "HEAD~2")
+    assert get_diff_range(ReviewEvent(sha=head, before=before, branch="feat/carte")) == [before, head]
@@ -0,0 +1,47 @@
+# scripts/tests/test_retry_policy.py
+# Délais de retry : en-têtes de quota pris en compte seulement quand la requête a été refusée pour quota
+import ai_reviewer
+from ai_reviewer import RETRY_MAX_DELAY, RETRY_MAX_HEADER_DELAY, get_retry_delay
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code: int, headers: dict):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = headers
+
+
+OPENAI_HEADERS = {"x-ratelimit-reset-requests": "8.64s", "x-ratelimit-reset-tokens": "6m0s", "x-ratelimit-remaining-requests": "499"}
+
+
+def test_server_error_ignores_informational_reset_headers():
+    assert get_retry_delay(HTTPError(500, OPENAI_HEADERS), 0) <= ai_reviewer.RETRY_BASE_DELAY
+
+
+def test_server_error_backoff_is_capped():
+    assert get_retry_delay(HTTPError(502, {}), 10) <= RETRY_MAX_DELAY
+
+
+def test_rate_limit_uses_reset_headers():
+    assert get_retry_delay(HTTPError(429, OPENAI_HEADERS), 0) == 8.64
+
+
+def test_retry_after_is_honoured_on_unavailable():
+    assert get_retry_delay(HTTPError(503, {"retry-after": "7"}), 0) == 7
+
+
+def test_retry_after_is_capped():
+    assert get_retry_delay(HTTPError(429, {"retry-after": "3600"}), 0) == RETRY_MAX_HEADER_DELAY
+
+
+def test_github_quota_reset_only_when_exhausted():
+    import time
+    headers = {"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(time.time() + 30)}
+    assert 25 < get_retry_delay(HTTPError(403, headers), 0) <= 30
+    assert get_retry_delay(HTTPError(500, headers), 0) <= ai_reviewer.RETRY_BASE_DELAY
+
+
+def test_retry_after_http_date():
+    import time
+    from email.utils import formatdate
+    assert 15 < get_retry_delay(HTTPError(503, {"retry-after": formatdate(time.time() + 20, usegmt=True)}), 0) <= 20
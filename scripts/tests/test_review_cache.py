@@ -0,0 +1,17 @@
+# scripts/tests/test_review_cache.py
+# Clé du cache des reviews : un rapport n'est réutilisé que pour le même diff, le même modèle et le même effort
+from ai_reviewer import FileChange, ReviewRoute, compute_cache_key
+
+CHANGES = [FileChange("a.py", 1, 1, patch="@@ -1 +1 @@\n-a = 1\n+a = 2\n")]
+
+
+def test_same_route_gives_same_key():
+    assert compute_cache_key(CHANGES, ReviewRoute("m", "low")) == compute_cache_key(CHANGES, ReviewRoute("m", "low"))
+
+
+def test_model_is_part_of_the_key():
+    assert compute_cache_key(CHANGES, ReviewRoute("light", "low")) != compute_cache_key(CHANGES, ReviewRoute("full", "low"))
+
+
+def test_effort_is_part_of_the_key():
+    assert compute_cache_key(CHANGES, ReviewRoute("m", "low")) != compute_cache_key(CHANGES, ReviewRoute("m", "medium"))
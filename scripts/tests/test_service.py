@@ -0,0 +1,133 @@
+# scripts/tests/test_service.py
+# Mode service : payloads GitHub enregistrés, signature des webhooks et refus d'écouter hors boucle locale sans secret
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import ai_reviewer
+
+WEBHOOKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "webhooks")
+SECRET = "s3cret"
+
+
+def load_payload(name: str) -> dict:
+    with open(os.path.join(WEBHOOKS_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def test_push_payload():
+    payload = load_payload("push")
+    key, event = ai_reviewer.event_from_webhook("push", payload)
+    assert key == "push:main"
+    assert (event.name, event.sha, event.before, event.branch) == ("push", payload["after"], payload["before"], "main")
+
+
+def test_pull_request_payload():
+    payload = load_payload("pull_request")
+    key, event = ai_reviewer.event_from_webhook("pull_request", payload)
+    assert key == "pr:57"
+    assert (event.sha, event.base_ref, event.base_sha, event.branch) == (
+        payload["pull_request"]["head"]["sha"], "main", payload["pull_request"]["base"]["sha"], "feat/map-clusters"
+    )
+
+
+@pytest.mark.parametrize("change", [
+    {"ref": "refs/tags/v1.2.0"},
+    {"deleted": True, "after": "0" * 40},
+])
+def test_ignored_pushes(change):
+    assert ai_reviewer.event_from_webhook("push", {**load_payload("push"), **change}) is None
+
+
+@pytest.mark.parametrize("change", [{"action": "closed"}, {"action": "labeled"}])
+def test_ignored_pull_request_actions(change):
+    assert ai_reviewer.event_from_webhook("pull_request", {**load_payload("pull_request"), **change}) is None
+
+
+def test_draft_pull_request_is_ignored():
+    payload = load_payload("pull_request")
+    payload["pull_request"]["draft"] = True
+    assert ai_reviewer.event_from_webhook("pull_request", payload) is None
+
+
+def test_signature(monkeypatch):
+    monkeypatch.setattr(ai_reviewer, "WEBHOOK_SECRET", SECRET)
+    body = json.dumps(load_payload("push")).encode("utf-8")
+    assert ai_reviewer.verify_webhook_signature(body, sign(body))
+    assert not ai_reviewer.verify_webhook_signature(body, sign(body, "autre"))
+    assert not ai_reviewer.verify_webhook_signature(body + b" ", sign(body))
+    assert not ai_reviewer.verify_webhook_signature(body, "")
+
+
+@pytest.fixture
+def service_url(monkeypatch):
+    """Handler réel sur un port libre ; sans worker, les événements restent en file"""
+    monkeypatch.setattr(ai_reviewer, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(ai_reviewer, "GITHUB_REPOSITORY", "culturia/culturiaquests")
+    service = ai_reviewer.ReviewService(0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ai_reviewer.make_webhook_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url: str, event_name: str, payload: dict, signature=None):
+    body = json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-GitHub-Event": event_name,
+        "X-Hub-Signature-256": sign(body) if signature is None else signature,
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_recorded_payloads_through_handler(service_url):
+    assert post(service_url, "ping", load_payload("ping")) == (200, {"status": "pong"})
+    assert post(service_url, "push", load_payload("push"), signature="sha256=00")[0] == 401
+
+    first = load_payload("push")
+    second = {**first, "before": first["after"], "after": "5b0e1f3c9a7d2e4f6a8b0c1d3e5f7a9b1c3d5e7f"}
+    assert post(service_url, "push", first)[1]["status"] == "queued"
+    assert post(service_url, "push", second)[1]["status"] == "coalesced"
+    assert post(service_url, "pull_request", load_payload("pull_request"))[1] == {
+        "status": "queued", "key": "pr:57", "sha": "c7e9b1d3f5a2c4e6b8d0f1a3c5e7b9d1f3a5c7e9"
+    }
+    assert post(service_url, "push", {**first, "repository": {"full_name": "autre/depot"}})[0] == 422
+
+    with urllib.request.urlopen(f"{service_url}/status", timeout=5) as response:
+        status = json.load(response)
+    # Les deux push fusionnés couvrent toute la plage : tête du second, base du premier
+    assert status["pending"] == {"push:main": second["after"], "pr:57": "c7e9b1d3f5a2c4e6b8d0f1a3c5e7b9d1f3a5c7e9"}
+    assert status["counters"]["received"] == 3 and status["counters"]["coalesced"] == 1
+
+
+@pytest.mark.parametrize("host", ["0.0.0.0", "::", "192.168.1.20", "review.example.com"])
+def test_serve_refuses_public_host_without_secret(monkeypatch, host):
+    monkeypatch.setattr(ai_reviewer, "WEBHOOK_SECRET", "")
+    monkeypatch.setattr(ai_reviewer, "warm_up_clients", lambda: pytest.fail("le service ne doit pas démarrer"))
+    assert ai_reviewer.run_service(argparse.Namespace(host=host, port=0, workers=1)) == 1
+
+
+@pytest.mark.parametrize("host,expected", [
+    ("127.0.0.1", True), ("127.0.0.53", True), ("::1", True), ("localhost", True),
+    ("0.0.0.0", False), ("10.0.0.1", False), ("example.com", False),
+])
+def test_is_loopback_host(host, expected):
+    assert ai_reviewer.is_loopback_host(host) is expected
@@ -0,0 +1,70 @@
+# scripts/tests/test_trivial_changes.py
+# Chemin rapide local : seuls les diffs réellement cosmétiques échappent à l'appel au modèle
+from ai_reviewer import FileChange, classify_trivial_change, is_whitespace_only_hunk
+
+
+def change(path: str, *lines: str) -> FileChange:
+    body = "".join(f"{line}\n" for line in lines)
+    return FileChange(path, patch=f"--- a/{path}\n+++ b/{path}\n@@ -1,{len(lines)} +1,{len(lines)} @@\n{body}")
+
+
+def test_reindented_js_is_whitespace():
+    assert classify_trivial_change([change("a.js", "-  foo();  ", "+    foo();", "+")]) == "whitespace"
+
+
+def test_python_dedent_is_not_whitespace():
+    assert classify_trivial_change([change("a.py", " if a:", "-    return 1", "+return 1")]) is None
+
+
+def test_yaml_indentation_is_not_whitespace():
+    assert classify_trivial_change([change("c.yml", " services:", "-  web: 1", "+web: 1")]) is None
+
+
+def test_space_inside_string_is_not_whitespace():
+    assert classify_trivial_change([change("a.py", '-x = "a b"', '+x = "ab"')]) is None
+
+
+def test_joined_lines_are_not_whitespace():
+    assert not is_whitespace_only_hunk("@@ -1,2 +1 @@\n-return\n-x\n+returnx\n", "a.js")
+
+
+def test_trailing_whitespace_in_python_is_whitespace():
+    assert classify_trivial_change([change("a.py", "-    x = 1  ", "+    x = 1")]) == "whitespace"
+
+
+def test_star_continuation_outside_block_comment_is_code():
+    assert classify_trivial_change([change("a.js", " const total = price", "-  * 2;", "+  * 3;")]) is None
+
+
+def test_star_line_inside_block_comment_is_comment():
+    lines = (" /**", "- * Ancienne description", "+ * Nouvelle description", " */")
+    assert classify_trivial_change([change("a.ts", *lines)]) == "comments"
+
+
+def test_block_comment_closed_then_code_is_code():
+    assert classify_trivial_change([change("a.js", "-/* a */ run(1);", "+/* a */ run(2);")]) is None
+
+
+def test_line_comments_are_comments():
+    assert classify_trivial_change([change("a.py", "-# ancien", "+# nouveau")]) == "comments"
+
+
+def test_php_attribute_is_not_a_comment():
+    assert classify_trivial_change([change("a.php", "-#[Route('/a')]", "+#[Route('/b')]")]) is None
+
+
+def test_vue_html_comment_block():
+    lines = (" <!--", "-  ancien texte", "+  nouveau texte", " -->")
+    assert classify_trivial_change([change("a.vue", *lines)]) == "comments"
+
+
+def test_statement_moved_across_context_is_not_trivial():
+    moved = change("a.js", "-const a = compute();", " const b = a + 1;", "+const a = compute();")
+    assert classify_trivial_change([moved]) is None
+
+
+def test_truncated_patch_is_not_trivial():
+    # Seuls les premiers hunks ont été lus : la suite du fichier peut changer le comportement
+    reindented = change("a.js", "-  foo();", "+    foo();")
+    reindented.truncated = True
+    assert classify_trivial_change([reindented]) is None